@@ -19,14 +19,20 @@ a = Analysis(
         'waitress.server',
         'waitress.task',
         'uniplus_handler',
+        'uniplus_session',
         'product_sync',
         'agent',
         'db',
         'printer_service',
+        'printer_monitor',
+        'print_pools',
+        'ipp_client',
         'receipt_formatter',
         'error_recovery',
         'notifications',
         'pos_print_worker',
+        'retention',
+        'receipt_layout',
         'tray',
         # Windows (ignorados no Linux se o pacote não existir)
         'win32print',
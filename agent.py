@@ -8,6 +8,7 @@ import time
 from datetime import datetime
 
 import db
+from printer_monitor import printer_monitor, start_printer_monitor
 from printer_service import PrinterService
 from receipt_formatter import format_order_receipt
 from error_recovery import (
@@ -49,10 +50,18 @@ _active_websockets_lock = threading.Lock()
 PRINTER_RECOVERY_WAIT_SECONDS = 90
 PRINTER_RECOVERY_CHECK_INTERVAL = 5
 PRINT_DRAIN_SECONDS = 120
+# Job que espera mais que isso na fila da impressora volta como erro para o SaaS
+PRINT_JOB_DEADLINE_SECONDS = 600
+# Backpressure no loop WebSocket: não segurar o on_message por muito tempo
+PRINT_JOB_QUEUE_WAIT_SECONDS = 10
 
 _device_drain_lock = threading.Lock()
 _device_drain_until = {}
 
+# Jobs esperando a impressora de rede voltar, fora da fila dela (chave -> jobs em ordem)
+_recovery_lock = threading.Lock()
+_recovery_pending = {}
+
 # WebSocket: não verificar certificado SSL (evita CERTIFICATE_VERIFY_FAILED com servidor com cert autoassinado).
 SSLOPT_WS = {"cert_reqs": ssl.CERT_NONE}
 
@@ -133,6 +142,15 @@ def _close_all_websockets():
             pass
 
 
+def _on_ws_url_change(changes: dict):
+    """URL do SaaS mudou: derruba as conexões para reconectarem no endereço novo."""
+    _log("INFO", "ws_url alterada na configuração. Reconectando WebSockets...")
+    _close_all_websockets()
+
+
+db.subscribe_config(_on_ws_url_change, keys=("ws_url",))
+
+
 def _start_device_drain(device_id: str, seconds: int = PRINT_DRAIN_SECONDS):
     did = (device_id or "").strip().lower()
     if not did:
@@ -345,44 +363,6 @@ def _handle_print_job(ws, job_id: int, conteudo: dict, printer_config: dict):
     else:
         _log("INFO", f"Job {job_id}: Processando na impressora device_id={device_id}, ip={printer_ip}:{printer_port}")
 
-    # Para impressora de rede, aguardar reconexÃ£o por um tempo antes de falhar o job.
-    if connection_type == "network":
-        start_wait = time.time()
-        while not _should_stop and not ConnectionHealthChecker.check_printer_connection(printer_ip, printer_port):
-            if _is_device_draining(device_id) or is_print_draining_for_config(latest_config):
-                msg = "Marcado como impresso (fila limpa)"
-                db.add_print_log(job_id, "done", msg)
-                _ack_print_done(ws, job_id, msg)
-                _log("INFO", f"Job {job_id}: {msg} device_id={device_id}")
-                return
-            elapsed = int(time.time() - start_wait)
-            if elapsed >= PRINTER_RECOVERY_WAIT_SECONDS:
-                error_msg = (
-                    f"Impressora {printer_ip}:{printer_port} nÃ£o voltou em "
-                    f"{PRINTER_RECOVERY_WAIT_SECONDS}s"
-                )
-                _log("ERROR", f"Job {job_id}: {error_msg}")
-                db.add_print_log(job_id, "error", error_msg)
-                notify_print_failure(
-                    error_msg,
-                    protocol=(conteudo or {}).get("protocol") or "",
-                    job_id=job_id,
-                )
-                try:
-                    ws.send(json.dumps({"event": "ack", "job_id": job_id, "status": "error", "message": error_msg}))
-                except Exception:
-                    pass
-                return
-
-            _log(
-                "WARN",
-                f"Job {job_id}: impressora indisponÃ­vel ({printer_ip}:{printer_port}), aguardando retorno..."
-            )
-            time.sleep(PRINTER_RECOVERY_CHECK_INTERVAL)
-            latest_config = _get_latest_printer_config(device_id) or latest_config
-            printer_ip = latest_config.get("printer_ip", printer_ip)
-            printer_port = int(latest_config.get("printer_port") or printer_port)
-
     printer = PrinterService(
         printer_ip=printer_ip,
         printer_port=printer_port,
@@ -421,86 +401,233 @@ def _handle_print_job(ws, job_id: int, conteudo: dict, printer_config: dict):
         def _print_with_retry():
             return printer.print_receipt(receipt)
 
-        success = _print_with_retry()
-
-        status = "done" if success else "error"
-        protocol = (conteudo or {}).get("protocol") or ""
-        message = "" if success else "Falha ao imprimir após múltiplas tentativas"
-        if success and protocol:
-            message = f"Impresso protocol={protocol}"
-        elif not success and protocol:
-            message = f"{message} protocol={protocol}"
-
-        # Detalhe específico de PRINT (não misturar com layout UniPlus na UI de logs)
-        customer = (receipt or {}).get("customer") or {}
-        items_flat = []
-        for grupo, items in ((receipt or {}).get("items_by_group") or {}).items():
-            for it in items or []:
-                items_flat.append(
-                    {
-                        "grupo": grupo,
-                        "nome": it.get("name"),
-                        "qtd": it.get("quantity"),
-                        "total": it.get("total"),
-                    }
-                )
-        print_detail = {
-            "kind": "print",
-            "protocol": protocol or None,
-            "formResponseId": (conteudo or {}).get("formResponseId")
-            or (conteudo or {}).get("form_response_id"),
-            "formName": (receipt or {}).get("form_name"),
-            "cliente": customer.get("name") or None,
-            "telefone": customer.get("phone") or None,
-            "email": customer.get("email") or None,
-            "tableNumber": (receipt or {}).get("table_number") or None,
-            "garcomName": (receipt or {}).get("garcom_name") or None,
-            "valortotal": (receipt or {}).get("total"),
-            "valorentrega": (receipt or {}).get("delivery_fee"),
-            "subtotal": (receipt or {}).get("subtotal"),
-            "itens_count": len(items_flat),
-            "itens": items_flat[:40],
-            "device_id": device_id,
-            "connection_type": connection_type,
-            "printer_ip": printer_ip if connection_type == "network" else None,
-            "printer_name_local": latest_config.get("printer_name_local")
-            if connection_type == "local"
-            else None,
-        }
+        def _finish(success):
+            status = "done" if success else "error"
+            protocol = (conteudo or {}).get("protocol") or ""
+            message = "" if success else "Falha ao imprimir após múltiplas tentativas"
+            if success and protocol:
+                message = f"Impresso protocol={protocol}"
+            elif not success and protocol:
+                message = f"{message} protocol={protocol}"
+
+            # Detalhe específico de PRINT (não misturar com layout UniPlus na UI de logs)
+            customer = (receipt or {}).get("customer") or {}
+            items_flat = []
+            for grupo, items in ((receipt or {}).get("items_by_group") or {}).items():
+                for it in items or []:
+                    items_flat.append(
+                        {
+                            "grupo": grupo,
+                            "nome": it.get("name"),
+                            "qtd": it.get("quantity"),
+                            "total": it.get("total"),
+                        }
+                    )
+            print_detail = {
+                "kind": "print",
+                "protocol": protocol or None,
+                "formResponseId": (conteudo or {}).get("formResponseId")
+                or (conteudo or {}).get("form_response_id"),
+                "formName": (receipt or {}).get("form_name"),
+                "cliente": customer.get("name") or None,
+                "telefone": customer.get("phone") or None,
+                "email": customer.get("email") or None,
+                "tableNumber": (receipt or {}).get("table_number") or None,
+                "garcomName": (receipt or {}).get("garcom_name") or None,
+                "valortotal": (receipt or {}).get("total"),
+                "valorentrega": (receipt or {}).get("delivery_fee"),
+                "subtotal": (receipt or {}).get("subtotal"),
+                "itens_count": len(items_flat),
+                "itens": items_flat[:40],
+                "device_id": device_id,
+                "connection_type": connection_type,
+                "printer_ip": printer_ip if connection_type == "network" else None,
+                "printer_name_local": latest_config.get("printer_name_local")
+                if connection_type == "local"
+                else None,
+            }
+
+            db.add_print_log(
+                job_id,
+                status,
+                message,
+                kind="print",
+                detail=print_detail,
+            )
+            ack = {"event": "ack", "job_id": job_id, "status": status}
+            if message:
+                ack["message"] = message
 
-        db.add_print_log(
-            job_id,
-            status,
-            message,
-            kind="print",
-            detail=print_detail,
-        )
-        ack = {"event": "ack", "job_id": job_id, "status": status}
-        if message:
-            ack["message"] = message
+            try:
+                ws.send(json.dumps(ack))
+            except Exception as e:
+                _log("ERROR", f"Erro ao enviar ACK para job {job_id}: {e}")
+
+            if success:
+                _log("INFO", f"Job {job_id} impresso com sucesso na impressora device_id={device_id}")
+            else:
+                _log("ERROR", f"Job {job_id} falhou na impressora device_id={device_id}: {message}")
+                notify_print_failure(message, protocol=protocol, job_id=job_id)
+                if connection_type == "network":
+                    # Envio falhou: o monitor confirma o estado já, sem esperar o intervalo
+                    printer_monitor().request_probe(latest_config)
+
+        if printer.can_coalesce():
+            # Cupom vai pronto para a fila da impressora e pode sair junto com os
+            # próximos; ACK e log deste job rodam quando a escrita terminar.
+            def _on_sent(success):
+                try:
+                    _finish(success)
+                except Exception as e:
+                    _fail_print_job(ws, job_id, conteudo, device_id, e)
 
-        try:
-            ws.send(json.dumps(ack))
-        except Exception as e:
-            _log("ERROR", f"Erro ao enviar ACK para job {job_id}: {e}")
+            printer.submit_receipt(receipt, _on_sent)
+            return
 
-        if success:
-            _log("INFO", f"Job {job_id} impresso com sucesso na impressora device_id={device_id}")
-        else:
-            _log("ERROR", f"Job {job_id} falhou na impressora device_id={device_id}: {message}")
-            notify_print_failure(message, protocol=protocol, job_id=job_id)
+        _finish(_print_with_retry())
     except Exception as e:
-        _log("ERROR", f"Job {job_id} erro na impressora device_id={device_id}: {str(e)}")
-        db.add_print_log(job_id, "error", str(e))
-        notify_print_failure(
-            str(e),
-            protocol=(conteudo or {}).get("protocol") or "",
-            job_id=job_id,
+        _fail_print_job(ws, job_id, conteudo, device_id, e)
+
+
+def _fail_print_job(ws, job_id: int, conteudo: dict, device_id: str, e: Exception):
+    _log("ERROR", f"Job {job_id} erro na impressora device_id={device_id}: {str(e)}")
+    db.add_print_log(job_id, "error", str(e))
+    notify_print_failure(
+        str(e),
+        protocol=(conteudo or {}).get("protocol") or "",
+        job_id=job_id,
+    )
+    try:
+        ws.send(json.dumps({"event": "ack", "job_id": job_id, "status": "error", "message": str(e)}))
+    except Exception:
+        pass
+
+
+def _reject_print_job(ws, job_id: int, conteudo: dict, error_msg: str):
+    _log("ERROR", f"Job {job_id}: {error_msg}")
+    db.add_print_log(job_id, "error", error_msg)
+    notify_print_failure(
+        error_msg,
+        protocol=(conteudo or {}).get("protocol") or "",
+        job_id=job_id,
+    )
+    try:
+        ws.send(json.dumps({"event": "ack", "job_id": job_id, "status": "error", "message": error_msg}))
+    except Exception:
+        pass
+
+
+def _dispatch_print_job(ws, job_id: int, conteudo: dict, printer_config: dict):
+    """
+    Enfileira o job no worker da impressora (sem thread nova por job). Impressora de
+    rede que não está online espera fora da fila (_await_printer_recovery): a espera
+    de reconexão não trava a fila nem os jobs das outras impressoras.
+    """
+    from printer_service import printer_key_for_config
+
+    device_id = (printer_config.get("device_id") or "").strip()
+    latest_config = _get_latest_printer_config(device_id) or printer_config
+    key = tuple(printer_key_for_config(latest_config))
+    if (latest_config.get("connection_type") or "network") == "network":
+        with _recovery_lock:
+            pending = _recovery_pending.get(key)
+            if pending is not None:
+                # Já tem job esperando esta impressora: entra atrás dele (mantém a ordem)
+                pending.append((ws, job_id, conteudo, printer_config, time.monotonic() + PRINTER_RECOVERY_WAIT_SECONDS))
+                return
+            if printer_monitor().is_up(latest_config) is not True:
+                _recovery_pending[key] = [
+                    (ws, job_id, conteudo, printer_config, time.monotonic() + PRINTER_RECOVERY_WAIT_SECONDS)
+                ]
+                threading.Thread(
+                    target=_await_printer_recovery,
+                    args=(key, latest_config),
+                    name=f"print-recovery-{latest_config.get('printer_ip') or key[0]}",
+                    daemon=True,
+                ).start()
+                return
+    _submit_print_job(ws, job_id, conteudo, printer_config, key)
+
+
+def _await_printer_recovery(key, cfg: dict):
+    """
+    Espera a impressora voltar (quem sonda é o monitor) e então enfileira os jobs
+    pendentes na ordem de chegada. Cada job desiste após PRINTER_RECOVERY_WAIT_SECONDS;
+    a cada intervalo confere fila limpa e config.
+    """
+    from printer_service import is_print_draining_for_config
+
+    warned = False
+    while True:
+        with _recovery_lock:
+            pending = _recovery_pending.get(key) or []
+            next_deadline = min((job[4] for job in pending), default=time.monotonic())
+        up = _should_stop or printer_monitor().wait_until_up(
+            cfg,
+            timeout=max(0.0, min(PRINTER_RECOVERY_CHECK_INTERVAL, next_deadline - time.monotonic())),
         )
-        try:
-            ws.send(json.dumps({"event": "ack", "job_id": job_id, "status": "error", "message": str(e)}))
-        except Exception:
-            pass
+        drained, expired = [], []
+        with _recovery_lock:
+            pending = _recovery_pending.get(key) or []
+            if up:
+                _recovery_pending.pop(key, None)
+                ready = pending
+                break
+            now = time.monotonic()
+            keep = []
+            for job in pending:
+                device_id = (job[3].get("device_id") or "").strip()
+                if _is_device_draining(device_id) or is_print_draining_for_config(cfg):
+                    drained.append(job)
+                elif now >= job[4]:
+                    expired.append(job)
+                else:
+                    keep.append(job)
+            pending[:] = keep
+            if not keep:
+                _recovery_pending.pop(key, None)
+        printer_addr = f"{cfg.get('printer_ip')}:{cfg.get('printer_port')}"
+        for ws, job_id, _conteudo, job_cfg, _until in drained:
+            msg = "Marcado como impresso (fila limpa)"
+            db.add_print_log(job_id, "done", msg)
+            _ack_print_done(ws, job_id, msg)
+            _log("INFO", f"Job {job_id}: {msg} device_id={job_cfg.get('device_id')}")
+        for ws, job_id, conteudo, _job_cfg, _until in expired:
+            _reject_print_job(
+                ws,
+                job_id,
+                conteudo,
+                f"Impressora {printer_addr} não voltou em {PRINTER_RECOVERY_WAIT_SECONDS}s",
+            )
+        if not keep:
+            return
+        if not warned:
+            _log("WARN", f"Impressora indisponível ({printer_addr}), {len(keep)} job(s) aguardando retorno...")
+            warned = True
+        device_id = (keep[0][3].get("device_id") or "").strip()
+        cfg = _get_latest_printer_config(device_id) or cfg
+
+    for ws, job_id, conteudo, printer_config, _until in ready:
+        _submit_print_job(ws, job_id, conteudo, printer_config, key)
+
+
+def _submit_print_job(ws, job_id: int, conteudo: dict, printer_config: dict, key):
+    from printer_service import PrintDeadlineExpired, PrintQueueFull, print_dispatcher
+
+    def _on_done(ticket):
+        if isinstance(ticket.error, PrintDeadlineExpired):
+            _reject_print_job(ws, job_id, conteudo, str(ticket.error))
+
+    try:
+        print_dispatcher().submit(
+            key,
+            lambda: _handle_print_job(ws, job_id, conteudo, printer_config),
+            deadline=PRINT_JOB_DEADLINE_SECONDS,
+            block_timeout=PRINT_JOB_QUEUE_WAIT_SECONDS,
+            on_done=_on_done,
+        )
+    except PrintQueueFull as e:
+        _reject_print_job(ws, job_id, conteudo, str(e))
 
 
 def _make_on_message(printer_config: dict):
@@ -537,13 +664,8 @@ def _make_on_message(printer_config: dict):
                         _ack_print_done(ws, job_id, msg)
                         _log("INFO", f"Job {job_id}: {msg}")
                         return
-                    # Processar em thread separada para não bloquear loop WebSocket.
-                    threading.Thread(
-                        target=_handle_print_job,
-                        args=(ws, job_id, conteudo, printer_config),
-                        daemon=True,
-                        name=f"print_job_{job_id}",
-                    ).start()
+                    # Worker da impressora processa; o loop WebSocket só enfileira.
+                    _dispatch_print_job(ws, job_id, conteudo, printer_config)
                 else:
                     _log("WARN", "print_job recebido sem job_id ou conteudo")
             elif event == "uniplus_job":
@@ -785,6 +907,7 @@ def start_agent_thread():
 
     if not thread_monitor.monitor_thread or not thread_monitor.monitor_thread.is_alive():
         thread_monitor.start()
+    start_printer_monitor()
 
     for did in list(_agent_threads_by_device.keys()):
         if did in wanted:
@@ -2,7 +2,6 @@
 import os
 import sys
 import threading
-import time
 from datetime import datetime
 from typing import List, Optional
 from flask import Flask, request, redirect, url_for, render_template, jsonify, send_file
@@ -10,9 +9,11 @@ from flask_cors import CORS
 
 import db
 from agent import start_agent_thread, stop_agent
-from product_sync import refresh_product_sync_thread, start_product_sync_thread
+from product_sync import start_product_sync_thread
+from retention import get_last_report as retention_last_report, start_retention_thread
 from error_recovery import DataValidator, DatabaseRecovery
 from pos_api import pos_bp
+from uniplus_handler import MESAS_CACHE_DEFAULT_MS
 
 # Tentar importar win32print para listar impressoras locais (Windows)
 try:
@@ -35,6 +36,11 @@ app.register_blueprint(pos_bp)
 
 # Inicializar banco na importação
 db.init_db()
+# auto_vacuum incremental antes de subir as threads (retention.py só devolve páginas)
+try:
+    db.ensure_incremental_vacuum()
+except Exception as e:
+    print(f"[WARN] Não foi possível ligar auto_vacuum incremental: {e}")
 
 # Validar banco de dados na inicialização
 if not DatabaseRecovery.validate_db_connection(db.DB_FILE):
@@ -47,7 +53,7 @@ def _config_context():
     ws_url = db.get_config("ws_url")
     printers = db.get_printers()
     restart_on_save = (db.get_config("restart_service_on_save") or "true").lower() == "true"
-    uniplus_enabled = (db.get_config("uniplus_enabled") or "false").lower() in ("true", "1", "yes", "on")
+    uniplus_enabled = db.get_config_bool("uniplus_enabled")
     uniplus_connection_string = db.get_config("uniplus_connection_string") or ""
     uniplus_produto_table = db.get_config("uniplus_produto_table") or "produto"
     uniplus_produto_codigo_column = db.get_config("uniplus_produto_codigo_column") or "codigo"
@@ -67,6 +73,8 @@ def _config_context():
         "ws_url": ws_url,
         "printers": printers,
         "restart_service_on_save": restart_on_save,
+        "print_coalesce_window_ms": db.get_config_int("print_coalesce_window_ms", 0),
+        "print_route_balance": db.get_config("print_route_balance") or "off",
         "uniplus_enabled": uniplus_enabled,
         "uniplus_connection_string": uniplus_connection_string,
         "uniplus_produto_table": uniplus_produto_table,
@@ -79,14 +87,22 @@ def _config_context():
         "uniplus_product_sync_poll": uniplus_product_sync_poll,
         "pos_api_token": pos_api_token,
         "uniplus_mesa_tipopedido": uniplus_mesa_tipopedido,
+        "uniplus_mesas_cache_ms": db.get_config_int("uniplus_mesas_cache_ms", MESAS_CACHE_DEFAULT_MS),
         "pos_catalog_version": db.get_config("pos_catalog_version") or "0",
         "pos_last_sync_error": db.get_config("pos_last_sync_error") or "",
         "pos_images": pos_images,
         "pos_images_ok": sum(1 for i in pos_images if i.get("exists")),
         "pos_images_missing": sum(1 for i in pos_images if not i.get("exists")),
+        "pos_images_progress": _pos_images_progress(),
     }
 
 
+def _pos_images_progress():
+    from pos_catalog import image_sync_progress
+
+    return image_sync_progress()
+
+
 def _pos_images_for_ui():
     """Imagens do catálogo POS com nomes dos produtos e se o arquivo existe."""
     names_by_id = {}
@@ -111,53 +127,6 @@ def _pos_images_for_ui():
     return out
 
 
-_printer_probe_cache = {"at": 0.0, "items": []}
-_PRINTER_PROBE_TTL_SEC = 20.0
-
-
-def _printer_health_cached():
-    """Probe TCP das térmicas com cache — o /health do POS não pode esperar isso."""
-    now = time.monotonic()
-    cached_at = float(_printer_probe_cache.get("at") or 0)
-    if _printer_probe_cache.get("items") is not None and now - cached_at < _PRINTER_PROBE_TTL_SEC:
-        return _printer_probe_cache["items"]
-    from error_recovery import ConnectionHealthChecker
-
-    printers = db.get_printers()
-    printer_health = []
-    for p in printers:
-        if p.get("connection_type") == "network":
-            printer_ip = p.get("printer_ip", "")
-            printer_port = p.get("printer_port", 9100)
-            is_accessible = False
-            if printer_ip:
-                is_accessible = ConnectionHealthChecker.check_printer_connection(
-                    printer_ip, printer_port, timeout=0.4
-                )
-            printer_health.append(
-                {
-                    "device_id": p.get("device_id", ""),
-                    "name": p.get("name") or p.get("device_id") or "",
-                    "connection_type": "network",
-                    "printer_ip": printer_ip,
-                    "printer_port": printer_port,
-                    "accessible": is_accessible,
-                }
-            )
-        else:
-            printer_health.append(
-                {
-                    "device_id": p.get("device_id", ""),
-                    "name": p.get("name") or p.get("device_id") or "",
-                    "connection_type": "local",
-                    "accessible": True,
-                }
-            )
-    _printer_probe_cache["at"] = now
-    _printer_probe_cache["items"] = printer_health
-    return printer_health
-
-
 def _build_health_status():
     """Monta o payload de saúde usado por /health e /status."""
     from error_recovery import thread_monitor
@@ -168,7 +137,8 @@ def _build_health_status():
         "message": "Print Agent is running",
         "timestamp": datetime.now().isoformat(),
         "database": {
-            "status": "ok" if DatabaseRecovery.validate_db_connection(db.DB_FILE) else "error"
+            "status": "ok" if DatabaseRecovery.validate_db_connection(db.DB_FILE) else "error",
+            "log_writer": db.print_log_writer_stats(),
         },
         "threads": {
             "total": len(_agent_threads),
@@ -181,11 +151,40 @@ def _build_health_status():
         },
     }
 
-    printer_health = _printer_health_cached()
-    health_status["printers"]["health"] = printer_health
+    from printer_monitor import printer_health
+    from printer_service import (
+        payload_cache_stats,
+        print_dispatcher_stats,
+        printer_key_for_config,
+        raw_pool_stats,
+    )
+
+    queues = print_dispatcher_stats()
+    queue_by_key = {tuple(q["key"]): q for q in queues}
+    health_rows = []
+    for item in printer_health():
+        # Fila ao vivo por cima do probe em cache
+        health_rows.append({**item, "queue": queue_by_key.get(tuple(printer_key_for_config(item)))})
+    health_status["printers"]["health"] = health_rows
+    health_status["printers"]["queues"] = queues
+    health_status["printers"]["raw_pool"] = raw_pool_stats()
+    health_status["printers"]["payload_cache"] = payload_cache_stats()
+    from ipp_client import ipp_client_stats
+
+    health_status["printers"]["ipp_clients"] = ipp_client_stats()
+    from print_pools import balance_mode, pool_stats
+
+    health_status["printers"]["route_balance"] = balance_mode()
+    health_status["printers"]["route_pools"] = pool_stats()
 
     # UniPlus: NÃO abrir conexão no health (Unico interpreta sessão concorrente).
-    from uniplus_handler import is_uniplus_enabled
+    from uniplus_handler import (
+        is_uniplus_enabled,
+        open_contas_cache_stats,
+        produto_cache_stats,
+        schema_cache_stats,
+    )
+    from uniplus_session import uniplus_session_stats
     from product_sync import is_product_sync_poll_enabled
 
     uniplus_on = is_uniplus_enabled(db)
@@ -194,9 +193,14 @@ def _build_health_status():
         "db_ok": None,
         "product_sync_poll": is_product_sync_poll_enabled(),
         "last_error": db.get_config("uniplus_last_error") or "",
-        "note": "conexão sob demanda (jobs/produtos); health não testa o Postgres",
+        "session": uniplus_session_stats(),
+        "schema_cache": schema_cache_stats(),
+        "produto_cache": produto_cache_stats(),
+        "mesas_cache": open_contas_cache_stats(),
+        "note": "sessão única compartilhada (jobs/POS/produtos); health não testa o Postgres",
     }
     health_status["uniplus"] = uniplus_info
+    health_status["retention"] = retention_last_report()
 
     if health_status["database"]["status"] != "ok":
         health_status["status"] = "degraded"
@@ -266,14 +270,17 @@ def config():
                 "uniplus_mesa_tipopedido",
                 (request.form.get("uniplus_mesa_tipopedido") or "1").strip() or "1",
             )
+            mesas_cache_ms = (request.form.get("uniplus_mesas_cache_ms") or "").strip()
+            db.set_config(
+                "uniplus_mesas_cache_ms",
+                str(max(0, min(60000, int(mesas_cache_ms))))
+                if mesas_cache_ms.isdigit()
+                else str(MESAS_CACHE_DEFAULT_MS),
+            )
             db.set_config(
                 "uniplus_product_sync_poll",
                 "true" if uniplus_product_sync_poll else "false",
             )
-            try:
-                refresh_product_sync_thread()
-            except Exception as sync_exc:
-                print(f"[WARN] refresh product_sync: {sync_exc}")
             for key, value in uniplus_tables.items():
                 db.set_config(key, value)
 
@@ -327,6 +334,16 @@ def config():
             # Opção "Reiniciar serviço ao salvar"
             restart_on_save = request.form.get("restart_service_on_save", "true").lower() in ("true", "1", "on", "yes")
             db.set_config("restart_service_on_save", "true" if restart_on_save else "false")
+            coalesce_ms = (request.form.get("print_coalesce_window_ms") or "0").strip()
+            db.set_config(
+                "print_coalesce_window_ms",
+                str(max(0, min(2000, int(coalesce_ms)))) if coalesce_ms.isdigit() else "0",
+            )
+            route_balance = (request.form.get("print_route_balance") or "off").strip().lower()
+            db.set_config(
+                "print_route_balance",
+                route_balance if route_balance in ("off", "least_queue", "round_robin") else "off",
+            )
             print(f"[DEBUG] Impressoras salvas com sucesso")
             if restart_on_save:
                 stop_agent()
@@ -408,6 +425,7 @@ def pos_images_sync_ui():
                 "index",
                 message=(
                     f"Imagens POS: {stats.get('downloaded', 0)} baixadas, "
+                    f"{stats.get('not_modified', 0)} inalteradas, "
                     f"{stats.get('failed', 0)} falhas."
                 ),
                 message_type="success",
@@ -421,6 +439,12 @@ def pos_images_sync_ui():
         )
 
 
+@app.route("/api/pos-images/progress", methods=["GET"])
+def pos_images_progress_api():
+    """Contadores do download de imagens (a tela de config consulta enquanto roda)."""
+    return jsonify(_pos_images_progress())
+
+
 @app.route("/health", methods=["GET"])
 def health():
     """Liveness rápido para o POS na LAN. Não sonda impressoras (isso travava o tablet)."""
@@ -456,8 +480,9 @@ def logs():
     except (TypeError, ValueError):
         limit = 50
     limit = max(1, min(limit, 500))
+    before_id = _parse_before_id(request.args.get("before_id"))
     logs_list = db.get_print_logs(
-        limit=limit, status=status_filter, q=q, kind=kind_filter
+        limit=limit, status=status_filter, q=q, kind=kind_filter, before_id=before_id
     )
     stats = db.get_print_log_stats()
     return render_template(
@@ -469,9 +494,26 @@ def logs():
         kind_filter=kind_filter,
         q=q,
         limit=limit,
+        before_id=before_id,
+        next_before_id=_next_before_id(logs_list, limit),
     )
 
 
+def _parse_before_id(raw):
+    try:
+        value = int(raw or 0)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def _next_before_id(logs_list, limit):
+    """Cursor da próxima página (mais antiga); None se esta foi a última."""
+    if len(logs_list) < limit:
+        return None
+    return logs_list[-1]["id"]
+
+
 def _find_parent_name(parents, product_id):
     try:
         pid = int(product_id)
@@ -1022,12 +1064,15 @@ def api_logs():
     except (TypeError, ValueError):
         limit = 50
     limit = max(1, min(limit, 500))
+    before_id = _parse_before_id(request.args.get("before_id"))
+    logs_list = db.get_print_logs(
+        limit=limit, status=status_filter, q=q, kind=kind_filter, before_id=before_id
+    )
     return jsonify(
         {
-            "logs": db.get_print_logs(
-                limit=limit, status=status_filter, q=q, kind=kind_filter
-            ),
+            "logs": logs_list,
             "stats": db.get_print_log_stats(),
+            "next_before_id": _next_before_id(logs_list, limit),
         }
     )
 
@@ -1211,6 +1256,7 @@ if __name__ == "__main__":
             print("Erro ao iniciar bandeja (instale: pip install pystray Pillow):", e)
             start_agent_thread()
             start_product_sync_thread()
+            start_retention_thread()
             run_flask()
     else:
         print("=" * 50)
@@ -1224,4 +1270,5 @@ if __name__ == "__main__":
         print("=" * 50)
         start_agent_thread()
         start_product_sync_thread()
+        start_retention_thread()
         run_flask()
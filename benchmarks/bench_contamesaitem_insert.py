@@ -0,0 +1,152 @@
+"""Benchmark: itens do pedido UniPlus em CONTAMESAITEM (INSERT por item x multi-linha).
+
+Precisa de um Postgres local (o do Unico ou um de teste). Cria um schema temporário
+com contamesa/contamesaitem (colunas do _contamesaitem_row, hash UNIQUE), e para
+cada pedido abre a transação, pega o advisory lock da mesa, insere a conta e os
+--items itens e faz commit — medindo quanto tempo o lock fica preso:
+
+    per_row  um INSERT por item (caminho antigo)
+    batch    _insert_contamesaitens: INSERT multi-linha com RETURNING id
+
+--rtt-ms soma um atraso a cada comando (Postgres em outra máquina da rede).
+O schema é removido no fim.
+
+Uso:
+    python benchmarks/bench_contamesaitem_insert.py --dsn "host=127.0.0.1 dbname=unico user=postgres"
+        [--orders 50] [--items 20] [--rtt-ms 0] [--json]
+    (ou defina UNIPLUS_BENCH_DSN)
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SCHEMA = "bench_uniplus_items"
+
+
+def _sql_type(name, value):
+    if name == "hash":
+        return "char(40) UNIQUE"
+    if isinstance(value, bool) or isinstance(value, int):
+        return "bigint"
+    if isinstance(value, float):
+        return "double precision"
+    return "text"
+
+
+def _sample_row(uh, conta_id, n, now):
+    return uh._contamesaitem_row(
+        conta_id=conta_id,
+        numeromesa=900,
+        idproduto=1000 + n,
+        codigo=str(1080 + n),
+        nome=f"ITEM {n:03d}",
+        qty=1.0,
+        precounitario=10.0,
+        valortotal=10.0,
+        observacao="sem cebola" if n % 3 == 0 else "",
+        protocol_key=f"bench-{conta_id}",
+        item_hash=uh._pad_hash(""),
+        data_val=now.date().isoformat(),
+        hora_abertura=now.isoformat(),
+        now=now,
+        idunidademedida=uh.DEFAULT_IDUNIDADEMEDIDA,
+        cnpjfilial="00000000000000",
+    )
+
+
+def _create_schema(conn, uh):
+    row = _sample_row(uh, 0, 0, datetime.now(timezone.utc))
+    cols = ", ".join(f"{name} {_sql_type(name, value)}" for name, value in row.items())
+    with conn, conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cur.execute(f"CREATE SCHEMA {SCHEMA}")
+        cur.execute(f"CREATE TABLE {SCHEMA}.contamesa (id bigserial PRIMARY KEY, numeromesa bigint)")
+        cur.execute(f"CREATE TABLE {SCHEMA}.contamesaitem (id bigserial PRIMARY KEY, {cols})")
+    return set(row) | {"id"}
+
+
+def _run(mode, conn, uh, item_cols, orders, items):
+    hold = []
+    for n in range(orders):
+        now = datetime.now(timezone.utc)
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s, %s)", (872014002, 900))
+            locked = time.perf_counter()
+            cur.execute(f"INSERT INTO {SCHEMA}.contamesa (numeromesa) VALUES (900) RETURNING id")
+            conta_id = cur.fetchone()["id"]
+            rows = [_sample_row(uh, conta_id, i, now) for i in range(items)]
+            if mode == "per_row":
+                ids = [uh._insert_contamesaitem(cur, f"{SCHEMA}.contamesaitem", item_cols, r) for r in rows]
+            else:
+                ids = uh._insert_contamesaitens(cur, f"{SCHEMA}.contamesaitem", item_cols, rows)
+            if len(ids) != items or None in ids:
+                raise RuntimeError(f"{mode}: ids inesperados {ids!r}")
+        hold.append((time.perf_counter() - locked) * 1000)
+    hold.sort()
+    return {
+        "orders": orders,
+        "items_per_order": items,
+        "lock_hold_p50_ms": round(statistics.median(hold), 3),
+        "lock_hold_p95_ms": round(hold[max(0, int(len(hold) * 0.95) - 1)], 3),
+        "lock_hold_mean_ms": round(statistics.fmean(hold), 3),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dsn", default=os.environ.get("UNIPLUS_BENCH_DSN", ""))
+    parser.add_argument("--orders", type=int, default=50)
+    parser.add_argument("--items", type=int, default=20)
+    parser.add_argument("--rtt-ms", type=float, default=0.0, help="atraso simulado por comando SQL")
+    parser.add_argument("--json", action="store_true", help="saída em JSON")
+    args = parser.parse_args()
+
+    try:
+        import psycopg2
+        from psycopg2.extras import RealDictCursor
+    except ImportError:
+        print("psycopg2 não instalado. Rode: pip install psycopg2-binary", file=sys.stderr)
+        return 2
+    if not args.dsn:
+        print("informe --dsn ou UNIPLUS_BENCH_DSN (Postgres local)", file=sys.stderr)
+        return 2
+
+    import uniplus_handler as uh
+
+    class _SlowCursor(RealDictCursor):
+        def execute(self, query, vars=None):
+            time.sleep(args.rtt_ms / 1000)
+            return super().execute(query, vars)
+
+    conn = psycopg2.connect(args.dsn, cursor_factory=_SlowCursor)
+    try:
+        item_cols = _create_schema(conn, uh)
+        results = {
+            "per_row": _run("per_row", conn, uh, item_cols, args.orders, args.items),
+            "batch": _run("batch", conn, uh, item_cols, args.orders, args.items),
+        }
+    finally:
+        with conn, conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name in ("per_row", "batch"):
+            r = results[name]
+            print(
+                f"{name:>7}: lock p50 {r['lock_hold_p50_ms']:8.3f} ms  p95 {r['lock_hold_p95_ms']:8.3f} ms  "
+                f"({r['orders']} pedidos x {r['items_per_order']} itens)"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
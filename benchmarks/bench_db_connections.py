@@ -0,0 +1,102 @@
+"""Benchmark: conexões SQLite por pedido POS (antes x depois do pool).
+
+Simula as chamadas de banco de um pedido POS (token, catálogo, rotas de
+impressão, claim/save do pedido, log de impressão) num banco temporário e
+conta quantas vezes sqlite3.connect é chamado.
+
+Uso:
+    python benchmarks/bench_db_connections.py [--orders 200] [--json]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+from error_recovery import DatabaseRecovery  # noqa: E402
+
+
+class _LegacyPool(db._ConnectionPool):
+    """Comportamento antigo: validar + conectar + PRAGMA em toda chamada."""
+
+    def acquire(self):
+        if not DatabaseRecovery.validate_db_connection(self.db_file):
+            DatabaseRecovery.backup_db(self.db_file)
+        self.opened += 1
+        return self._open()
+
+    def release(self, conn, *, broken=False):
+        conn.close()
+
+
+def _simulate_order(i: int) -> None:
+    db.get_config("pos_token")
+    db.list_pos_products()
+    db.list_pos_addon_groups()
+    db.list_pos_print_routes()
+    db.list_pos_printers()
+    db.get_printers()
+    cid = f"bench-{os.getpid()}-{i}-{time.perf_counter_ns()}"
+    db.claim_pos_order(cid)
+    db.save_pos_order(cid, {"ok": True})
+    db.add_print_log(cid, "success", "bench", kind="pos")
+
+
+def _run(pool, orders: int) -> dict:
+    calls = {"connect": 0}
+    real_connect = sqlite3.connect
+
+    def counting_connect(*args, **kwargs):
+        calls["connect"] += 1
+        return real_connect(*args, **kwargs)
+
+    db._pool = pool
+    sqlite3.connect = counting_connect
+    try:
+        t0 = time.perf_counter()
+        for i in range(orders):
+            _simulate_order(i)
+        elapsed = time.perf_counter() - t0
+    finally:
+        sqlite3.connect = real_connect
+        pool.close_all()
+    return {
+        "orders": orders,
+        "connects": calls["connect"],
+        "connects_per_order": round(calls["connect"] / orders, 2),
+        "ms_per_order": round(elapsed * 1000 / orders, 3),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="saída em JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "bench.db")
+        db.init_db()
+        db.set_printers([{"device_id": "bench", "token": "t", "printer_ip": "127.0.0.1"}])
+        results = {
+            "legacy": _run(_LegacyPool(db.DB_FILE), args.orders),
+            "pooled": _run(db._ConnectionPool(db.DB_FILE), args.orders),
+        }
+        db.close_connections()
+        db._pool = None
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, r in results.items():
+            print(f"{name:>7}: {r['connects_per_order']:6.2f} connect/pedido  {r['ms_per_order']:8.3f} ms/pedido")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,277 @@
+"""Benchmark: cupons via IPP (conexão nova por job x cliente keep-alive com job-state).
+
+Sobe um servidor IPP falso local (HTTP/1.1 keep-alive; Print-Job, Get-Job-Attributes,
+Get-Printer-Attributes e Purge-Jobs; cada job fica "processing" por --job-ms e depois
+"completed"), confere o protocolo do ipp_client (request-id ecoado, job-id, estados,
+purge) e mede N cupons:
+
+    per_job    conexão HTTP nova por cupom, Print-Job e só o status HTTP (caminho antigo)
+    keepalive  IppClient compartilhado: mesma conexão, Print-Job + espera do job-state
+
+--rtt-ms soma um atraso a cada conexão TCP nova (impressora no Wi-Fi).
+
+Uso:
+    python benchmarks/bench_ipp_client.py [--jobs 200] [--job-ms 5] [--rtt-ms 0] [--json]
+"""
+import argparse
+import http.client
+import http.server
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ipp_client  # noqa: E402
+from ipp_client import (  # noqa: E402
+    GET_JOB_ATTRIBUTES,
+    GET_PRINTER_ATTRIBUTES,
+    JOB_ABORTED,
+    JOB_CANCELED,
+    JOB_COMPLETED,
+    JOB_PENDING,
+    JOB_PROCESSING,
+    PRINT_JOB,
+    PURGE_JOBS,
+    TAG_CHARSET,
+    TAG_ENUM,
+    TAG_INTEGER,
+    TAG_JOB,
+    TAG_KEYWORD,
+    TAG_LANGUAGE,
+    TAG_OPERATION,
+    TAG_PRINTER,
+    TAG_TEXT,
+    IppClient,
+    decode_message,
+    encode_message,
+)
+
+_STATUS_BAD_REQUEST = 0x0400
+_STATUS_NOT_FOUND = 0x0406
+_STATUS_NOT_SUPPORTED = 0x0501
+
+
+class _FakeIppHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        request = decode_message(body)
+        status, groups = self.server.handle_ipp(request)
+        reply = encode_message(status, request.request_id, [
+            (TAG_OPERATION, [
+                ("attributes-charset", TAG_CHARSET, "utf-8"),
+                ("attributes-natural-language", TAG_LANGUAGE, "pt-br"),
+                *([("status-message", TAG_TEXT, "erro")] if status >= 0x0100 else []),
+            ]),
+            *groups,
+        ])
+        self.send_response(200)
+        self.send_header("Content-Type", "application/ipp")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+
+class FakeIppServer(http.server.ThreadingHTTPServer):
+    """
+    Impressora IPP em memória: jobs terminam job_seconds depois de aceitos
+    (abort_rate: fração que termina "aborted"; on_data(bytes): documento recebido).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, job_seconds=0.005, abort_rate=0.0, on_data=None, seed=None):
+        super().__init__(("127.0.0.1", 0), _FakeIppHandler)
+        self.job_seconds = job_seconds
+        self.abort_rate = abort_rate
+        self.on_data = on_data
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.jobs = {}  # id -> [estado, aceito_em, bytes, vai_abortar]
+        self.job_ids = itertools.count(1)
+        self.connections = 0
+        self.bytes_received = 0
+        threading.Thread(target=self.serve_forever, name="fake-ipp-accept", daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def process_request(self, request, client_address):
+        # Nome próprio: o farm separa as threads do servidor falso das do agente
+        threading.Thread(
+            target=self.process_request_thread, args=(request, client_address),
+            name="fake-ipp", daemon=True,
+        ).start()
+
+    def _state(self, job):
+        if job[0] == JOB_PROCESSING and time.monotonic() - job[1] >= self.job_seconds:
+            job[0] = JOB_ABORTED if job[3] else JOB_COMPLETED
+        return job[0]
+
+    def handle_ipp(self, request):
+        op = request.group(TAG_OPERATION)
+        names = list(op)
+        # RFC 8011: charset, idioma e alvo nessa ordem
+        if names[:3] != ["attributes-charset", "attributes-natural-language", "printer-uri"]:
+            return _STATUS_BAD_REQUEST, []
+        with self.lock:
+            if request.code == PRINT_JOB:
+                job_id = next(self.job_ids)
+                aborts = self.abort_rate > 0 and self.rng.random() < self.abort_rate
+                self.jobs[job_id] = [JOB_PROCESSING, time.monotonic(), len(request.data), aborts]
+                self.bytes_received += len(request.data)
+                if self.on_data is not None and not aborts:
+                    self.on_data(request.data)
+                return 0, [(TAG_JOB, [("job-id", TAG_INTEGER, job_id), ("job-state", TAG_ENUM, JOB_PENDING)])]
+            if request.code == GET_JOB_ATTRIBUTES:
+                job = self.jobs.get(request.attr(TAG_OPERATION, "job-id"))
+                if job is None:
+                    return _STATUS_NOT_FOUND, []
+                return 0, [(TAG_JOB, [
+                    ("job-state", TAG_ENUM, self._state(job)),
+                    ("job-state-reasons", TAG_KEYWORD, ["none"]),
+                ])]
+            if request.code == GET_PRINTER_ATTRIBUTES:
+                queued = sum(1 for j in self.jobs.values() if self._state(j) == JOB_PROCESSING)
+                return 0, [(TAG_PRINTER, [
+                    ("printer-state", TAG_ENUM, 4 if queued else 3),
+                    ("printer-state-reasons", TAG_KEYWORD, ["none"]),
+                    ("queued-job-count", TAG_INTEGER, queued),
+                ])]
+            if request.code == PURGE_JOBS:
+                for job in self.jobs.values():
+                    if self._state(job) == JOB_PROCESSING:
+                        job[0] = JOB_CANCELED
+                return 0, []
+        return _STATUS_NOT_SUPPORTED, []
+
+
+def _check_protocol(server) -> list:
+    """Fluxo completo contra o servidor falso; devolve as falhas encontradas."""
+    failures = []
+    client = IppClient("127.0.0.1", server.port, timeout=5)
+    job_id = client.print_job(b"\x1b@teste\n")
+    if not isinstance(job_id, int):
+        failures.append(f"print_job devolveu {job_id!r}")
+    elif client.wait_for_job(job_id, timeout=5, interval=0.005) != JOB_COMPLETED:
+        failures.append("job não chegou a completed")
+    if client.get_printer_attributes().get("printer-state") not in (3, 4):
+        failures.append("printer-state ausente")
+    server.job_seconds = 60
+    pending = client.print_job(b"x")
+    client.purge_jobs()
+    if client.get_job_attributes(pending).get("job-state") != JOB_CANCELED:
+        failures.append("purge não cancelou o job")
+    server.job_seconds = 0.005
+    try:
+        client.get_job_attributes(10 ** 6)
+        failures.append("job inexistente não gerou IppError")
+    except ipp_client.IppError as e:
+        if e.status_code != _STATUS_NOT_FOUND:
+            failures.append(f"status inesperado 0x{e.status_code:04x}")
+    if client.connects != 1:
+        failures.append(f"{client.connects} conexões para {client.requests} requisições")
+    client.close()
+    return failures
+
+
+def _legacy_print(port, data):
+    request = encode_message(PRINT_JOB, 1, [(TAG_OPERATION, [
+        ("attributes-charset", TAG_CHARSET, "utf-8"),
+        ("attributes-natural-language", TAG_LANGUAGE, "pt"),
+        ("printer-uri", 0x45, f"ipp://127.0.0.1:{port}/ipp/print"),
+    ])], data)
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    conn.request("POST", "/ipp/print", request, {"Content-Type": "application/ipp"})
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    return response.status == 200
+
+
+def _run(mode, server, jobs):
+    data = b"\x1b@" + b"1x ITEM 000  R$ 10,00\n" * 25 + b"\x1dV\x00"
+    client = IppClient("127.0.0.1", server.port, timeout=5)
+    before = server.connections
+    samples = []
+    for _ in range(jobs):
+        t0 = time.perf_counter()
+        if mode == "per_job":
+            ok = _legacy_print(server.port, data)
+        else:
+            job_id = client.print_job(data)
+            ok = client.wait_for_job(job_id, timeout=5, interval=0.002) == JOB_COMPLETED
+        samples.append((time.perf_counter() - t0) * 1000)
+        if not ok:
+            raise RuntimeError(f"falha ao imprimir no modo {mode}")
+    client.close()
+    samples.sort()
+    return {
+        "jobs": jobs,
+        "tcp_connects": server.connections - before,
+        "job_state_tracked": mode != "per_job",
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3),
+        "mean_ms": round(statistics.fmean(samples), 3),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--job-ms", type=float, default=5.0, help="tempo de impressão simulado por job")
+    parser.add_argument("--rtt-ms", type=float, default=0.0, help="atraso simulado por conexão TCP nova")
+    parser.add_argument("--json", action="store_true", help="saída em JSON")
+    args = parser.parse_args()
+
+    server = FakeIppServer(job_seconds=args.job_ms / 1000)
+    original_connect = http.client.HTTPConnection.connect
+
+    def _slow_connect(self):
+        time.sleep(args.rtt_ms / 1000)
+        return original_connect(self)
+
+    http.client.HTTPConnection.connect = _slow_connect
+    try:
+        failures = _check_protocol(server)
+        results = {
+            "protocol_failures": failures,
+            "per_job": _run("per_job", server, args.jobs),
+            "keepalive": _run("keepalive", server, args.jobs),
+        }
+    finally:
+        http.client.HTTPConnection.connect = original_connect
+        server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"protocolo: {'ok' if not failures else '; '.join(failures)}")
+        for name in ("per_job", "keepalive"):
+            r = results[name]
+            print(
+                f"{name:>9}: p50 {r['p50_ms']:7.3f} ms  p95 {r['p95_ms']:7.3f} ms  "
+                f"{r['tcp_connects']} connects/{r['jobs']} cupons"
+                + ("  (com job-state)" if r["job_state_tracked"] else "")
+            )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""Benchmark: lookups de catálogo de um pedido POS de 30 itens (antes x índice).
+
+"antes" reproduz o caminho antigo (JSON do SQLite a cada produto/adicional/
+rótulo); "índice" usa db.pos_catalog_index(). Banco temporário.
+
+Uso:
+    python benchmarks/bench_pos_catalog_index.py [--products 400] [--orders 200] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+from receipt_formatter import _resolve_size_label_from_db  # noqa: E402
+
+ORDER_ITEMS = 30
+
+
+def _catalog(n_products: int) -> dict:
+    products = []
+    for pid in range(1, n_products + 1):
+        products.append({
+            "id": pid,
+            "name": f"Produto {pid}",
+            "grupo": f"Grupo {pid % 12}",
+            "idUniplus": f"U{pid}",
+            "value": 10.0 + pid % 7,
+            "variations": [{
+                "name": "Tamanho",
+                "options": [
+                    {"id": pid * 10 + k, "label": label, "idUniplus": f"U{pid}-{k}"}
+                    for k, label in enumerate(("Pequena", "Média", "Grande"))
+                ],
+            }],
+        })
+    groups = []
+    for gid in range(1, 21):
+        groups.append({
+            "id": gid,
+            "name": f"Adicionais {gid}",
+            "items": [{"id": gid * 100 + k, "idUniplus": f"A{gid}-{k}"} for k in range(10)],
+            "subgroups": [{"items": [{"id": gid * 100 + 50 + k, "idUniplus": f"S{gid}-{k}"} for k in range(5)]}],
+        })
+    return {"catalogVersion": 1, "products": products, "groups": groups, "users": [], "mesas": []}
+
+
+def _order(n_products: int) -> list:
+    items = []
+    for i in range(ORDER_ITEMS):
+        pid = (i * 37) % n_products + 1
+        items.append({
+            "productId": pid,
+            "optionId": pid * 10 + i % 3,
+            "addons": [{"addOnItemId": ((i % 20) + 1) * 100 + 55}, {"addOnItemId": ((i % 20) + 1) * 100 + 3}],
+        })
+    return items
+
+
+# --- caminho antigo (cópia do código anterior ao índice) ---
+
+def _legacy_product(pid):
+    with db._connection() as conn:
+        row = conn.execute("SELECT payload FROM pos_products WHERE id = ?", (int(pid),)).fetchone()
+        return db._json_load(row[0], {}) if row else None
+
+
+def _legacy_option_codigo(product, option_id):
+    for variation in product.get("variations") or []:
+        for opt in variation.get("options") or []:
+            if int(opt.get("id") or 0) == int(option_id):
+                return str(opt.get("idUniplus") or product.get("idUniplus") or "")
+    return str(product.get("idUniplus") or "")
+
+
+def _legacy_addon_codigo(addon_id):
+    for group in db._load_pos_addon_groups():
+        for item in group.get("items") or []:
+            if int(item.get("id") or 0) == int(addon_id):
+                return str(item.get("idUniplus") or "")
+        for sg in group.get("subgroups") or []:
+            for item in sg.get("items") or []:
+                if int(item.get("id") or 0) == int(addon_id):
+                    return str(item.get("idUniplus") or "")
+    return ""
+
+
+def _legacy_label(item):
+    product = _legacy_product(item["productId"])
+    for variation in product.get("variations") or []:
+        for opt in variation.get("options") or []:
+            if int(opt.get("id") or 0) == int(item["optionId"]):
+                return str(opt.get("label") or "")
+    return ""
+
+
+def _legacy_order(items):
+    out = []
+    for item in items:
+        product = _legacy_product(item["productId"])  # _build_uniplus_items
+        codigo = _legacy_option_codigo(product, item["optionId"])
+        addons = [_legacy_addon_codigo(a["addOnItemId"]) for a in item["addons"]]
+        grupo = _legacy_product(item["productId"]).get("grupo")  # _item_grupo
+        out.append((codigo, addons, grupo, _legacy_label(item)))
+    return out
+
+
+# --- caminho novo ---
+
+def _indexed_order(items):
+    out = []
+    for item in items:
+        index = db.pos_catalog_index()
+        product = index.product(item["productId"])
+        opt = index.option_by_product.get((int(product["id"]), int(item["optionId"])))
+        codigo = str(opt.get("idUniplus") or product.get("idUniplus") or "")
+        addons = [index.addon_codigo_by_id.get(int(a["addOnItemId"]), "") for a in item["addons"]]
+        grupo = index.product(item["productId"]).get("grupo")
+        out.append((codigo, addons, grupo, _resolve_size_label_from_db(item)))
+    return out
+
+
+def _time(fn, items, orders):
+    t0 = time.perf_counter()
+    for _ in range(orders):
+        result = fn(items)
+    return (time.perf_counter() - t0) * 1000 / orders, result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=400)
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="saída em JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "bench.db")
+        db.init_db()
+        db.replace_pos_catalog(_catalog(args.products))
+        items = _order(args.products)
+        legacy_ms, legacy = _time(_legacy_order, items, args.orders)
+        indexed_ms, indexed = _time(_indexed_order, items, args.orders)
+        db.close_connections()
+        db._pool = None
+
+    results = {
+        "items_per_order": ORDER_ITEMS,
+        "products": args.products,
+        "legacy_ms_per_order": round(legacy_ms, 3),
+        "indexed_ms_per_order": round(indexed_ms, 4),
+        "speedup": round(legacy_ms / indexed_ms, 1) if indexed_ms else None,
+        "same_result": legacy == indexed,
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(
+            f"pedido de {ORDER_ITEMS} itens: antes {results['legacy_ms_per_order']:.3f} ms · "
+            f"índice {results['indexed_ms_per_order']:.4f} ms · {results['speedup']}x · "
+            f"mesmo resultado={results['same_result']}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,616 @@
+"""Benchmark ponta a ponta: fazenda de impressoras falsas + SaaS falso.
+
+Sobe N impressoras RAW 9100 falsas (tempo de impressão por cupom, leitura lenta,
+queda de conexão, porta recusando), M impressoras IPP falsas (servidor de
+bench_ipp_client) e um servidor WebSocket falso que faz o papel do SaaS: aceita
+uma sessão por device_id, manda "ready" e depois eventos print_job/uniplus_job,
+e mede o tempo até o ACK de cada um.
+
+Fases:
+
+    ws   agent._run_websocket por impressora (o caminho real: on_message, fila da
+         impressora, monitor, envio, ACK); latência = evento enviado -> ACK
+    pos  pos_api._print_kitchen em paralelo (rotas por grupo, pools, failover);
+         latência = chamada -> retorno
+
+As impressoras falsas reconhecem o protocolo de cada cupom nos bytes recebidos:
+"lost" conta cupons com ACK done que nunca chegaram ao papel. Sem UniPlus
+configurado os uniplus_job voltam com erro de config (mede só o despacho).
+Cada fase reporta p50/p95/p99, cupons/s e o pico de threads do agente.
+
+Precisa de websocket-client (fase ws) e Flask (fase pos); a fase sem a
+dependência sai como "skipped". Usa um agent.db temporário.
+
+Uso:
+    python benchmarks/bench_print_farm.py [--raw 3] [--ipp 1] [--refuse 0] [--jobs 300]
+        [--rate 0] [--latency-ms 20] [--slow-read-kbps 0] [--drop-rate 0]
+        [--uniplus-ratio 0.1] [--pos-orders 60] [--pos-concurrency 4] [--pos-groups 2]
+        [--balance off] [--recovery-wait 5] [--timeout 120] [--seed 7] [--verbose] [--json]
+"""
+import argparse
+import base64
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import socket
+import socketserver
+import statistics
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+from bench_ipp_client import FakeIppServer  # noqa: E402
+
+_MARKER = re.compile(rb"(WSJ|POS)(\d{6})")
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_GROUPS = ["Pizzas", "Bebidas", "Lanches", "Sobremesas", "Porções"]
+_WORDS = ["Calabresa", "Frango c/ Catupiry", "Guaraná 2L", "X-Tudo", "Açaí 500ml", "Batata Frita", "Pudim"]
+
+
+class _Farm:
+    """Cupons vistos pelas impressoras falsas (protocolo -> primeira chegada)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.printed = {}
+
+    def saw(self, data: bytes):
+        now = time.perf_counter()
+        with self.lock:
+            for kind, num in _MARKER.findall(data):
+                self.printed.setdefault(kind.decode() + num.decode(), now)
+
+
+# --- impressora RAW falsa -------------------------------------------------
+
+
+class _FakeRawHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        srv = self.server
+        sock = self.request
+        tail = b""
+        chunk = 512 if srv.slow_read_bps else 65536
+        while True:
+            try:
+                data = sock.recv(chunk)
+            except OSError:
+                return
+            if not data:
+                return
+            if b"\x1b@" in data and srv.drop_rate and srv.rng.random() < srv.drop_rate:
+                # Queda no meio do cupom: RST, o resto do buffer se perde
+                srv.dropped += 1
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                sock.close()
+                return
+            srv.bytes_received += len(data)
+            if b"\x10\x04\x01" in data:
+                sock.sendall(b"\x12")
+            buf = tail + data
+            srv.farm.saw(buf)
+            tail = buf[-16:]
+            if srv.slow_read_bps:
+                time.sleep(len(data) / srv.slow_read_bps)
+            cuts = data.count(b"\x1dV")
+            if cuts:
+                srv.receipts += cuts
+                # Cabeça térmica ocupada: não lê o socket enquanto imprime
+                time.sleep(srv.print_seconds * cuts)
+
+
+class FakeRawPrinter(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, farm, print_seconds=0.02, slow_read_bps=0, drop_rate=0.0, seed=None):
+        super().__init__(("127.0.0.1", 0), _FakeRawHandler)
+        self.farm = farm
+        self.print_seconds = print_seconds
+        self.slow_read_bps = slow_read_bps
+        self.drop_rate = drop_rate
+        self.rng = random.Random(seed)
+        self.bytes_received = 0
+        self.receipts = 0
+        self.dropped = 0
+        threading.Thread(target=self.serve_forever, name="fake-raw-accept", daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def process_request(self, request, client_address):
+        threading.Thread(
+            target=self.process_request_thread, args=(request, client_address),
+            name="fake-raw", daemon=True,
+        ).start()
+
+    def stats(self):
+        return {"receipts": self.receipts, "bytes": self.bytes_received, "dropped": self.dropped}
+
+
+class RefusingPrinter:
+    """Porta ocupada sem listen: todo connect volta "connection refused"."""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+
+    @property
+    def port(self):
+        return self.sock.getsockname()[1]
+
+    def shutdown(self):
+        self.sock.close()
+
+    def stats(self):
+        return {"receipts": 0, "refused": True}
+
+
+# --- SaaS falso (WebSocket RFC 6455 mínimo) --------------------------------
+
+
+def _recv_exact(sock, n):
+    buf = b""
+    while len(buf) < n:
+        part = sock.recv(n - len(buf))
+        if not part:
+            raise ConnectionError("fechado")
+        buf += part
+    return buf
+
+
+def _ws_frame(opcode: int, payload: bytes) -> bytes:
+    n = len(payload)
+    if n < 126:
+        head = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < 65536:
+        head = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        head = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return head + payload
+
+
+def _ws_read(sock):
+    b1, b2 = _recv_exact(sock, 2)
+    n = b2 & 0x7F
+    if n == 126:
+        n = struct.unpack("!H", _recv_exact(sock, 2))[0]
+    elif n == 127:
+        n = struct.unpack("!Q", _recv_exact(sock, 8))[0]
+    mask = _recv_exact(sock, 4) if b2 & 0x80 else b""
+    data = _recv_exact(sock, n)
+    if mask:
+        data = bytes(c ^ mask[i % 4] for i, c in enumerate(data))
+    return b1 & 0x0F, data
+
+
+class _WsSession:
+    def __init__(self, sock, device_id):
+        self.sock = sock
+        self.device_id = device_id
+        self.lock = threading.Lock()
+
+    def send_json(self, obj):
+        with self.lock:
+            self.sock.sendall(_ws_frame(0x1, json.dumps(obj).encode("utf-8")))
+
+
+class _FakeSaasHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        srv = self.server
+        sock = self.request
+        raw = b""
+        while b"\r\n\r\n" not in raw:
+            part = sock.recv(4096)
+            if not part:
+                return  # preflight TCP do agente
+            raw += part
+        lines = raw.split(b"\r\n\r\n", 1)[0].decode("latin-1").split("\r\n")
+        headers = {k.strip().lower(): v.strip() for k, _, v in (ln.partition(":") for ln in lines[1:])}
+        device_id = headers.get("x-device-id", "")
+        if headers.get("authorization") != f"Bearer {srv.tokens.get(device_id)}":
+            sock.sendall(b"HTTP/1.1 401 Unauthorized\r\nContent-Length: 0\r\n\r\n")
+            return
+        accept = base64.b64encode(
+            hashlib.sha1((headers.get("sec-websocket-key", "") + _WS_GUID).encode()).digest()
+        ).decode()
+        sock.sendall(
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode()
+        )
+        session = _WsSession(sock, device_id)
+        session.send_json({"event": "ready"})
+        with srv.cond:
+            srv.sessions[device_id] = session
+            srv.cond.notify_all()
+        try:
+            while True:
+                opcode, data = _ws_read(sock)
+                if opcode == 0x8:
+                    with session.lock:
+                        sock.sendall(_ws_frame(0x8, data[:2]))
+                    return
+                if opcode == 0x9:
+                    with session.lock:
+                        sock.sendall(_ws_frame(0xA, data))
+                elif opcode == 0x1:
+                    srv.on_message(json.loads(data))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with srv.cond:
+                if srv.sessions.get(device_id) is session:
+                    del srv.sessions[device_id]
+
+
+class FakeSaas(socketserver.ThreadingTCPServer):
+    """Despacha eventos para as sessões e guarda envio/ACK de cada job."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, tokens):
+        super().__init__(("127.0.0.1", 0), _FakeSaasHandler)
+        self.tokens = tokens
+        self.cond = threading.Condition()
+        self.sessions = {}
+        self.jobs = {}  # job_id -> {"kind", "sent", "ack", "status"}
+        threading.Thread(target=self.serve_forever, name="fake-saas-accept", daemon=True).start()
+
+    @property
+    def url(self):
+        return f"ws://127.0.0.1:{self.server_address[1]}/agent"
+
+    def process_request(self, request, client_address):
+        threading.Thread(
+            target=self.process_request_thread, args=(request, client_address),
+            name="fake-saas", daemon=True,
+        ).start()
+
+    def wait_sessions(self, count, timeout):
+        end = time.monotonic() + timeout
+        with self.cond:
+            while len(self.sessions) < count and time.monotonic() < end:
+                self.cond.wait(0.1)
+            return len(self.sessions)
+
+    def send_job(self, device_id, event, job_id, conteudo, kind):
+        with self.cond:
+            session = self.sessions.get(device_id)
+            self.jobs[job_id] = {"kind": kind, "sent": time.perf_counter(), "ack": None, "status": None}
+        if session is None:
+            return False
+        session.send_json({"event": event, "job_id": job_id, "conteudo": conteudo})
+        return True
+
+    def on_message(self, msg):
+        if msg.get("event") != "ack":
+            return
+        with self.cond:
+            job = self.jobs.get(msg.get("job_id"))
+            if job is not None and job["ack"] is None:
+                job["ack"] = time.perf_counter()
+                job["status"] = msg.get("status")
+                self.cond.notify_all()
+
+    def wait_acks(self, timeout):
+        end = time.monotonic() + timeout
+        with self.cond:
+            while any(j["ack"] is None for j in self.jobs.values()) and time.monotonic() < end:
+                self.cond.wait(0.2)
+
+
+# --- cargas ----------------------------------------------------------------
+
+
+def _menu_items(rng, groups):
+    return [
+        {
+            "productName": rng.choice(_WORDS),
+            "quantity": rng.randint(1, 4),
+            "productValue": round(rng.uniform(4, 80), 2),
+            "grupo": rng.choice(groups),
+            "addons": [{"label": "Borda recheada", "value": 8}] if rng.random() < 0.2 else [],
+        }
+        for _ in range(rng.randint(1, 8))
+    ]
+
+
+def _print_job(rng, n):
+    return {
+        "formName": "Cardápio Digital",
+        "protocol": f"WSJ{n:06d}",
+        "responder": {"name": "Cliente Benchmark", "phone": "(11) 90000-0000"},
+        "menuItems": _menu_items(rng, _GROUPS),
+        "submittedAt": "2026-10-17T20:15:00Z",
+    }
+
+
+def _uniplus_job(rng, n):
+    return {
+        "protocol": f"UNI{n:06d}",
+        "contamesa": {"numeromesa": str(rng.randint(1, 40)), "nomecliente": "Mesa Benchmark"},
+        "itens": [],
+    }
+
+
+def _settle(farm, quiet=1.0, limit=30.0):
+    """Espera as impressoras falsas pararem de receber cupons (buffer drenado)."""
+    end = time.monotonic() + limit
+    seen = -1
+    while time.monotonic() < end:
+        with farm.lock:
+            count = len(farm.printed)
+        if count == seen:
+            return
+        seen = count
+        time.sleep(quiet)
+
+
+class _ThreadSampler:
+    """Pico de threads do agente (fora as dos servidores falsos) durante a fase."""
+
+    def __init__(self):
+        self.peak = 0
+        self.peak_by_name = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="fake-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(0.05):
+            names = Counter(
+                re.sub(r"\d+", "N", t.name) for t in threading.enumerate() if not t.name.startswith("fake-")
+            )
+            total = sum(names.values())
+            if total > self.peak:
+                self.peak = total
+                self.peak_by_name = names
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def as_dict(self):
+        return {
+            "agent_threads_peak": self.peak,
+            "agent_threads_at_peak": dict(self.peak_by_name.most_common(12)),
+        }
+
+
+def _latency(samples):
+    if not samples:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    samples = sorted(samples)
+
+    def pct(q):
+        return round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1000, 2)
+
+    return {"p50_ms": round(statistics.median(samples) * 1000, 2), "p95_ms": pct(0.95), "p99_ms": pct(0.99)}
+
+
+def _ws_phase(args, rng, farm, printers):
+    try:
+        import agent
+    except ImportError as e:
+        return {"skipped": str(e)}
+    if agent.websocket is None:
+        return {"skipped": "websocket-client não instalado"}
+
+    tokens = {p["device_id"]: p["token"] for p in printers}
+    saas = FakeSaas(tokens)
+    db.set_config("ws_url", saas.url)
+    agent.PRINTER_RECOVERY_WAIT_SECONDS = args.recovery_wait
+    agent._should_stop = False
+    threads = [
+        threading.Thread(target=agent._run_websocket, args=(p,), name=f"ws_{p['device_id']}", daemon=True)
+        for p in printers
+    ]
+    with _ThreadSampler() as sampler:
+        for t in threads:
+            t.start()
+        connected = saas.wait_sessions(len(printers), timeout=15)
+        devices = sorted(saas.sessions)
+        if not devices:
+            agent.stop_agent()
+            saas.shutdown()
+            return {"skipped": "nenhuma sessão WebSocket abriu"}
+        started = time.perf_counter()
+        for n in range(1, args.jobs + 1):
+            device_id = devices[n % len(devices)]
+            if rng.random() < args.uniplus_ratio:
+                saas.send_job(device_id, "uniplus_job", n, _uniplus_job(rng, n), "uniplus")
+            else:
+                saas.send_job(device_id, "print_job", n, _print_job(rng, n), "print")
+            if args.rate:
+                time.sleep(max(0.0, started + n / args.rate - time.perf_counter()))
+        saas.wait_acks(args.timeout)
+    _settle(farm)
+    agent.stop_agent()
+    saas.shutdown()
+
+    out = {"sessions": connected, "devices": len(printers)}
+    for kind in ("print", "uniplus"):
+        jobs = {n: j for n, j in saas.jobs.items() if j["kind"] == kind}
+        if not jobs:
+            continue
+        done = {n: j for n, j in jobs.items() if j["status"] == "done"}
+        # Vazão só dos cupons impressos (erros por timeout de impressora offline esticam a fase)
+        wall = (max(j["ack"] for j in done.values()) - started) if done else 0.0
+        row = {
+            "sent": len(jobs),
+            "done": len(done),
+            "error": sum(1 for j in jobs.values() if j["status"] not in (None, "done")),
+            "no_ack": sum(1 for j in jobs.values() if j["ack"] is None),
+            "per_sec": round(len(done) / wall, 1) if wall else 0.0,
+            **_latency([j["ack"] - j["sent"] for j in done.values()]),
+        }
+        if kind == "print":
+            row["printed"] = sum(1 for n in jobs if f"WSJ{n:06d}" in farm.printed)
+            row["lost"] = sum(1 for n in done if f"WSJ{n:06d}" not in farm.printed)
+            row["to_paper"] = _latency(
+                [farm.printed[f"WSJ{n:06d}"] - j["sent"] for n, j in jobs.items() if f"WSJ{n:06d}" in farm.printed]
+            )
+        out[kind] = row
+    out.update(sampler.as_dict())
+    return out
+
+
+def _pos_phase(args, rng, farm, printers):
+    try:
+        import pos_api
+    except ImportError as e:
+        return {"skipped": str(e)}
+
+    groups = _GROUPS[: max(1, args.pos_groups)]
+    db.set_config(
+        "pos_print_routes",
+        json.dumps([{"deviceId": p["device_id"], "groupNames": [groups[i % len(groups)]]} for i, p in enumerate(printers)]),
+    )
+    db.set_config("print_route_balance", args.balance)
+    orders = [
+        {"protocol": f"POS{n:06d}", "formName": "POS", "tableNumber": str(rng.randint(1, 40)),
+         "responder": {"name": "Mesa"}, "menuItems": _menu_items(rng, groups)}
+        for n in range(1, args.pos_orders + 1)
+    ]
+
+    def _order(payload):
+        t0 = time.perf_counter()
+        info = pos_api._print_kitchen(payload)
+        return time.perf_counter() - t0, info
+
+    with _ThreadSampler() as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.pos_concurrency, thread_name_prefix="fake-pos") as ex:
+            results = list(ex.map(_order, orders))
+        wall = time.perf_counter() - started
+    _settle(farm)
+    printed = [r for r in results if r[1].get("printed")]
+    return {
+        "orders": len(orders),
+        "balance": args.balance,
+        "printed": len(printed),
+        "failed": len(orders) - len(printed),
+        "on_paper": sum(1 for o in orders if o["protocol"] in farm.printed),
+        "per_sec": round(len(printed) / wall, 1) if wall else 0.0,
+        **_latency([seconds for seconds, _ in printed]),
+        **sampler.as_dict(),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--raw", type=int, default=3, help="impressoras RAW 9100 falsas")
+    parser.add_argument("--ipp", type=int, default=1, help="impressoras IPP falsas")
+    parser.add_argument("--refuse", type=int, default=0, help="impressoras recusando conexão")
+    parser.add_argument("--jobs", type=int, default=300, help="eventos WebSocket")
+    parser.add_argument("--rate", type=float, default=0.0, help="eventos/s (0 = rajada)")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="tempo de impressão por cupom")
+    parser.add_argument("--slow-read-kbps", type=float, default=0.0, help="leitura lenta das RAW (0 = livre)")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fração de cupons com queda (RAW) ou abortados (IPP)")
+    parser.add_argument("--uniplus-ratio", type=float, default=0.1)
+    parser.add_argument("--pos-orders", type=int, default=60)
+    parser.add_argument("--pos-concurrency", type=int, default=4)
+    parser.add_argument("--pos-groups", type=int, default=2, help="grupos das rotas POS (impressoras repartidas)")
+    parser.add_argument("--balance", default="off", choices=("off", "least_queue", "round_robin"))
+    parser.add_argument("--recovery-wait", type=float, default=5.0, help="espera por impressora offline (agent)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="espera máxima pelos ACKs")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--verbose", action="store_true", help="mostra os logs do agente")
+    parser.add_argument("--json", action="store_true", help="saída em JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    tmp = tempfile.TemporaryDirectory(prefix="bench_farm_", ignore_cleanup_errors=True)
+    db.DB_FILE = os.path.join(tmp.name, "agent.db")
+
+    farm = _Farm()
+    servers = []
+    printers = []
+    kinds = ["raw"] * args.raw + ["ipp"] * args.ipp + ["refuse"] * args.refuse
+    for i, kind in enumerate(kinds):
+        if kind == "raw":
+            srv = FakeRawPrinter(
+                farm, args.latency_ms / 1000, args.slow_read_kbps * 1024, args.drop_rate, seed=args.seed + i
+            )
+        elif kind == "ipp":
+            srv = FakeIppServer(args.latency_ms / 1000, args.drop_rate, on_data=farm.saw, seed=args.seed + i)
+        else:
+            srv = RefusingPrinter()
+        servers.append((kind, srv))
+        printers.append(
+            {
+                "device_id": f"bench-{kind}-{i}",
+                "token": f"tok-{i}",
+                "name": f"{kind.upper()} {i}",
+                "connection_type": "network",
+                "printer_ip": "127.0.0.1",
+                "printer_port": srv.port,
+                "printer_type": "ipp" if kind == "ipp" else "raw",
+            }
+        )
+
+    out = sys.stdout if args.verbose else open(os.devnull, "w")
+    if not args.verbose:
+        # websocket-client loga cada conexão pelo logging (basicConfig do agent)
+        logging.getLogger("websocket").setLevel(logging.WARNING)
+    try:
+        with contextlib.redirect_stdout(out):
+            db.init_db()
+            db.set_printers(printers)
+            printers = db.get_printers()
+            results = {
+                "config": {k: v for k, v in vars(args).items() if k not in ("json", "verbose")},
+                "ws": _ws_phase(args, rng, farm, printers),
+                "pos": _pos_phase(args, rng, farm, printers),
+            }
+    finally:
+        for _, srv in servers:
+            srv.shutdown()
+        tmp.cleanup()
+    results["printers"] = [
+        {"device_id": p["device_id"], **(srv.stats() if kind != "ipp" else {"receipts": len(srv.jobs), "bytes": srv.bytes_received})}
+        for p, (kind, srv) in zip(printers, servers)
+    ]
+
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+        return 0
+    for phase in ("ws", "pos"):
+        r = results[phase]
+        if "skipped" in r:
+            print(f"{phase}: ignorada ({r['skipped']})")
+            continue
+        rows = [("print", r["print"]), ("uniplus", r.get("uniplus"))] if phase == "ws" else [("pedidos", r)]
+        for name, row in rows:
+            if not row:
+                continue
+            print(
+                f"{phase}/{name:<8} p50 {row['p50_ms']} ms  p95 {row['p95_ms']} ms  p99 {row['p99_ms']} ms  "
+                f"{row['per_sec']}/s  ok {row.get('done', row.get('printed'))}/{row.get('sent', row.get('orders'))}"
+                f"  erro {row.get('error', row.get('failed'))}"
+                + (f"  sem ACK {row['no_ack']}" if row.get("no_ack") else "")
+                + (f"  perdidos {row['lost']}" if "lost" in row else "")
+            )
+        print(f"{phase}: pico de {r['agent_threads_peak']} threads do agente")
+    for p in results["printers"]:
+        print(f"  {p['device_id']:<16} {p['receipts']:>5} cupons")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""Benchmark: latência por cupom RAW 9100 (connect por job x pool de sockets).
+
+Sobe uma impressora falsa local (aceita conexões, consome os bytes e responde
+DLE EOT com status "online") e envia N cupons do jeito antigo (probe connect +
+connect/send/close) e pelo pool (probe reaproveitado + socket persistente).
+
+--rtt-ms soma um atraso artificial a cada handshake TCP para simular uma
+térmica no Wi-Fi (no loopback o handshake custa microssegundos).
+
+Uso:
+    python benchmarks/bench_raw_printer_pool.py [--jobs 300] [--rtt-ms 0] [--json]
+"""
+import argparse
+import json
+import os
+import socketserver
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import printer_service  # noqa: E402
+from error_recovery import ConnectionHealthChecker  # noqa: E402
+from printer_service import PrinterService, _RawSocketPool  # noqa: E402
+
+
+class _FakePrinterHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        while True:
+            try:
+                data = sock.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+            self.server.bytes_received += len(data)
+            if b"\x10\x04\x01" in data:
+                sock.sendall(b"\x12")
+
+
+class FakePrinter(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _FakePrinterHandler)
+        self.bytes_received = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+def _slow_pool(idle_seconds: float, rtt: float) -> _RawSocketPool:
+    class _Pool(_RawSocketPool):
+        def _connect(self, host, port, timeout):
+            time.sleep(rtt)
+            return super()._connect(host, port, timeout)
+
+    return _Pool(idle_seconds=idle_seconds)
+
+
+def _run(mode: str, port: int, jobs: int, rtt: float) -> dict:
+    pooled = mode == "pooled"
+    printer_service._raw_pool = _slow_pool(printer_service.RAW_POOL_IDLE_SECONDS if pooled else 0, rtt)
+    svc = PrinterService(printer_ip="127.0.0.1", printer_port=port, max_retries=0)
+    text = "\n".join(f"1x ITEM {i:03d}  R$ 10,00" for i in range(25))
+    samples = []
+    for _ in range(jobs):
+        t0 = time.perf_counter()
+        if pooled:
+            ok = printer_service.probe_raw_printer("127.0.0.1", port)
+        else:
+            time.sleep(rtt)
+            ok = ConnectionHealthChecker.check_printer_connection("127.0.0.1", port)
+        ok = ok and svc._print_via_raw(text)
+        samples.append((time.perf_counter() - t0) * 1000)
+        if not ok:
+            raise RuntimeError(f"falha ao imprimir no modo {mode}")
+    stats = printer_service.raw_pool_stats()
+    printer_service._raw_pool.discard()
+    samples.sort()
+    return {
+        "jobs": jobs,
+        "tcp_connects": stats["connects"] + (0 if pooled else jobs),
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3),
+        "mean_ms": round(statistics.fmean(samples), 3),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=300)
+    parser.add_argument("--rtt-ms", type=float, default=0.0, help="atraso simulado por handshake TCP")
+    parser.add_argument("--json", action="store_true", help="saída em JSON")
+    args = parser.parse_args()
+
+    fake = FakePrinter()
+    # _print_via_raw imprime uma linha por cupom; silencia durante a medição
+    printer_service.print = lambda *a, **k: None
+    try:
+        results = {
+            "per_job": _run("per_job", fake.port, args.jobs, args.rtt_ms / 1000),
+            "pooled": _run("pooled", fake.port, args.jobs, args.rtt_ms / 1000),
+        }
+    finally:
+        del printer_service.print
+        fake.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, r in results.items():
+            print(
+                f"{name:>8}: p50 {r['p50_ms']:7.3f} ms  p95 {r['p95_ms']:7.3f} ms  "
+                f"{r['tcp_connects']} connects/{r['jobs']} cupons"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
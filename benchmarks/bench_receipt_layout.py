@@ -0,0 +1,136 @@
+"""Benchmark: renderização de cupons (texto + encode x layout compilado em bytes).
+
+Gera N cupons variados (mesa/delivery, meio a meio, combos, adicionais, observações
+longas, acentos e emoji) em 32/48 colunas, escalas 1-3 e os quatro encodings, confere
+que o layout compilado produz exatamente os mesmos bytes e mede o throughput.
+
+Uso:
+    python benchmarks/bench_receipt_layout.py [--receipts 10000] [--seed 7] [--rounds 3] [--encoding cp850] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from printer_service import PrinterService, _resolve_font_scale  # noqa: E402
+
+_WORDS = [
+    "PIZZA", "Calabresa", "Frango c/ Catupiry", "Açaí", "Pão de Queijo", "Coração",
+    "X-Tudo", "Refrigerante", "Limão", "Guaraná", "Feijoada", "Porção", "Maçã",
+    "Strogonoff", "Parmegiana", "Batata", "Café", "Suco de Maracujá", "🍕", "Crème brûlée",
+]
+_GROUPS = ["Pizzas", "Bebidas", "Lanches", "Sobremesas", "Porções", "Pratos do Dia"]
+_ENCODINGS = ["cp850", "cp860", "cp1252", "utf8"]
+
+
+def _phrase(rng, lo, hi):
+    return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(lo, hi)))
+
+
+def _item(rng):
+    addons = [
+        {"label": _phrase(rng, 1, 3), "value": rng.choice([0, 1.5, 2, 3.75])}
+        for _ in range(rng.randint(0, 3))
+    ]
+    item = {
+        "name": _phrase(rng, 1, 6),
+        "quantity": rng.randint(1, 12),
+        "value": round(rng.uniform(2, 120) + sum(a["value"] for a in addons), 2),
+        "addons": addons,
+        "observation": _phrase(rng, 0, 14) if rng.random() < 0.4 else "",
+    }
+    if rng.random() < 0.15:
+        item["type"] = "halfAndHalf"
+        item["half_lines"] = [f"1/2 {_phrase(rng, 1, 4)}" for _ in range(2)]
+    if rng.random() < 0.15:
+        item["combo_items"] = [
+            {"name": _phrase(rng, 1, 3), "quantity": rng.randint(1, 3), "value": rng.choice([0, 4.5])}
+            for _ in range(rng.randint(1, 3))
+        ]
+    return item
+
+
+def _receipt(rng):
+    mesa = rng.random() < 0.3
+    delivery = not mesa and rng.random() < 0.5
+    groups = rng.sample(_GROUPS, rng.randint(1, 4))
+    total = round(rng.uniform(10, 900), 2)
+    receipt = {
+        "form_name": _phrase(rng, 1, 4),
+        "protocol": f"{rng.randint(1, 99999):05d}" if rng.random() < 0.9 else "",
+        "date": "17/10/2026 20:15:00",
+        "table_number": str(rng.randint(1, 60)) if mesa else "",
+        "garcom_name": _phrase(rng, 1, 2) if mesa and rng.random() < 0.7 else "",
+        "customer": {
+            "name": _phrase(rng, 1, 4),
+            "phone": "(11) 9" + str(rng.randint(10000000, 99999999)) if rng.random() < 0.7 else "",
+            "email": "cliente@exemplo.com.br" if rng.random() < 0.3 else "",
+        },
+        "custom_info": {"Endereço": _phrase(rng, 2, 12)} if rng.random() < 0.5 else {},
+        "items_by_group": {g: [_item(rng) for _ in range(rng.randint(1, 5))] for g in groups},
+        "total": total,
+        "subtotal": round(total - (6.5 if delivery else 0), 2),
+        "delivery_fee": 6.5 if delivery and rng.random() < 0.7 else 0,
+        "delivery_scan_url": "https://exemplo.com/r/abc" if delivery else "",
+        "font_scale": rng.choice([1, 1, 1, 2, 3]),
+        "is_pickup": False,
+    }
+    return receipt
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--receipts", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--encoding", choices=_ENCODINGS, help="só um encoding (padrão: sorteia os quatro)")
+    parser.add_argument("--json", action="store_true", help="saída em JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cases = []
+    for _ in range(args.receipts):
+        svc = PrinterService(
+            printer_ip="127.0.0.1",
+            paper_width=rng.choice([32, 48]),
+            printer_encoding=args.encoding or rng.choice(_ENCODINGS),
+        )
+        cases.append((svc, _receipt(rng)))
+
+    legacy_s = compiled_s = float("inf")
+    # Melhor de N rodadas intercaladas: a máquina do caixa também roda outras coisas
+    for _ in range(max(1, args.rounds)):
+        t0 = time.perf_counter()
+        legacy = [svc._encode_text_with_fallback(svc._generate_receipt_text(r)) for svc, r in cases]
+        legacy_s = min(legacy_s, time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        compiled = [svc._render_receipt_bytes(r, _resolve_font_scale(r)) for svc, r in cases]
+        compiled_s = min(compiled_s, time.perf_counter() - t0)
+
+    mismatches = sum(1 for a, b in zip(legacy, compiled) if a != b)
+    results = {
+        "receipts": args.receipts,
+        "mismatches": mismatches,
+        "bytes": sum(len(b) for b in compiled),
+        "layouts": len({(svc.paper_width, _resolve_font_scale(r), svc.printer_encoding) for svc, r in cases}),
+        "legacy_receipts_per_s": round(args.receipts / legacy_s),
+        "compiled_receipts_per_s": round(args.receipts / compiled_s),
+        "speedup": round(legacy_s / compiled_s, 2),
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"cupons: {results['receipts']}  divergências: {results['mismatches']}")
+        print(f"  texto+encode: {results['legacy_receipts_per_s']:>8} cupons/s")
+        print(f"  compilado   : {results['compiled_receipts_per_s']:>8} cupons/s  ({results['speedup']}x)")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
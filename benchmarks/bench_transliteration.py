@@ -0,0 +1,149 @@
+"""Benchmark: transliteração por code page (encode "replace" x tabelas pré-calculadas).
+
+Primeiro faz um fuzz das tabelas de EncodingFallback: textos aleatórios (ASCII,
+acentos, aspas curvas, travessões, emoji com seletores/ZWJ, grego, CJK, marcas
+combinantes) codificados de uma vez têm de bater com o oráculo caractere a
+caractere, e cada caractere vira no máximo um byte (o layout alinha por len()).
+Depois mede o throughput de textos de cupom em três caminhos:
+
+    replace    text.encode(enc, "replace") — caminho antigo, tudo fora vira "?"
+    translate  str.translate(tabela) + encode — uma passada no texto inteiro
+    handler    encode com o error handler da tabela — o que o agente usa
+
+Uso:
+    python benchmarks/bench_transliteration.py [--texts 5000] [--fuzz 5000] [--seed 7] [--rounds 3] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from error_recovery import EncodingFallback  # noqa: E402
+
+_ENCODINGS = ("cp850", "cp860", "cp1252")
+_FUZZ_POOLS = [
+    [chr(c) for c in range(0x20, 0x7F)],
+    [chr(c) for c in range(0xA0, 0x250)],
+    [chr(c) for c in range(0x2000, 0x2070)] + ["€", "™", "←", "→", "●"],
+    [chr(c) for c in range(0x1F300, 0x1F6FF)] + ["‍", "️", "\U0001F3FD"],
+    [chr(c) for c in range(0x0300, 0x0370)] + [chr(c) for c in range(0x0391, 0x03CA)],
+    [chr(c) for c in range(0x4E00, 0x4E80)] + [chr(c) for c in range(0xFF01, 0xFF5F)],
+]
+_WORDS = [
+    "Pizza", "Calabresa", "Açaí", "Pão de Queijo", "Coração", "Limão", "Guaraná", "Porção",
+    "Maçã", "Crème brûlée", "X-Tudo", "Refrigerante", "Feijoada", "entregar no 2º andar",
+    "Não tocar a campainha", "troco p/ R$ 50", "sem cebola", "bem passado",
+]
+# Colados do WhatsApp/app: aparecem em ~1 de cada 10 palavras
+_EXOTIC = ["“sem cebola”", "bem passado…", "cartão – débito", "🍕", "🍔🍟", "❤️", "👍🏽", "‘caprichado’"]
+
+
+def _fuzz_text(rng):
+    return "".join(rng.choice(rng.choice(_FUZZ_POOLS)) for _ in range(rng.randint(0, 40)))
+
+
+def _oracle(text, encoding, table):
+    """Bytes esperados, caractere a caractere."""
+    out = []
+    for ch in text:
+        try:
+            out.append(ch.encode(encoding))
+            continue
+        except UnicodeEncodeError:
+            pass
+        if ord(ch) in table:
+            out.append((table[ord(ch)] or "").encode(encoding))
+        else:
+            out.append(b"?")
+    return b"".join(out)
+
+
+def _fuzz(rng, count):
+    failures = []
+    for encoding in _ENCODINGS:
+        table = EncodingFallback.TRANSLIT_TABLES[encoding]
+        for cp, sub in table.items():
+            if sub is not None and (len(sub) != 1 or len(sub.encode(encoding)) != 1):
+                failures.append(f"{encoding}: U+{cp:04X} -> {sub!r} não é 1 byte")
+        for _ in range(count):
+            text = _fuzz_text(rng)
+            got, used = EncodingFallback.encode_with_fallback(text, encoding)
+            dropped = sum(1 for ch in text if ord(ch) in table and table[ord(ch)] is None)
+            if used != encoding or got != _oracle(text, encoding, table):
+                failures.append(f"{encoding}: {text!r}")
+            elif len(got) != len(text) - dropped:
+                failures.append(f"{encoding}: largura {len(got)} != {len(text) - dropped} em {text!r}")
+    return failures
+
+
+def _receipt_text(rng):
+    lines = []
+    for _ in range(rng.randint(15, 40)):
+        line = " ".join(
+            rng.choice(_EXOTIC if rng.random() < 0.1 else _WORDS) for _ in range(rng.randint(1, 5))
+        )
+        lines.append(line[:48].ljust(34) + f" {rng.randint(1, 9)}x R$ {rng.uniform(2, 90):.2f}")
+    return "\n".join(lines)
+
+
+def _time(fn, texts, rounds):
+    best = float("inf")
+    out = None
+    for _ in range(max(1, rounds)):
+        t0 = time.perf_counter()
+        out = [fn(t) for t in texts]
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--texts", type=int, default=5000, help="textos de cupom por encoding")
+    parser.add_argument("--fuzz", type=int, default=5000, help="strings aleatórias por encoding")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="saída em JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    failures = _fuzz(rng, args.fuzz)
+    texts = [_receipt_text(rng) for _ in range(args.texts)]
+    chars = sum(len(t) for t in texts)
+
+    results = {"fuzz_cases": args.fuzz * len(_ENCODINGS), "fuzz_failures": len(failures), "encodings": {}}
+    for encoding in _ENCODINGS:
+        table = EncodingFallback.TRANSLIT_TABLES[encoding]
+        errors = EncodingFallback.errors_for(encoding)
+        paths = {
+            "replace": lambda t: t.encode(encoding, errors="replace"),
+            "translate": lambda t: t.translate(table).encode(encoding, errors="replace"),
+            "handler": lambda t: t.encode(encoding, errors=errors),
+        }
+        row = {}
+        for name, fn in paths.items():
+            seconds, out = _time(fn, texts, args.rounds)
+            row[name] = {
+                "mchars_per_s": round(chars / seconds / 1e6, 2),
+                "question_marks": sum(b.count(b"?") for b in out),
+            }
+        results["encodings"][encoding] = row
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"fuzz: {results['fuzz_cases']} casos, {len(failures)} falhas")
+        for failure in failures[:10]:
+            print(f"  {failure}")
+        for encoding, row in results["encodings"].items():
+            print(encoding)
+            for name, r in row.items():
+                print(f"  {name:>9}: {r['mchars_per_s']:6.2f} Mchar/s  {r['question_marks']:>7} '?' impressos")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,18 @@
 """Módulo de banco de dados SQLite para o Print Agent."""
 import sqlite3
 import json
+import atexit
+import gzip
+import hashlib
 import os
+import re
+import shutil
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional
 
 from error_recovery import (
     DatabaseRecovery,
@@ -37,29 +46,417 @@ DEFAULT_CONFIG = {
     "pos_catalog_updated_at": "",
     "pos_last_sync_error": "",
     "uniplus_mesa_tipopedido": "1",
+    # Retenção (retention.py): 0 desliga a política
+    "log_retention_days": "90",
+    "log_retention_max_rows": "200000",
+    "pos_orders_retention_days": "30",
+    "retention_archive": "false",
+    "retention_last_report": "",
+    # Admin: compacta (VACUUM completo) no próximo start, mesmo com banco grande
+    "db_compact_on_startup": "false",
+    # Menor "since" que o log de mudanças do catálogo POS ainda atende
+    "pos_changelog_floor": "",
+    "print_coalesce_window_ms": "0",
+    # Impressoras com a mesma rota: off (todas imprimem) | least_queue | round_robin
+    "print_route_balance": "off",
 }
 PRINTER_KEYS = ("device_id", "token", "printer_ip", "printer_port", "printer_type", "paper_width", "printer_encoding", "name", "connection_type", "printer_name_local")
+# Conexões ociosas mantidas abertas (waitress usa ~16 threads; agente/sync algumas mais)
+POOL_MAX_IDLE = 8
+# Gravador assíncrono de print_logs
+LOG_QUEUE_MAX = 10000
+LOG_BATCH_SIZE = 100
+LOG_FLUSH_INTERVAL = 0.5
+
+
+class _ConnectionPool:
+    """Pool de conexões SQLite reutilizáveis (checkout/checkin).
+
+    Cada conexão recebe os PRAGMAs uma única vez, ao ser aberta. A validação
+    do arquivo (e backup) só roda quando uma operação falha com erro de banco.
+    """
+
+    def __init__(self, db_file: str, max_idle: int = POOL_MAX_IDLE):
+        self.db_file = db_file
+        self.max_idle = max(0, int(max_idle))
+        self._idle: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def _open(self) -> sqlite3.Connection:
+        # check_same_thread=False: a conexão muda de thread entre checkouts,
+        # mas nunca é usada por duas threads ao mesmo tempo.
+        conn = sqlite3.connect(self.db_file, timeout=10.0, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # Arquivo novo já nasce INCREMENTAL (antes do WAL criar o arquivo); em
+        # banco existente não muda nada sem VACUUM (ver ensure_incremental_vacuum)
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # Habilitar WAL mode para melhor concorrência
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()
+            self.opened += 1
+        return self._open()
+
+    def release(self, conn: sqlite3.Connection, *, broken: bool = False) -> None:
+        if not broken and conn.in_transaction:
+            # Transação esquecida aberta não pode vazar para o próximo checkout
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
+        if not broken:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(conn)
+                    return
+        else:
+            with self._lock:
+                self.discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
 
+    def close_all(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "opened": self.opened,
+                "reused": self.reused,
+                "discarded": self.discarded,
+                "idle": len(self._idle),
+            }
 
-def _get_connection():
-    """Retorna conexão com o banco."""
-    # Validar conexão antes de retornar
-    if not DatabaseRecovery.validate_db_connection(DB_FILE):
-        # Tentar criar backup e recriar banco se necessário
-        print(f"[WARN] Problema detectado no banco de dados. Tentando recuperar...")
-        DatabaseRecovery.backup_db(DB_FILE)
-    
-    conn = sqlite3.connect(DB_FILE, timeout=10.0)  # Timeout aumentado
-    conn.row_factory = sqlite3.Row
-    # Habilitar WAL mode para melhor concorrência
-    conn.execute("PRAGMA journal_mode=WAL")
-    return conn
+
+_pool: Optional[_ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> _ConnectionPool:
+    """Pool do DB_FILE atual (recriado se DB_FILE mudar, ex.: benchmarks)."""
+    global _pool
+    pool = _pool
+    if pool is not None and pool.db_file == DB_FILE:
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool.db_file != DB_FILE:
+            if _pool is not None:
+                _pool.close_all()
+            _pool = _ConnectionPool(DB_FILE)
+        return _pool
+
+
+def _is_busy_error(exc: Exception) -> bool:
+    msg = str(exc).lower()
+    return "locked" in msg or "busy" in msg
+
+
+@contextmanager
+def _connection():
+    """Empresta uma conexão do pool; devolve ao sair do bloco.
+
+    Erro de banco (exceto lock/busy) descarta a conexão e dispara a
+    validação/backup que antes rodava a cada chamada.
+    """
+    pool = _get_pool()
+    conn = pool.acquire()
+    broken = False
+    try:
+        yield conn
+    except sqlite3.DatabaseError as exc:
+        if not _is_busy_error(exc):
+            broken = True
+            if not DatabaseRecovery.validate_db_connection(pool.db_file):
+                print("[WARN] Problema detectado no banco de dados. Tentando recuperar...")
+                DatabaseRecovery.backup_db(pool.db_file)
+        raise
+    finally:
+        pool.release(conn, broken=broken)
+
+
+def connection_stats() -> Dict[str, int]:
+    """Contadores do pool (conexões abertas, reutilizadas, descartadas, ociosas)."""
+    return _get_pool().stats()
+
+
+def close_connections() -> None:
+    """Fecha as conexões ociosas do pool (shutdown)."""
+    if _pool is not None:
+        _pool.close_all()
+
+
+# Chaves que alteram o resultado de get_printers()
+_PRINTER_CONFIG_KEYS = frozenset((
+    "printers", "device_id", "token", "printer_ip", "printer_port",
+    "printer_type", "paper_width", "printer_encoding",
+))
+
+
+# Serializa gravação de config no SQLite + troca do cache (ordem dos commits)
+_config_write_lock = threading.RLock()
+
+
+class _ConfigCache:
+    """Cópia em memória da tabela config (write-through).
+
+    Carregada uma vez do SQLite; set_config grava no banco e depois troca o
+    snapshot inteiro (copy-on-write), então leitores nunca veem estado parcial.
+    Gravação + stage() rodam sob _config_write_lock: o cache segue a ordem dos
+    commits. notify() roda depois, fora do lock.
+    O cache é por processo: edições externas no agent.db exigem
+    invalidate_config_cache().
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._values: Optional[Dict[str, Any]] = None
+        self._db_file: Optional[str] = None
+        self._printers: Optional[List[Dict[str, Any]]] = None
+        self._subscribers: List[tuple] = []
+
+    def snapshot(self) -> Dict[str, Any]:
+        values = self._values
+        if values is not None and self._db_file == DB_FILE:
+            return values
+        with self._lock:
+            if self._values is None or self._db_file != DB_FILE:
+                with _connection() as conn:
+                    rows = conn.execute("SELECT key, value FROM config").fetchall()
+                loaded = dict(DEFAULT_CONFIG)
+                for row in rows:
+                    loaded[row[0]] = row[1]
+                self._values = loaded
+                self._db_file = DB_FILE
+                self._printers = None
+            return self._values
+
+    def printers(self, parse: Callable[[], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        self.snapshot()
+        cached = self._printers
+        if cached is not None:
+            return cached
+        with self._lock:
+            if self._printers is None:
+                self._printers = parse()
+            return self._printers
+
+    def stage(self, updates: Dict[str, Any]) -> Dict[str, Any]:
+        """Troca o snapshot; retorna só as chaves que mudaram (para notify)."""
+        with self._lock:
+            current = self.snapshot()
+            changes = {k: v for k, v in updates.items() if current.get(k) != v}
+            if not changes:
+                return changes
+            values = dict(current)
+            values.update(changes)
+            self._values = values
+            if _PRINTER_CONFIG_KEYS.intersection(changes):
+                self._printers = None
+            return changes
+
+    def notify(self, changes: Dict[str, Any]) -> None:
+        if not changes:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+            values = self._values or {}
+        # Valor atual, não o desta gravação: com escritores concorrentes a
+        # última notificação nunca traz um valor já sobrescrito
+        changes = {k: values.get(k, v) for k, v in changes.items()}
+        # Callbacks fora do lock: podem ler/gravar config livremente
+        for callback, keys in subscribers:
+            if keys is not None and keys.isdisjoint(changes):
+                continue
+            try:
+                callback(dict(changes))
+            except Exception as e:
+                print(f"[WARN] Callback de config falhou ({getattr(callback, '__name__', callback)}): {e}")
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._values = None
+            self._printers = None
+
+    def subscribe(self, callback, keys=None) -> Callable[[], None]:
+        entry = (callback, frozenset(keys) if keys is not None else None)
+        with self._lock:
+            self._subscribers.append(entry)
+
+        def _unsubscribe():
+            with self._lock:
+                if entry in self._subscribers:
+                    self._subscribers.remove(entry)
+
+        return _unsubscribe
+
+
+_config_cache = _ConfigCache()
+
+# DB_FILE -> print_logs_fts existe (SQLite sem FTS5 usa LIKE)
+_fts_by_db_file: Dict[str, bool] = {}
+
+
+# Tabelas do catálogo POS; replace_pos_catalog monta cópias <tabela>_new e troca
+_POS_CATALOG_DDL = {
+    "pos_users": """
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            pin TEXT,
+            profile TEXT,
+            payload TEXT
+        )
+    """,
+    "pos_mesas": """
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY,
+            number TEXT,
+            name TEXT,
+            type TEXT,
+            status TEXT,
+            form_id INTEGER,
+            contact_name TEXT,
+            display_order INTEGER,
+            section TEXT
+        )
+    """,
+    "pos_products": """
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY,
+            payload TEXT
+        )
+    """,
+    "pos_groups": """
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY,
+            kind TEXT,
+            payload TEXT
+        )
+    """,
+    "pos_printers": """
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY,
+            device_id TEXT,
+            name TEXT
+        )
+    """,
+    "pos_entity_hashes": """
+        CREATE TABLE IF NOT EXISTS {table} (
+            entity TEXT NOT NULL,
+            id TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            PRIMARY KEY (entity, id)
+        )
+    """,
+}
+
+
+def _backfill_print_log_columns(conn: sqlite3.Connection) -> None:
+    """Normaliza status/kind e extrai protocol de logs gravados antes da migração."""
+    conn.execute(
+        "UPDATE print_logs SET status = lower(trim(status)), kind = lower(ifnull(kind, 'print'))"
+    )
+    try:
+        conn.execute(
+            "UPDATE print_logs SET protocol = json_extract(detail, '$.protocol') "
+            "WHERE detail LIKE '{%' AND json_valid(detail)"
+        )
+    except sqlite3.OperationalError as e:
+        # SQLite sem JSON1: logs antigos ficam sem protocol
+        print(f"[WARN] Backfill de protocol em print_logs ignorado: {e}")
+
+
+def _init_print_log_search(conn: sqlite3.Connection) -> None:
+    """Índices, contadores por status (via trigger) e FTS5 de print_logs."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_print_logs_status_id ON print_logs(status, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_print_logs_kind_id ON print_logs(kind, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_print_logs_created_at ON print_logs(created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_print_logs_protocol ON print_logs(protocol)")
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS print_log_counters (
+            status TEXT PRIMARY KEY,
+            n INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.executescript("""
+        CREATE TRIGGER IF NOT EXISTS print_logs_count_ai AFTER INSERT ON print_logs BEGIN
+            INSERT OR IGNORE INTO print_log_counters (status, n) VALUES (new.status, 0);
+            UPDATE print_log_counters SET n = n + 1 WHERE status = new.status;
+        END;
+        CREATE TRIGGER IF NOT EXISTS print_logs_count_ad AFTER DELETE ON print_logs BEGIN
+            UPDATE print_log_counters SET n = n - 1 WHERE status = old.status;
+        END;
+        CREATE TRIGGER IF NOT EXISTS print_logs_count_au AFTER UPDATE OF status ON print_logs BEGIN
+            UPDATE print_log_counters SET n = n - 1 WHERE status = old.status;
+            INSERT OR IGNORE INTO print_log_counters (status, n) VALUES (new.status, 0);
+            UPDATE print_log_counters SET n = n + 1 WHERE status = new.status;
+        END;
+    """)
+    # Recontagem no startup (uma varredura do índice) corrige qualquer desvio
+    conn.execute("DELETE FROM print_log_counters")
+    conn.execute(
+        "INSERT INTO print_log_counters (status, n) "
+        "SELECT status, COUNT(*) FROM print_logs GROUP BY status"
+    )
+    conn.commit()
+
+    has_fts = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'print_logs_fts'"
+    ).fetchone() is not None
+    if not has_fts:
+        try:
+            conn.execute("""
+                CREATE VIRTUAL TABLE print_logs_fts USING fts5(
+                    job_id, message, detail, protocol,
+                    content='print_logs', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                )
+            """)
+        except sqlite3.OperationalError as e:
+            # SQLite sem FTS5: busca cai no LIKE
+            print(f"[WARN] FTS5 indisponível, busca de logs usa LIKE: {e}")
+            return
+        conn.execute("INSERT INTO print_logs_fts (print_logs_fts) VALUES ('rebuild')")
+    conn.executescript("""
+        CREATE TRIGGER IF NOT EXISTS print_logs_fts_ai AFTER INSERT ON print_logs BEGIN
+            INSERT INTO print_logs_fts (rowid, job_id, message, detail, protocol)
+            VALUES (new.id, new.job_id, new.message, new.detail, new.protocol);
+        END;
+        CREATE TRIGGER IF NOT EXISTS print_logs_fts_ad AFTER DELETE ON print_logs BEGIN
+            INSERT INTO print_logs_fts (print_logs_fts, rowid, job_id, message, detail, protocol)
+            VALUES ('delete', old.id, old.job_id, old.message, old.detail, old.protocol);
+        END;
+        CREATE TRIGGER IF NOT EXISTS print_logs_fts_au AFTER UPDATE ON print_logs BEGIN
+            INSERT INTO print_logs_fts (print_logs_fts, rowid, job_id, message, detail, protocol)
+            VALUES ('delete', old.id, old.job_id, old.message, old.detail, old.protocol);
+            INSERT INTO print_logs_fts (rowid, job_id, message, detail, protocol)
+            VALUES (new.id, new.job_id, new.message, new.detail, new.protocol);
+        END;
+    """)
+    conn.commit()
+    _fts_by_db_file[DB_FILE] = True
 
 
 def init_db():
     """Inicializa tabelas do banco de dados."""
-    conn = _get_connection()
-    try:
+    with _connection() as conn:
         conn.execute("""
             CREATE TABLE IF NOT EXISTS config (
                 key TEXT PRIMARY KEY,
@@ -86,6 +483,10 @@ def init_db():
             conn.execute("ALTER TABLE print_logs ADD COLUMN kind TEXT DEFAULT 'print'")
         if "detail" not in cols:
             conn.execute("ALTER TABLE print_logs ADD COLUMN detail TEXT")
+        if "protocol" not in cols:
+            conn.execute("ALTER TABLE print_logs ADD COLUMN protocol TEXT")
+            _backfill_print_log_columns(conn)
+        _init_print_log_search(conn)
         conn.execute("""
             CREATE TABLE IF NOT EXISTS uniplus_sync_products (
                 codigo TEXT PRIMARY KEY,
@@ -97,56 +498,27 @@ def init_db():
                 last_error TEXT
             )
         """)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS pos_users (
-                id INTEGER PRIMARY KEY,
-                name TEXT,
-                pin TEXT,
-                profile TEXT,
-                payload TEXT
-            )
-        """)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS pos_mesas (
-                id INTEGER PRIMARY KEY,
-                number TEXT,
-                name TEXT,
-                type TEXT,
-                status TEXT,
-                form_id INTEGER,
-                contact_name TEXT,
-                display_order INTEGER,
-                section TEXT
-            )
-        """)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS pos_products (
-                id INTEGER PRIMARY KEY,
-                payload TEXT
-            )
-        """)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS pos_groups (
-                id INTEGER PRIMARY KEY,
-                kind TEXT,
-                payload TEXT
-            )
-        """)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS pos_printers (
-                id INTEGER PRIMARY KEY,
-                device_id TEXT,
-                name TEXT
-            )
-        """)
+        for table, ddl in _POS_CATALOG_DDL.items():
+            conn.execute(ddl.format(table=table))
         conn.execute("""
             CREATE TABLE IF NOT EXISTS pos_images (
                 id TEXT PRIMARY KEY,
                 url TEXT,
                 hash TEXT,
-                path TEXT
+                path TEXT,
+                etag TEXT,
+                last_modified TEXT
             )
         """)
+        image_cols = {
+            row[1]
+            for row in conn.execute("PRAGMA table_info(pos_images)").fetchall()
+        }
+        # Validadores HTTP para download condicional (bancos antigos)
+        if "etag" not in image_cols:
+            conn.execute("ALTER TABLE pos_images ADD COLUMN etag TEXT")
+        if "last_modified" not in image_cols:
+            conn.execute("ALTER TABLE pos_images ADD COLUMN last_modified TEXT")
         conn.execute("""
             CREATE TABLE IF NOT EXISTS pos_orders_queue (
                 client_order_id TEXT PRIMARY KEY,
@@ -154,6 +526,22 @@ def init_db():
                 result_json TEXT
             )
         """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_pos_orders_queue_created_at ON pos_orders_queue(created_at)"
+        )
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS pos_catalog_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                catalog_version INTEGER NOT NULL,
+                entity TEXT NOT NULL,
+                entity_id TEXT NOT NULL,
+                op TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_pos_catalog_changes_version ON pos_catalog_changes(catalog_version)"
+        )
         conn.commit()
 
         cursor = conn.execute("SELECT COUNT(*) FROM config")
@@ -181,16 +569,15 @@ def init_db():
                 "UPDATE config SET value = '1' WHERE key = 'uniplus_mesa_tipopedido'"
             )
             conn.commit()
-    finally:
-        conn.close()
+    # init_db grava config direto no SQLite
+    _config_cache.invalidate()
 
 
 # --- Sync de produtos UniPlus → Compuchat ---
 
 
 def list_sync_products(enabled_only: bool = False) -> List[Dict[str, Any]]:
-    conn = _get_connection()
-    try:
+    with _connection() as conn:
         sql = (
             "SELECT codigo, nome, preco, fingerprint, enabled, last_synced_at, last_error "
             "FROM uniplus_sync_products"
@@ -211,13 +598,10 @@ def list_sync_products(enabled_only: bool = False) -> List[Dict[str, Any]]:
             }
             for r in rows
         ]
-    finally:
-        conn.close()
 
 
 def get_sync_product(codigo: str) -> Optional[Dict[str, Any]]:
-    conn = _get_connection()
-    try:
+    with _connection() as conn:
         row = conn.execute(
             "SELECT codigo, nome, preco, fingerprint, enabled, last_synced_at, last_error "
             "FROM uniplus_sync_products WHERE codigo = ?",
@@ -234,8 +618,6 @@ def get_sync_product(codigo: str) -> Optional[Dict[str, Any]]:
             "last_synced_at": row[5],
             "last_error": row[6] or "",
         }
-    finally:
-        conn.close()
 
 
 def set_sync_product_enabled(
@@ -248,8 +630,7 @@ def set_sync_product_enabled(
     codigo = str(codigo).strip()
     if not codigo:
         return
-    conn = _get_connection()
-    try:
+    with _connection() as conn:
         existing = conn.execute(
             "SELECT codigo FROM uniplus_sync_products WHERE codigo = ?", (codigo,)
         ).fetchone()
@@ -267,8 +648,6 @@ def set_sync_product_enabled(
                 (codigo, nome or "", float(preco or 0), 1 if enabled else 0),
             )
         conn.commit()
-    finally:
-        conn.close()
 
 
 def update_sync_product_state(
@@ -283,8 +662,7 @@ def update_sync_product_state(
     codigo = str(codigo).strip()
     if not codigo:
         return
-    conn = _get_connection()
-    try:
+    with _connection() as conn:
         sets = []
         params: list = []
         if nome is not None:
@@ -309,8 +687,6 @@ def update_sync_product_state(
             params,
         )
         conn.commit()
-    finally:
-        conn.close()
 
 
 def get_enabled_sync_codigos() -> List[str]:
@@ -318,19 +694,27 @@ def get_enabled_sync_codigos() -> List[str]:
 
 
 def get_config(key: str) -> str:
-    """Retorna valor de uma chave de configuração."""
-    conn = _get_connection()
+    """Retorna valor de uma chave de configuração (do cache em memória)."""
+    values = _config_cache.snapshot()
+    if key in values:
+        return values[key]
+    return DEFAULT_CONFIG.get(key, "")
+
+
+def get_config_bool(key: str, default: bool = False) -> bool:
+    """Valor booleano da config ("true", "1", "yes", "on")."""
+    raw = get_config(key)
+    if raw is None or not str(raw).strip():
+        return default
+    return str(raw).strip().lower() in ("true", "1", "yes", "on")
+
+
+def get_config_int(key: str, default: int = 0) -> int:
+    """Valor inteiro da config; default se vazio/inválido."""
     try:
-        cursor = conn.execute(
-            "SELECT value FROM config WHERE key = ?", (key,)
-        )
-        row = cursor.fetchone()
-        if row:
-            return row[0]
-        default = DEFAULT_CONFIG.get(key, "")
+        return int(str(get_config(key)).strip())
+    except (TypeError, ValueError):
         return default
-    finally:
-        conn.close()
 
 
 def set_config(key: str, value: str) -> None:
@@ -342,8 +726,7 @@ def set_config(key: str, value: str) -> None:
         retryable_exceptions=(sqlite3.OperationalError, sqlite3.DatabaseError)
     ))
     def _save_config():
-        conn = _get_connection()
-        try:
+        with _connection() as conn:
             print(f"[DEBUG] set_config: key={key}, value_length={len(str(value))}")
             conn.execute(
                 "INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)",
@@ -351,28 +734,162 @@ def set_config(key: str, value: str) -> None:
             )
             conn.commit()
             print(f"[DEBUG] set_config: valor salvo com sucesso")
-        finally:
-            conn.close()
     
-    try:
-        _save_config()
-    except Exception as e:
-        print(f"[ERROR] set_config: erro ao salvar após múltiplas tentativas - {str(e)}")
-        raise
+    with _config_write_lock:
+        try:
+            _save_config()
+        except Exception as e:
+            print(f"[ERROR] set_config: erro ao salvar após múltiplas tentativas - {str(e)}")
+            raise
+        # Write-through: cache só muda depois do commit, ainda sob o lock
+        changes = _config_cache.stage({key: str(value)})
+    _config_cache.notify(changes)
 
 
 def get_all_config() -> dict:
     """Retorna todas as configurações como dicionário."""
-    conn = _get_connection()
-    try:
-        cursor = conn.execute("SELECT key, value FROM config")
-        rows = cursor.fetchall()
-        result = dict(DEFAULT_CONFIG)
-        for row in rows:
-            result[row[0]] = row[1]
-        return result
-    finally:
-        conn.close()
+    return dict(_config_cache.snapshot())
+
+
+def subscribe_config(
+    callback: Callable[[Dict[str, str]], None],
+    keys: Optional[Iterable[str]] = None,
+) -> Callable[[], None]:
+    """Registra callback(changes) chamado quando chaves de config mudam de valor.
+
+    keys=None recebe todas as mudanças. Retorna função que cancela a inscrição.
+    """
+    return _config_cache.subscribe(callback, keys)
+
+
+def invalidate_config_cache() -> None:
+    """Força recarga da config do SQLite na próxima leitura."""
+    _config_cache.invalidate()
+
+
+class _PrintLogWriter:
+    """Grava print_logs em segundo plano, em lotes (uma transação por flush).
+
+    add_print_log só enfileira; a thread grava quando o lote enche
+    (LOG_BATCH_SIZE) ou a cada LOG_FLUSH_INTERVAL. Fila cheia descarta o
+    registro e conta em ``dropped`` — o caminho de impressão nunca espera disco.
+    """
+
+    def __init__(self, max_queue: int = LOG_QUEUE_MAX, batch_size: int = LOG_BATCH_SIZE,
+                 interval: float = LOG_FLUSH_INTERVAL):
+        self.max_queue = max(1, int(max_queue))
+        self.batch_size = max(1, int(batch_size))
+        self.interval = max(0.05, float(interval))
+        self._pending: deque = deque()
+        self._cond = threading.Condition()
+        # Serializa gravações: lotes saem da fila e entram no banco na mesma ordem
+        self._write_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = False
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def enqueue(self, row: tuple) -> bool:
+        with self._cond:
+            if len(self._pending) >= self.max_queue:
+                self.dropped += 1
+                return False
+            self._pending.append(row)
+            self.enqueued += 1
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+        self._ensure_thread()
+        return True
+
+    def _ensure_thread(self) -> None:
+        t = self._thread
+        if t is not None and t.is_alive():
+            return
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop = False
+            self._thread = threading.Thread(target=self._run, name="print-log-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._stop or len(self._pending) >= self.batch_size,
+                    timeout=self.interval,
+                )
+                stopping = self._stop
+            self.flush()
+            if stopping:
+                return
+
+    def _take(self) -> List[tuple]:
+        with self._cond:
+            n = min(len(self._pending), self.batch_size)
+            return [self._pending.popleft() for _ in range(n)]
+
+    def flush(self) -> int:
+        """Grava tudo que está na fila (bloqueante). Retorna linhas gravadas."""
+        total = 0
+        with self._write_lock:
+            while True:
+                batch = self._take()
+                if not batch:
+                    return total
+                try:
+                    self._write(batch)
+                    total += len(batch)
+                    self.written += len(batch)
+                    self.batches += 1
+                except Exception as e:
+                    # Log de erro mas não falhar completamente
+                    self.failed += len(batch)
+                    print(f"[ERROR] Falha ao salvar {len(batch)} log(s) no banco: {e}")
+
+    @retry_with_backoff(RetryConfig(
+        max_retries=2,
+        initial_delay=0.3,
+        max_delay=2.0,
+        retryable_exceptions=(sqlite3.OperationalError, sqlite3.DatabaseError)
+    ))
+    def _write(self, batch: List[tuple]) -> None:
+        with _connection() as conn:
+            conn.executemany(
+                "INSERT INTO print_logs (job_id, status, message, kind, detail, protocol, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                batch,
+            )
+            conn.commit()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Para a thread após a gravação final."""
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+            t = self._thread
+        if t is not None and t.is_alive():
+            t.join(timeout=timeout)
+        self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            depth = len(self._pending)
+        return {
+            "queue_depth": depth,
+            "queue_max": self.max_queue,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
+
+
+_log_writer = _PrintLogWriter()
 
 
 def add_print_log(
@@ -382,41 +899,46 @@ def add_print_log(
     kind: str = "print",
     detail: Any = None,
 ) -> None:
-    """Adiciona registro de impressão/UniPlus ao log."""
+    """Adiciona registro de impressão/UniPlus ao log (gravação assíncrona em lote)."""
     kind_val = (kind or "print").strip().lower() or "print"
+    # Status normalizado na gravação: filtros usam o índice sem lower()
+    status_val = (status or "").strip().lower()
+    protocol = None
+    if isinstance(detail, dict):
+        protocol = str(detail.get("protocol") or "").strip() or None
     if isinstance(detail, (dict, list)):
         detail_val = json.dumps(detail, ensure_ascii=False, default=str)
     elif detail is None:
         detail_val = None
     else:
         detail_val = str(detail)
+    # created_at no enfileiramento (mesmo formato de CURRENT_TIMESTAMP, UTC)
+    created_at = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    row = (job_id, status_val, message or "", kind_val, detail_val, protocol, created_at)
+    if not _log_writer.enqueue(row):
+        print(f"[ERROR] Fila de logs cheia; log descartado (job_id={job_id})")
 
-    @retry_with_backoff(RetryConfig(
-        max_retries=2,
-        initial_delay=0.3,
-        max_delay=2.0,
-        retryable_exceptions=(sqlite3.OperationalError, sqlite3.DatabaseError)
-    ))
-    def _save_log():
-        conn = _get_connection()
-        try:
-            conn.execute(
-                "INSERT INTO print_logs (job_id, status, message, kind, detail) VALUES (?, ?, ?, ?, ?)",
-                (job_id, status, message or "", kind_val, detail_val),
-            )
-            conn.commit()
-        finally:
-            conn.close()
-    
-    try:
-        _save_log()
-    except Exception as e:
-        # Log de erro mas não falhar completamente
-        print(f"[ERROR] Falha ao salvar log no banco (job_id={job_id}): {e}")
 
+def flush_print_logs() -> int:
+    """Grava imediatamente os logs pendentes na fila."""
+    return _log_writer.flush()
 
-def get_printers() -> List[Dict[str, Any]]:
-    """Retorna lista de impressoras. Se não houver lista salva, retorna uma impressora a partir das chaves legadas."""
+
+def stop_print_log_writer(timeout: float = 5.0) -> None:
+    """Encerra o gravador de logs com flush final (shutdown)."""
+    _log_writer.stop(timeout=timeout)
+
+
+def print_log_writer_stats() -> Dict[str, int]:
+    """Profundidade da fila e contadores (gravados, descartados, falhas) do gravador de logs."""
+    return _log_writer.stats()
+
+
+atexit.register(stop_print_log_writer)
+
+
+def _parse_printers() -> List[Dict[str, Any]]:
+    """Monta a lista de impressoras a partir da config (JSON ou chaves legadas)."""
     raw = get_config("printers")
     if raw and raw.strip():
         try:
@@ -460,6 +982,12 @@ def get_printers() -> List[Dict[str, Any]]:
     return []
 
 
+def get_printers() -> List[Dict[str, Any]]:
+    """Retorna lista de impressoras. Se não houver lista salva, retorna uma impressora a partir das chaves legadas."""
+    # Lista já parseada fica no cache; cópias para o chamador poder alterar
+    return [dict(p) for p in _config_cache.printers(_parse_printers)]
+
+
 def set_printers(printers: List[Dict[str, Any]]) -> None:
     """Salva lista de impressoras como JSON."""
     from error_recovery import DataValidator
@@ -493,35 +1021,65 @@ def set_printers(printers: List[Dict[str, Any]]) -> None:
     print(f"[DEBUG] Configuração salva no banco de dados")
 
 
+def _has_print_logs_fts(conn: sqlite3.Connection) -> bool:
+    found = _fts_by_db_file.get(DB_FILE)
+    if found is None:
+        found = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'print_logs_fts'"
+        ).fetchone() is not None
+        _fts_by_db_file[DB_FILE] = found
+    return found
+
+
+def _fts_match_expr(q: str) -> str:
+    """Termos da busca como prefixos FTS5 ("abc"* "12"*), sem operadores do usuário."""
+    tokens = re.findall(r"\w+", q, flags=re.UNICODE)
+    return " ".join('"' + t.replace('"', '""') + '"*' for t in tokens)
+
+
 def get_print_logs(
     limit: int = 50,
     status: str = None,
     q: str = None,
     kind: str = None,
+    before_id: int = None,
 ) -> list:
-    """Retorna registros com filtro opcional de status, texto e tipo (print|uniplus)."""
-    conn = _get_connection()
-    try:
+    """Retorna registros com filtro opcional de status, texto e tipo (print|uniplus).
+
+    Paginação por chave: before_id devolve só registros com id menor (mais antigos).
+    """
+    # Read-your-writes: logs ainda na fila entram antes da consulta
+    _log_writer.flush()
+    with _connection() as conn:
         sql = (
             "SELECT id, job_id, status, message, created_at, "
-            "ifnull(kind, 'print') AS kind, detail "
+            "ifnull(kind, 'print') AS kind, detail, protocol "
             "FROM print_logs WHERE 1=1"
         )
         params = []
         if status and str(status).strip() and str(status).strip().lower() != "all":
-            sql += " AND lower(status) = ?"
+            sql += " AND status = ?"
             params.append(str(status).strip().lower())
         if kind and str(kind).strip() and str(kind).strip().lower() != "all":
-            sql += " AND lower(ifnull(kind, 'print')) = ?"
+            sql += " AND kind = ?"
             params.append(str(kind).strip().lower())
+        if before_id:
+            sql += " AND id < ?"
+            params.append(int(before_id))
         if q and str(q).strip():
-            sql += (
-                " AND (CAST(job_id AS TEXT) LIKE ? OR ifnull(message,'') LIKE ?"
-                " OR ifnull(detail,'') LIKE ?)"
-            )
-            like = f"%{str(q).strip()}%"
-            params.extend([like, like, like])
-        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+            match = _fts_match_expr(str(q).strip())
+            if match and _has_print_logs_fts(conn):
+                sql += " AND id IN (SELECT rowid FROM print_logs_fts WHERE print_logs_fts MATCH ?)"
+                params.append(match)
+            else:
+                sql += (
+                    " AND (CAST(job_id AS TEXT) LIKE ? OR ifnull(message,'') LIKE ?"
+                    " OR ifnull(detail,'') LIKE ?)"
+                )
+                like = f"%{str(q).strip()}%"
+                params.extend([like, like, like])
+        # id cresce na ordem de gravação (created_at vem do enfileiramento)
+        sql += " ORDER BY id DESC LIMIT ?"
         params.append(max(1, min(int(limit or 50), 500)))
         cursor = conn.execute(sql, params)
         logs = []
@@ -542,36 +1100,147 @@ def get_print_logs(
                     "created_at": row[4],
                     "kind": row[5] or "print",
                     "detail": detail_obj,
+                    "protocol": row[7] or "",
                 }
             )
         return logs
-    finally:
-        conn.close()
 
 
 def get_print_log_stats() -> dict:
-    """Contadores rápidos para o painel de logs."""
-    conn = _get_connection()
-    try:
-        cursor = conn.execute(
-            """
-            SELECT
-              COUNT(*) AS total,
-              SUM(CASE WHEN lower(status) = 'done' THEN 1 ELSE 0 END) AS done,
-              SUM(CASE WHEN lower(status) = 'error' THEN 1 ELSE 0 END) AS error,
-              SUM(CASE WHEN lower(status) NOT IN ('done','error') THEN 1 ELSE 0 END) AS other
-            FROM print_logs
-            """
-        )
-        row = cursor.fetchone()
-        return {
-            "total": int(row[0] or 0),
-            "done": int(row[1] or 0),
-            "error": int(row[2] or 0),
-            "other": int(row[3] or 0),
+    """Contadores rápidos para o painel de logs (mantidos por trigger, O(1))."""
+    _log_writer.flush()
+    with _connection() as conn:
+        counts = {
+            row[0]: int(row[1] or 0)
+            for row in conn.execute("SELECT status, n FROM print_log_counters").fetchall()
         }
-    finally:
-        conn.close()
+    total = sum(counts.values())
+    done = counts.get("done", 0)
+    error = counts.get("error", 0)
+    return {
+        "total": total,
+        "done": done,
+        "error": error,
+        "other": total - done - error,
+    }
+
+
+# --- Retenção (usado por retention.py) ---
+
+RETENTION_TABLES = ("print_logs", "pos_orders_queue")
+
+
+def _retention_table(table: str) -> str:
+    if table not in RETENTION_TABLES:
+        raise ValueError(f"Tabela sem política de retenção: {table}")
+    return table
+
+
+def fetch_retention_batch(
+    table: str, limit: int, older_than: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """Linhas mais antigas (por rowid) da tabela; older_than filtra por created_at (UTC)."""
+    table = _retention_table(table)
+    sql = f"SELECT rowid AS _rowid, * FROM {table}"
+    params: List[Any] = []
+    if older_than:
+        sql += " WHERE created_at < ?"
+        params.append(older_than)
+    sql += " ORDER BY rowid LIMIT ?"
+    params.append(max(1, int(limit)))
+    with _connection() as conn:
+        return [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+
+def delete_rows_by_rowid(table: str, rowids: List[int]) -> int:
+    """Apaga um lote numa transação curta."""
+    table = _retention_table(table)
+    if not rowids:
+        return 0
+    with _connection() as conn:
+        cur = conn.executemany(
+            f"DELETE FROM {table} WHERE rowid = ?", [(int(r),) for r in rowids]
+        )
+        conn.commit()
+        return cur.rowcount
+
+
+def count_rows(table: str) -> int:
+    table = _retention_table(table)
+    if table == "print_logs":
+        return get_print_log_stats()["total"]
+    with _connection() as conn:
+        return int(conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] or 0)
+
+
+def db_file_bytes() -> int:
+    """Tamanho do agent.db + WAL em disco."""
+    total = 0
+    for path in (DB_FILE, DB_FILE + "-wal"):
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+
+# Até este tamanho a conversão para auto_vacuum=INCREMENTAL roda sozinha no start
+AUTO_VACUUM_CONVERT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def auto_vacuum_mode() -> int:
+    """PRAGMA auto_vacuum: 0 NONE, 1 FULL, 2 INCREMENTAL."""
+    with _connection() as conn:
+        return int(conn.execute("PRAGMA auto_vacuum").fetchone()[0] or 0)
+
+
+def ensure_incremental_vacuum() -> bool:
+    """Passo de inicialização (antes das threads): liga auto_vacuum=INCREMENTAL.
+
+    A conversão é um VACUUM completo: trava o banco e precisa de ~2x o arquivo
+    livre em disco. Roda sozinha só até AUTO_VACUUM_CONVERT_MAX_BYTES; acima
+    disso, quando o admin marca db_compact_on_startup. True se ficou INCREMENTAL.
+    """
+    if auto_vacuum_mode() == 2:
+        return True
+    force = get_config_bool("db_compact_on_startup")
+    size = db_file_bytes()
+    if size > AUTO_VACUUM_CONVERT_MAX_BYTES and not force:
+        print(
+            f"[INFO] Banco com {size} bytes sem auto_vacuum incremental: compactação pendente "
+            "(marque db_compact_on_startup=true e reinicie o agente)"
+        )
+        return False
+    try:
+        free = shutil.disk_usage(os.path.dirname(os.path.abspath(DB_FILE))).free
+    except OSError:
+        free = 0
+    if free < 2 * size:
+        print(f"[WARN] Compactação do banco adiada: {free} bytes livres para {size} bytes de banco")
+        return False
+    print(f"[INFO] Compactando banco ({size} bytes) para auto_vacuum incremental...")
+    with _connection() as conn:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    if force:
+        set_config("db_compact_on_startup", "false")
+    return auto_vacuum_mode() == 2
+
+
+def incremental_vacuum(max_pages: int) -> int:
+    """Devolve até max_pages páginas livres ao sistema. Retorna páginas liberadas."""
+    with _connection() as conn:
+        before = int(conn.execute("PRAGMA freelist_count").fetchone()[0] or 0)
+        if before:
+            conn.execute(f"PRAGMA incremental_vacuum({max(1, int(max_pages))})").fetchall()
+        after = int(conn.execute("PRAGMA freelist_count").fetchone()[0] or 0)
+        return before - after
+
+
+def checkpoint_wal() -> None:
+    """Checkpoint TRUNCATE: zera o arquivo -wal após muitas exclusões."""
+    with _connection() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
 
 
 def _json_load(raw: Optional[str], default=None):
@@ -583,114 +1252,410 @@ def _json_load(raw: Optional[str], default=None):
         return default if default is not None else {}
 
 
-def replace_pos_catalog(catalog: Dict[str, Any]) -> None:
-    """Substitui o snapshot POS local pelo catálogo da cloud."""
-    conn = _get_connection()
+class _PosCatalogIndex:
+    """Catálogo POS já decodificado, com buscas O(1) para o caminho do pedido.
+
+    Montado uma vez por replace_pos_catalog e trocado por referência (atômico).
+    Os dicts são compartilhados entre threads: somente leitura.
+    """
+
+    def __init__(self, products: List[Dict[str, Any]], addon_groups: List[Dict[str, Any]]):
+        self.db_file = DB_FILE
+        self.products = products
+        self.addon_groups = addon_groups
+        self.products_by_id: Dict[int, Dict[str, Any]] = {}
+        # (product_id, option_id) -> option
+        self.option_by_product: Dict[tuple, Dict[str, Any]] = {}
+        # Rótulos de tamanho (receipt_formatter): primeiro não vazio vence
+        self.label_by_product_option: Dict[tuple, str] = {}
+        self.label_by_option_uniplus: Dict[str, str] = {}
+        self.label_by_option_id: Dict[int, str] = {}
+        self.addon_codigo_by_id: Dict[int, str] = {}
+        # idUniplus (produto/opção) e "name:<nome>" -> grupo
+        self.grupo_by_codigo: Dict[str, str] = {}
+
+        for product in products:
+            if not isinstance(product, dict):
+                continue
+            pid = _int_or_none(product.get("id"))
+            if pid is not None and pid not in self.products_by_id:
+                self.products_by_id[pid] = product
+            grupo = str(product.get("grupo") or "Outros").strip() or "Outros"
+            codigo = str(product.get("idUniplus") or "").strip()
+            if codigo:
+                self.grupo_by_codigo[codigo] = grupo
+            for variation in product.get("variations") or []:
+                if not isinstance(variation, dict):
+                    continue
+                for opt in variation.get("options") or []:
+                    if not isinstance(opt, dict):
+                        continue
+                    oid = _int_or_none(opt.get("id") or 0)
+                    label = str(opt.get("label") or "").strip()
+                    if pid is not None and oid is not None:
+                        self.option_by_product.setdefault((pid, oid), opt)
+                        if label:
+                            self.label_by_product_option.setdefault((pid, oid), label)
+                    if label and oid is not None:
+                        self.label_by_option_id.setdefault(oid, label)
+                    oc = str(opt.get("idUniplus") or "").strip()
+                    if oc:
+                        self.grupo_by_codigo[oc] = grupo
+                        if label:
+                            self.label_by_option_uniplus.setdefault(oc, label)
+            name = str(product.get("name") or "").strip().lower()
+            if name and name not in self.grupo_by_codigo:
+                self.grupo_by_codigo[f"name:{name}"] = grupo
+
+        for group in addon_groups:
+            if not isinstance(group, dict):
+                continue
+            items = list(group.get("items") or [])
+            for sg in group.get("subgroups") or []:
+                items.extend((sg or {}).get("items") or [])
+            for item in items:
+                aid = _int_or_none((item or {}).get("id") or 0)
+                if aid is not None:
+                    self.addon_codigo_by_id.setdefault(aid, str(item.get("idUniplus") or ""))
+
+    def product(self, product_id: Any) -> Optional[Dict[str, Any]]:
+        pid = _int_or_none(product_id)
+        return self.products_by_id.get(pid) if pid is not None else None
+
+
+def _int_or_none(value: Any) -> Optional[int]:
     try:
-        conn.execute("DELETE FROM pos_users")
-        conn.execute("DELETE FROM pos_mesas")
-        conn.execute("DELETE FROM pos_products")
-        conn.execute("DELETE FROM pos_groups")
-        conn.execute("DELETE FROM pos_printers")
-        for u in catalog.get("users") or []:
-            conn.execute(
-                "INSERT INTO pos_users (id, name, pin, profile, payload) VALUES (?, ?, ?, ?, ?)",
-                (
-                    int(u.get("id")),
-                    str(u.get("name") or ""),
-                    str(u.get("pin") or ""),
-                    str(u.get("profile") or ""),
-                    json.dumps(u, ensure_ascii=False),
-                ),
-            )
-        for m in catalog.get("mesas") or []:
-            conn.execute(
-                "INSERT INTO pos_mesas (id, number, name, type, status, form_id, contact_name, display_order, section) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                (
-                    int(m.get("id")),
-                    str(m.get("number") or ""),
-                    str(m.get("name") or ""),
-                    str(m.get("type") or "mesa"),
-                    str(m.get("status") or "livre"),
-                    m.get("formId"),
-                    m.get("contactName"),
-                    int(m.get("displayOrder") or 0),
-                    m.get("section"),
-                ),
-            )
-        for p in catalog.get("products") or []:
-            conn.execute(
-                "INSERT INTO pos_products (id, payload) VALUES (?, ?)",
-                (int(p.get("id")), json.dumps(p, ensure_ascii=False)),
-            )
-        for g in catalog.get("groups") or []:
-            conn.execute(
-                "INSERT INTO pos_groups (id, kind, payload) VALUES (?, ?, ?)",
-                (int(g.get("id")), "addon", json.dumps(g, ensure_ascii=False)),
-            )
-        for pr in catalog.get("printers") or []:
-            conn.execute(
-                "INSERT INTO pos_printers (id, device_id, name) VALUES (?, ?, ?)",
-                (int(pr.get("id")), str(pr.get("deviceId") or ""), str(pr.get("name") or "")),
-            )
-        conn.commit()
-        set_config("pos_catalog_version", str(catalog.get("catalogVersion") or 0))
-        set_config("pos_catalog_updated_at", str(catalog.get("updatedAt") or ""))
-        set_config(
-            "pos_product_groups",
-            json.dumps(catalog.get("productGroups") or [], ensure_ascii=False),
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+_pos_index: Optional[_PosCatalogIndex] = None
+_pos_index_lock = threading.Lock()
+
+
+def pos_catalog_index() -> _PosCatalogIndex:
+    """Índice do catálogo POS atual (carregado do SQLite na primeira chamada)."""
+    global _pos_index
+    idx = _pos_index
+    if idx is not None and idx.db_file == DB_FILE:
+        return idx
+    with _pos_index_lock:
+        if _pos_index is None or _pos_index.db_file != DB_FILE:
+            _pos_index = _PosCatalogIndex(_load_pos_products(), _load_pos_addon_groups())
+        return _pos_index
+
+
+# --- Catálogo POS: gravação completa e por diferença ---
+
+POS_ENTITIES = ("users", "mesas", "products", "groups", "printers")
+_POS_ENTITY_TABLES = {
+    "users": "pos_users",
+    "mesas": "pos_mesas",
+    "products": "pos_products",
+    "groups": "pos_groups",
+    "printers": "pos_printers",
+}
+# Blocos do catálogo guardados na config (entidade "meta" no log de mudanças)
+POS_META_CONFIG_KEYS = {
+    "productGroups": "pos_product_groups",
+    "grupoAddOn": "pos_grupo_addon",
+    "printRoutes": "pos_print_routes",
+}
+# Versões mantidas no log; since mais antigo recebe o catálogo completo
+POS_CHANGELOG_KEEP_VERSIONS = 50
+
+
+def _pos_entity_hash(obj: Any) -> str:
+    canonical = json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def _pos_entity_row(entity: str, obj: Dict[str, Any]) -> tuple:
+    """(INSERT OR REPLACE, parâmetros) de uma entidade do catálogo cloud."""
+    if entity == "users":
+        return (
+            "INSERT OR REPLACE INTO pos_users (id, name, pin, profile, payload) VALUES (?, ?, ?, ?, ?)",
+            (
+                int(obj.get("id")),
+                str(obj.get("name") or ""),
+                str(obj.get("pin") or ""),
+                str(obj.get("profile") or ""),
+                json.dumps(obj, ensure_ascii=False),
+            ),
         )
-        set_config(
-            "pos_grupo_addon",
-            json.dumps(catalog.get("grupoAddOn") or [], ensure_ascii=False),
+    if entity == "mesas":
+        return (
+            "INSERT OR REPLACE INTO pos_mesas (id, number, name, type, status, form_id, contact_name, display_order, section) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                int(obj.get("id")),
+                str(obj.get("number") or ""),
+                str(obj.get("name") or ""),
+                str(obj.get("type") or "mesa"),
+                str(obj.get("status") or "livre"),
+                obj.get("formId"),
+                obj.get("contactName"),
+                int(obj.get("displayOrder") or 0),
+                obj.get("section"),
+            ),
         )
-        set_config(
-            "pos_print_routes",
-            json.dumps(catalog.get("printRoutes") or [], ensure_ascii=False),
+    if entity == "products":
+        return (
+            "INSERT OR REPLACE INTO pos_products (id, payload) VALUES (?, ?)",
+            (int(obj.get("id")), json.dumps(obj, ensure_ascii=False)),
         )
-    finally:
-        conn.close()
+    if entity == "groups":
+        return (
+            "INSERT OR REPLACE INTO pos_groups (id, kind, payload) VALUES (?, ?, ?)",
+            (int(obj.get("id")), "addon", json.dumps(obj, ensure_ascii=False)),
+        )
+    if entity == "printers":
+        return (
+            "INSERT OR REPLACE INTO pos_printers (id, device_id, name) VALUES (?, ?, ?)",
+            (int(obj.get("id")), str(obj.get("deviceId") or ""), str(obj.get("name") or "")),
+        )
+    raise ValueError(f"Entidade POS desconhecida: {entity}")
+
+
+def _after_pos_catalog_write() -> None:
+    """Índice novo a partir do que foi gravado (troca atômica) e snapshot do /pos/sync sujo."""
+    global _pos_index
+    new_index = _PosCatalogIndex(_load_pos_products(), _load_pos_addon_groups())
+    with _pos_index_lock:
+        _pos_index = new_index
+    _touch_pos_sync()
+
+
+def _write_config_rows(conn: sqlite3.Connection, updates: Dict[str, str]) -> None:
+    """Grava chaves de config na transação do chamador.
+
+    O chamador segura _config_write_lock da transação até _config_cache.stage.
+    """
+    conn.executemany(
+        "INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)",
+        [(k, str(v)) for k, v in updates.items()],
+    )
+
+
+def replace_pos_catalog(catalog: Dict[str, Any]) -> Dict[str, Any]:
+    """Substitui o snapshot POS local pelo catálogo da cloud (e reinicia o log de mudanças).
+
+    Monta tabelas <tabela>_new com executemany e troca tudo (tabelas + config)
+    numa transação curta: leitores veem o catálogo antigo ou o novo, nunca metade.
+    """
+    started = time.perf_counter()
+    version = int(catalog.get("catalogVersion") or 0)
+    rows: Dict[str, List[tuple]] = {}
+    hashes = []
+    for entity in POS_ENTITIES:
+        table = _POS_ENTITY_TABLES[entity]
+        for obj in catalog.get(entity) or []:
+            sql, params = _pos_entity_row(entity, obj)
+            rows.setdefault(table, []).append(params)
+            hashes.append((entity, str(int(obj.get("id"))), _pos_entity_hash(obj)))
+    for key in POS_META_CONFIG_KEYS:
+        hashes.append(("meta", key, _pos_entity_hash(catalog.get(key) or [])))
+    rows["pos_entity_hashes"] = hashes
+    config_updates = {
+        "pos_catalog_version": str(version),
+        "pos_catalog_updated_at": str(catalog.get("updatedAt") or ""),
+        "pos_changelog_floor": str(version),
+    }
+    for key, config_key in POS_META_CONFIG_KEYS.items():
+        config_updates[config_key] = json.dumps(catalog.get(key) or [], ensure_ascii=False)
+
+    with _connection() as conn:
+        # Cópias montadas fora da troca; cada tabela em sua própria transação
+        for table, ddl in _POS_CATALOG_DDL.items():
+            shadow = f"{table}_new"
+            conn.execute(f"DROP TABLE IF EXISTS {shadow}")
+            conn.execute(ddl.format(table=shadow))
+            table_rows = rows.get(table) or []
+            if table_rows:
+                placeholders = ", ".join("?" * len(table_rows[0]))
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO {shadow} VALUES ({placeholders})", table_rows
+                )
+            conn.commit()
+        build_ms = (time.perf_counter() - started) * 1000
+
+        with _config_write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for table in _POS_CATALOG_DDL:
+                    conn.execute(f"DROP TABLE {table}")
+                    conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+                # Deltas só a partir desta versão
+                conn.execute("DELETE FROM pos_catalog_changes")
+                _write_config_rows(conn, config_updates)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            config_changes = _config_cache.stage(config_updates)
+    _config_cache.notify(config_changes)
+    _after_pos_catalog_write()
+    report = {
+        "full": True,
+        "rows": {entity: len(catalog.get(entity) or []) for entity in POS_ENTITIES},
+        "buildMs": round(build_ms, 1),
+        "durationMs": round((time.perf_counter() - started) * 1000, 1),
+    }
+    print(
+        f"[INFO] Catálogo POS v{version} importado: "
+        + ", ".join(f"{k}={v}" for k, v in report["rows"].items())
+        + f" em {report['durationMs']} ms"
+    )
+    return report
+
+
+def has_pos_entity_hashes() -> bool:
+    """False em bancos anteriores ao sync por diferença (exige um replace completo)."""
+    with _connection() as conn:
+        return conn.execute("SELECT 1 FROM pos_entity_hashes LIMIT 1").fetchone() is not None
+
+
+def apply_pos_catalog_delta(catalog: Dict[str, Any]) -> Dict[str, int]:
+    """Aplica só o que mudou no catálogo cloud (hash por entidade) e registra no log."""
+    started = time.perf_counter()
+    version = int(catalog.get("catalogVersion") or 0)
+    summary = {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+    changes: List[tuple] = []
+    meta_updates: Dict[str, str] = {}
+    # Lock antes da primeira escrita: a transação implícita abre dentro dele
+    with _config_write_lock:
+        with _connection() as conn:
+            stored = {
+                (r[0], r[1]): r[2]
+                for r in conn.execute("SELECT entity, id, hash FROM pos_entity_hashes").fetchall()
+            }
+            seen = set()
+            for entity in POS_ENTITIES:
+                for obj in catalog.get(entity) or []:
+                    eid = str(int(obj.get("id")))
+                    key = (entity, eid)
+                    seen.add(key)
+                    new_hash = _pos_entity_hash(obj)
+                    old_hash = stored.get(key)
+                    if old_hash == new_hash:
+                        summary["unchanged"] += 1
+                        continue
+                    conn.execute(*_pos_entity_row(entity, obj))
+                    conn.execute(
+                        "INSERT OR REPLACE INTO pos_entity_hashes (entity, id, hash) VALUES (?, ?, ?)",
+                        (entity, eid, new_hash),
+                    )
+                    changes.append((version, entity, eid, "upsert"))
+                    summary["inserted" if old_hash is None else "updated"] += 1
+            for (entity, eid) in stored:
+                if entity not in _POS_ENTITY_TABLES or (entity, eid) in seen:
+                    continue
+                conn.execute(f"DELETE FROM {_POS_ENTITY_TABLES[entity]} WHERE id = ?", (int(eid),))
+                conn.execute("DELETE FROM pos_entity_hashes WHERE entity = ? AND id = ?", (entity, eid))
+                changes.append((version, entity, eid, "delete"))
+                summary["deleted"] += 1
+            for key, config_key in POS_META_CONFIG_KEYS.items():
+                value = catalog.get(key) or []
+                new_hash = _pos_entity_hash(value)
+                if stored.get(("meta", key)) == new_hash:
+                    continue
+                conn.execute(
+                    "INSERT OR REPLACE INTO pos_entity_hashes (entity, id, hash) VALUES (?, ?, ?)",
+                    ("meta", key, new_hash),
+                )
+                meta_updates[config_key] = json.dumps(value, ensure_ascii=False)
+                changes.append((version, "meta", key, "upsert"))
+            config_updates = {
+                "pos_catalog_version": str(version),
+                "pos_catalog_updated_at": str(catalog.get("updatedAt") or ""),
+            }
+            config_updates.update(meta_updates)
+            if changes:
+                conn.executemany(
+                    "INSERT INTO pos_catalog_changes (catalog_version, entity, entity_id, op) VALUES (?, ?, ?, ?)",
+                    changes,
+                )
+                row = conn.execute(
+                    "SELECT DISTINCT catalog_version FROM pos_catalog_changes "
+                    "ORDER BY catalog_version DESC LIMIT 1 OFFSET ?",
+                    (POS_CHANGELOG_KEEP_VERSIONS,),
+                ).fetchone()
+                if row is not None:
+                    new_floor = int(row[0])
+                    conn.execute("DELETE FROM pos_catalog_changes WHERE catalog_version <= ?", (new_floor,))
+                    if new_floor > get_config_int("pos_changelog_floor", 0):
+                        config_updates["pos_changelog_floor"] = str(new_floor)
+            # Linhas, log e config na mesma transação
+            _write_config_rows(conn, config_updates)
+            conn.commit()
+        config_changes = _config_cache.stage(config_updates)
+    _config_cache.notify(config_changes)
+    if changes:
+        _after_pos_catalog_write()
+    summary["changes"] = len(changes)
+    summary["durationMs"] = round((time.perf_counter() - started) * 1000, 1)
+    return summary
 
 
 def upsert_pos_image(image_id: str, url: str, hash_val: str, path: str) -> None:
-    conn = _get_connection()
-    try:
-        conn.execute(
-            "INSERT OR REPLACE INTO pos_images (id, url, hash, path) VALUES (?, ?, ?, ?)",
-            (image_id, url, hash_val, path),
+    upsert_pos_images([{"id": image_id, "url": url, "hash": hash_val, "path": path}])
+
+
+def upsert_pos_images(images: List[Dict[str, Any]]) -> None:
+    """Grava várias imagens numa transação (fim do download em lote)."""
+    if not images:
+        return
+    with _connection() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO pos_images (id, url, hash, path, etag, last_modified) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    i["id"],
+                    i.get("url"),
+                    i.get("hash"),
+                    i.get("path"),
+                    i.get("etag"),
+                    i.get("last_modified"),
+                )
+                for i in images
+            ],
         )
         conn.commit()
-    finally:
-        conn.close()
+    _touch_pos_sync()
+
+
+def _pos_image_row(row) -> Dict[str, Any]:
+    return {
+        "id": row[0],
+        "url": row[1],
+        "hash": row[2],
+        "path": row[3],
+        "etag": row[4] or "",
+        "last_modified": row[5] or "",
+    }
 
 
 def get_pos_image(image_id: str) -> Optional[Dict[str, Any]]:
-    conn = _get_connection()
-    try:
+    with _connection() as conn:
         row = conn.execute(
-            "SELECT id, url, hash, path FROM pos_images WHERE id = ?",
+            "SELECT id, url, hash, path, etag, last_modified FROM pos_images WHERE id = ?",
             (image_id,),
         ).fetchone()
-        if not row:
-            return None
-        return {"id": row[0], "url": row[1], "hash": row[2], "path": row[3]}
-    finally:
-        conn.close()
+        return _pos_image_row(row) if row else None
 
 
 def list_pos_images() -> List[Dict[str, Any]]:
-    conn = _get_connection()
-    try:
-        rows = conn.execute("SELECT id, url, hash, path FROM pos_images").fetchall()
-        return [{"id": r[0], "url": r[1], "hash": r[2], "path": r[3]} for r in rows]
-    finally:
-        conn.close()
+    with _connection() as conn:
+        rows = conn.execute(
+            "SELECT id, url, hash, path, etag, last_modified FROM pos_images"
+        ).fetchall()
+        return [_pos_image_row(r) for r in rows]
 
 
 def list_pos_users() -> List[Dict[str, Any]]:
-    conn = _get_connection()
-    try:
+    with _connection() as conn:
         rows = conn.execute(
             "SELECT id, name, pin, profile, payload FROM pos_users ORDER BY name COLLATE NOCASE"
         ).fetchall()
@@ -700,13 +1665,10 @@ def list_pos_users() -> List[Dict[str, Any]]:
             payload.update({"id": r[0], "name": r[1] or "", "pin": r[2] or "", "profile": r[3] or ""})
             out.append(payload)
         return out
-    finally:
-        conn.close()
 
 
 def get_pos_user(user_id: int) -> Optional[Dict[str, Any]]:
-    conn = _get_connection()
-    try:
+    with _connection() as conn:
         row = conn.execute(
             "SELECT id, name, pin, profile, payload FROM pos_users WHERE id = ?",
             (int(user_id),),
@@ -716,13 +1678,10 @@ def get_pos_user(user_id: int) -> Optional[Dict[str, Any]]:
         payload = _json_load(row[4], {})
         payload.update({"id": row[0], "name": row[1] or "", "pin": row[2] or "", "profile": row[3] or ""})
         return payload
-    finally:
-        conn.close()
 
 
 def list_pos_mesas() -> List[Dict[str, Any]]:
-    conn = _get_connection()
-    try:
+    with _connection() as conn:
         rows = conn.execute(
             "SELECT id, number, name, type, status, form_id, contact_name, display_order, section "
             "FROM pos_mesas ORDER BY display_order, number COLLATE NOCASE"
@@ -741,13 +1700,10 @@ def list_pos_mesas() -> List[Dict[str, Any]]:
             }
             for r in rows
         ]
-    finally:
-        conn.close()
 
 
 def get_pos_mesa(mesa_id: int) -> Optional[Dict[str, Any]]:
-    conn = _get_connection()
-    try:
+    with _connection() as conn:
         row = conn.execute(
             "SELECT id, number, name, type, status, form_id, contact_name, display_order, section "
             "FROM pos_mesas WHERE id = ?",
@@ -766,67 +1722,68 @@ def get_pos_mesa(mesa_id: int) -> Optional[Dict[str, Any]]:
             "displayOrder": row[7] or 0,
             "section": row[8],
         }
-    finally:
-        conn.close()
+
+
+def _invalidate_pos_entity_hash(conn: sqlite3.Connection, entity: str, entity_id: Any) -> None:
+    """Linha alterada localmente: o próximo sync regrava a versão da cloud."""
+    conn.execute(
+        "UPDATE pos_entity_hashes SET hash = '' WHERE entity = ? AND id = ?",
+        (entity, str(int(entity_id))),
+    )
 
 
 def update_pos_mesa(mesa_id: int, *, status: str, contact_name: Optional[str] = None) -> Optional[Dict[str, Any]]:
-    conn = _get_connection()
-    try:
+    with _connection() as conn:
         conn.execute(
             "UPDATE pos_mesas SET status = ?, contact_name = ? WHERE id = ?",
             (status, contact_name, int(mesa_id)),
         )
+        _invalidate_pos_entity_hash(conn, "mesas", mesa_id)
         conn.commit()
-    finally:
-        conn.close()
+    _touch_pos_sync()
     return get_pos_mesa(mesa_id)
 
 
 def update_pos_mesa_contact_name(
     mesa_id: int, contact_name: str
 ) -> Optional[Dict[str, Any]]:
-    conn = _get_connection()
-    try:
+    with _connection() as conn:
         conn.execute(
             "UPDATE pos_mesas SET contact_name = ? WHERE id = ?",
             (str(contact_name or "").strip(), int(mesa_id)),
         )
+        _invalidate_pos_entity_hash(conn, "mesas", mesa_id)
         conn.commit()
-    finally:
-        conn.close()
+    _touch_pos_sync()
     return get_pos_mesa(mesa_id)
 
 
-def list_pos_products() -> List[Dict[str, Any]]:
-    conn = _get_connection()
-    try:
+def _load_pos_products() -> List[Dict[str, Any]]:
+    with _connection() as conn:
         rows = conn.execute("SELECT payload FROM pos_products").fetchall()
         return [_json_load(r[0], {}) for r in rows]
-    finally:
-        conn.close()
-
-
-def get_pos_product(product_id: int) -> Optional[Dict[str, Any]]:
-    conn = _get_connection()
-    try:
-        row = conn.execute(
-            "SELECT payload FROM pos_products WHERE id = ?", (int(product_id),)
-        ).fetchone()
-        return _json_load(row[0], {}) if row else None
-    finally:
-        conn.close()
 
 
-def list_pos_addon_groups() -> List[Dict[str, Any]]:
-    conn = _get_connection()
-    try:
+def _load_pos_addon_groups() -> List[Dict[str, Any]]:
+    with _connection() as conn:
         rows = conn.execute(
             "SELECT payload FROM pos_groups WHERE kind = 'addon'"
         ).fetchall()
         return [_json_load(r[0], {}) for r in rows]
-    finally:
-        conn.close()
+
+
+def list_pos_products() -> List[Dict[str, Any]]:
+    """Produtos do catálogo POS (do índice em memória; somente leitura)."""
+    return list(pos_catalog_index().products)
+
+
+def get_pos_product(product_id: int) -> Optional[Dict[str, Any]]:
+    return pos_catalog_index().product(product_id)
+
+
+def list_pos_addon_groups() -> List[Dict[str, Any]]:
+    """Grupos de adicionais do catálogo POS (do índice em memória; somente leitura)."""
+    return list(pos_catalog_index().addon_groups)
 
 
 def list_pos_print_routes() -> List[Dict[str, Any]]:
@@ -835,30 +1792,23 @@ def list_pos_print_routes() -> List[Dict[str, Any]]:
 
 
 def list_pos_printers() -> List[Dict[str, Any]]:
-    conn = _get_connection()
-    try:
+    with _connection() as conn:
         rows = conn.execute("SELECT id, device_id, name FROM pos_printers").fetchall()
         return [{"id": r[0], "deviceId": r[1], "name": r[2]} for r in rows]
-    finally:
-        conn.close()
 
 
 def get_pos_order(client_order_id: str) -> Optional[Dict[str, Any]]:
-    conn = _get_connection()
-    try:
+    with _connection() as conn:
         row = conn.execute(
             "SELECT result_json FROM pos_orders_queue WHERE client_order_id = ?",
             (client_order_id,),
         ).fetchone()
         return _json_load(row[0], None) if row else None
-    finally:
-        conn.close()
 
 
 def claim_pos_order(client_order_id: str) -> Optional[Dict[str, Any]]:
     """Reserva clientOrderId com lock imediato — evita duplicata sob retry paralelo."""
-    conn = _get_connection()
-    try:
+    with _connection() as conn:
         conn.execute("BEGIN IMMEDIATE")
         row = conn.execute(
             "SELECT result_json FROM pos_orders_queue WHERE client_order_id = ?",
@@ -874,30 +1824,33 @@ def claim_pos_order(client_order_id: str) -> Optional[Dict[str, Any]]:
         )
         conn.commit()
         return None
-    finally:
-        conn.close()
 
 
 def save_pos_order(client_order_id: str, result: Dict[str, Any]) -> None:
-    conn = _get_connection()
-    try:
+    with _connection() as conn:
         conn.execute(
             "INSERT OR REPLACE INTO pos_orders_queue (client_order_id, result_json) VALUES (?, ?)",
             (client_order_id, json.dumps(result, ensure_ascii=False, default=str)),
         )
         conn.commit()
-    finally:
-        conn.close()
+
+
+def _pos_sync_user(u: Dict[str, Any]) -> Dict[str, Any]:
+    return {"id": u["id"], "name": u["name"], "pin": bool(u.get("pin")), "profile": u.get("profile")}
+
+
+def _pos_sync_images() -> List[Dict[str, Any]]:
+    return [
+        {"id": i["id"], "hash": i["hash"], "url": f"/pos/media/{i['id']}"}
+        for i in list_pos_images()
+    ]
 
 
 def build_pos_sync_payload() -> Dict[str, Any]:
     return {
         "catalogVersion": int(get_config("pos_catalog_version") or 0),
         "updatedAt": get_config("pos_catalog_updated_at") or "",
-        "users": [
-            {"id": u["id"], "name": u["name"], "pin": bool(u.get("pin")), "profile": u.get("profile")}
-            for u in list_pos_users()
-        ],
+        "users": [_pos_sync_user(u) for u in list_pos_users()],
         "mesas": list_pos_mesas(),
         "products": list_pos_products(),
         "groups": list_pos_addon_groups(),
@@ -905,8 +1858,102 @@ def build_pos_sync_payload() -> Dict[str, Any]:
         "grupoAddOn": _json_load(get_config("pos_grupo_addon"), []),
         "printRoutes": _json_load(get_config("pos_print_routes"), []),
         "printers": list_pos_printers(),
-        "images": [
-            {"id": i["id"], "hash": i["hash"], "url": f"/pos/media/{i['id']}"}
-            for i in list_pos_images()
-        ],
+        "images": _pos_sync_images(),
     }
+
+
+def build_pos_sync_delta(since: int) -> Optional[Dict[str, Any]]:
+    """Mudanças do catálogo desde a versão since; None se o log não cobre (usar completo)."""
+    current = get_config_int("pos_catalog_version", 0)
+    floor = get_config_int("pos_changelog_floor", -1)
+    if floor < 0 or since < floor or since >= current:
+        return None
+    with _connection() as conn:
+        rows = conn.execute(
+            "SELECT entity, entity_id, op FROM pos_catalog_changes "
+            "WHERE catalog_version > ? ORDER BY seq",
+            (int(since),),
+        ).fetchall()
+    latest: Dict[tuple, str] = {}
+    for entity, entity_id, op in rows:
+        latest[(entity, entity_id)] = op
+
+    wanted: Dict[str, set] = {}
+    changes: Dict[str, Dict[str, list]] = {}
+    payload: Dict[str, Any] = {
+        "delta": True,
+        "fromVersion": int(since),
+        "catalogVersion": current,
+        "updatedAt": get_config("pos_catalog_updated_at") or "",
+        "changes": changes,
+        "images": _pos_sync_images(),
+    }
+    for (entity, entity_id), op in latest.items():
+        if entity == "meta":
+            payload[entity_id] = _json_load(get_config(POS_META_CONFIG_KEYS[entity_id]), [])
+            continue
+        bucket = changes.setdefault(entity, {"upsert": [], "delete": []})
+        if op == "delete":
+            bucket["delete"].append(int(entity_id))
+        else:
+            wanted.setdefault(entity, set()).add(int(entity_id))
+
+    if wanted:
+        index = pos_catalog_index()
+        current_rows = {
+            "users": lambda: [_pos_sync_user(u) for u in list_pos_users()],
+            "mesas": list_pos_mesas,
+            "products": lambda: index.products,
+            "groups": lambda: index.addon_groups,
+            "printers": list_pos_printers,
+        }
+        for entity, ids in wanted.items():
+            for obj in current_rows[entity]():
+                if _int_or_none(obj.get("id")) in ids:
+                    changes[entity]["upsert"].append(obj)
+    return payload
+
+
+class _PosSyncSnapshot:
+    """Resposta de GET /pos/sync já serializada (identity + gzip) e com ETag."""
+
+    def __init__(self, generation: int, payload: Dict[str, Any]):
+        self.generation = generation
+        self.db_file = DB_FILE
+        self.catalog_version = int(payload.get("catalogVersion") or 0)
+        self.identity = json.dumps(
+            payload, ensure_ascii=False, separators=(",", ":"), default=str
+        ).encode("utf-8")
+        # mtime=0: mesmo conteúdo -> mesmos bytes gzip
+        self.gzip = gzip.compress(self.identity, compresslevel=6, mtime=0)
+        digest = hashlib.sha1(self.identity).hexdigest()[:20]
+        self.etag = f'"v{self.catalog_version}-{digest}"'
+
+
+_pos_sync_generation = 0
+_pos_sync_snapshot: Optional[_PosSyncSnapshot] = None
+_pos_sync_lock = threading.Lock()
+
+
+def _touch_pos_sync() -> None:
+    """Marca o snapshot do /pos/sync como desatualizado (catálogo, mesas, imagens)."""
+    global _pos_sync_generation
+    with _pos_sync_lock:
+        _pos_sync_generation += 1
+
+
+def pos_sync_snapshot() -> _PosSyncSnapshot:
+    """Snapshot atual do /pos/sync; remonta só quando algo do POS mudou."""
+    global _pos_sync_snapshot
+    snap = _pos_sync_snapshot
+    if snap is not None and snap.generation == _pos_sync_generation and snap.db_file == DB_FILE:
+        return snap
+    with _pos_sync_lock:
+        generation = _pos_sync_generation
+        snap = _pos_sync_snapshot
+        if snap is not None and snap.generation == generation and snap.db_file == DB_FILE:
+            return snap
+        # Montado dentro do lock: dez tablets juntos geram um único build
+        snap = _PosSyncSnapshot(generation, build_pos_sync_payload())
+        _pos_sync_snapshot = snap
+        return snap
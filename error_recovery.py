@@ -3,6 +3,8 @@ import time
 import threading
 import logging
 import socket
+import codecs
+import unicodedata
 from typing import Callable, Optional, Dict, Any
 from functools import wraps
 from datetime import datetime, timedelta
@@ -368,11 +370,108 @@ class DataValidator:
         return sanitized
 
 
+# Substitutos de 1 caractere: o layout alinha colunas por len() antes de codificar
+_TRANSLIT_OVERRIDES = {
+    "\u2018": "'", "\u2019": "'", "\u201a": "'", "\u201b": "'", "\u2032": "'", "\u00b4": "'",
+    "\u201c": '"', "\u201d": '"', "\u201e": '"', "\u201f": '"', "\u2033": '"',
+    "\u00ab": '"', "\u00bb": '"', "\u2039": "<", "\u203a": ">",
+    "\u2010": "-", "\u2011": "-", "\u2012": "-", "\u2013": "-", "\u2014": "-", "\u2015": "-",
+    "\u2212": "-", "\u2026": ".", "\u2022": "*", "\u2023": "*", "\u25cf": "*", "\u00b7": ".",
+    "\u2190": "<", "\u2192": ">", "\u2191": "^", "\u2193": "v", "\u20ac": "E", "\u2122": "T",
+    "\u0141": "L", "\u0142": "l", "\u0110": "D", "\u0111": "d", "\u0126": "H", "\u0127": "h",
+    "\u0131": "i", "\u00d8": "O", "\u00f8": "o", "\u00c6": "A", "\u00e6": "a", "\u0152": "O",
+    "\u0153": "o", "\u00df": "s", "\u00d0": "D", "\u00f0": "d", "\u00de": "P", "\u00fe": "p",
+}
+# Invisíveis (junção de emoji, seletores de variação, tom de pele): somem
+_TRANSLIT_DROP = (
+    [0x200B, 0x200C, 0x200D, 0x2060, 0xFEFF]
+    + list(range(0xFE00, 0xFE10))
+    + list(range(0x1F3FB, 0x1F400))
+)
+_TRANSLIT_RANGES = ((0x80, 0x3000), (0xFF01, 0xFF5F), (0x1F000, 0x1FB00))
+
+
+def _encodable_chars(encoding: str):
+    """Conjunto de caracteres que a code page imprime (None = codec sem tabela)."""
+    try:
+        name = codecs.lookup(encoding).name.replace("-", "_")
+        module = __import__("encodings." + name, fromlist=["decoding_table"])
+    except (ImportError, LookupError):
+        return None
+    table = getattr(module, "decoding_table", None)
+    return set(table) - {"\ufffe"} if isinstance(table, str) else None
+
+
+def _translit_candidates() -> dict:
+    """Substituto de cada caractere das faixas cobertas (independe da code page)."""
+    candidates = {}
+    for start, end in _TRANSLIT_RANGES:
+        for cp in range(start, end):
+            ch = chr(cp)
+            sub = _TRANSLIT_OVERRIDES.get(ch)
+            if sub is None:
+                base = "".join(
+                    c for c in unicodedata.normalize("NFKD", ch) if not unicodedata.combining(c)
+                )
+                if len(base) == 1 and base != ch:
+                    sub = base
+                elif unicodedata.category(ch) == "So":
+                    sub = "*"
+            if sub is not None:
+                candidates[cp] = sub
+    return candidates
+
+
+def _build_translit_table(encoding: str, candidates: dict) -> dict:
+    """
+    Mapa para str.translate: cada caractere fora da code page vira o substituto
+    imprimível mais próximo (aspas curvas, travessões, letras sem o acento, emoji
+    vira "*"). O que não tem equivalente continua saindo "?" no encode.
+    """
+    encodable = _encodable_chars(encoding)
+    if encodable is None:
+        return {}
+    table = {cp: None for cp in _TRANSLIT_DROP}
+    for cp, sub in candidates.items():
+        if cp not in table and chr(cp) not in encodable and sub in encodable:
+            table[cp] = sub
+    return table
+
+
+def _build_translit_tables(encodings) -> dict:
+    candidates = _translit_candidates()
+    return {enc: _build_translit_table(enc, candidates) for enc in encodings}
+
+
+def _register_translit_handler(encoding: str, table: dict) -> str:
+    """
+    Error handler do codec que aplica a tabela: o encode só consulta o mapa nos
+    caracteres que a code page não tem (str.translate percorreria o texto inteiro).
+    """
+    def handler(exc):
+        if not isinstance(exc, UnicodeEncodeError):
+            raise exc
+        chunk = exc.object[exc.start:exc.end]
+        return "".join(table.get(ord(c), "?") or "" for c in chunk), exc.end
+
+    name = f"translit_{encoding}"
+    codecs.register_error(name, handler)
+    return name
+
+
 class EncodingFallback:
     """Sistema de fallback para encoding."""
     
     ENCODING_ORDER = ["cp850", "cp860", "cp1252", "utf-8", "latin1"]
-    
+    # Montadas no import; utf-8 imprime tudo e não precisa de tabela
+    TRANSLIT_TABLES = _build_translit_tables(("cp850", "cp860", "cp1252"))
+    TRANSLIT_ERRORS = {enc: _register_translit_handler(enc, t) for enc, t in TRANSLIT_TABLES.items()}
+
+    @staticmethod
+    def errors_for(encoding: str) -> str:
+        """Nome do error handler de encode: transliteração da code page ou "replace"."""
+        return EncodingFallback.TRANSLIT_ERRORS.get(encoding, "replace")
+
     @staticmethod
     def encode_with_fallback(text: str, preferred_encoding: str = "cp850") -> tuple[bytes, str]:
         """Codifica texto com fallback automático."""
@@ -382,7 +481,7 @@ class EncodingFallback:
         
         for encoding in encodings_to_try:
             try:
-                return text.encode(encoding, errors="replace"), encoding
+                return text.encode(encoding, errors=EncodingFallback.errors_for(encoding)), encoding
             except (UnicodeEncodeError, LookupError):
                 continue
         
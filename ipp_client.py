@@ -0,0 +1,398 @@
+"""Cliente IPP/1.1-2.0 mínimo: codifica/decodifica mensagens (RFC 8010) e fala com a
+impressora por uma conexão HTTP keep-alive por impressora.
+
+Operações: Print-Job, Get-Job-Attributes, Get-Printer-Attributes e Purge-Jobs.
+"""
+from __future__ import annotations
+
+import http.client
+import itertools
+import select
+import struct
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Operações
+PRINT_JOB = 0x0002
+GET_JOB_ATTRIBUTES = 0x0009
+GET_PRINTER_ATTRIBUTES = 0x000B
+PURGE_JOBS = 0x0012
+
+# Grupos de atributos (delimiter tags)
+TAG_OPERATION = 0x01
+TAG_JOB = 0x02
+TAG_END = 0x03
+TAG_PRINTER = 0x04
+TAG_UNSUPPORTED = 0x05
+
+# Tipos de valor
+TAG_INTEGER = 0x21
+TAG_BOOLEAN = 0x22
+TAG_ENUM = 0x23
+TAG_TEXT = 0x41
+TAG_NAME = 0x42
+TAG_KEYWORD = 0x44
+TAG_URI = 0x45
+TAG_CHARSET = 0x47
+TAG_LANGUAGE = 0x48
+TAG_MIME = 0x49
+_INT_TAGS = (TAG_INTEGER, TAG_ENUM)
+# Texto: string/text/name/keyword/uri/.../mimeMediaType (0x40-0x49, exceto os com idioma)
+_STR_TAGS = (0x41, 0x42, 0x44, 0x45, 0x46, 0x47, 0x48, 0x49)
+
+# job-state
+JOB_PENDING = 3
+JOB_HELD = 4
+JOB_PROCESSING = 5
+JOB_STOPPED = 6
+JOB_CANCELED = 7
+JOB_ABORTED = 8
+JOB_COMPLETED = 9
+JOB_TERMINAL_STATES = (JOB_CANCELED, JOB_ABORTED, JOB_COMPLETED)
+
+# printer-state
+PRINTER_IDLE = 3
+PRINTER_PROCESSING = 4
+PRINTER_STOPPED = 5
+
+STATUS_OK = 0x0000
+STATUS_OPERATION_NOT_SUPPORTED = 0x0501
+
+IPP_DEFAULT_PORT = 631
+IPP_DEFAULT_PATH = "/ipp/print"
+# Conexão ociosa há mais que isso é fechada antes de reusar (impressora costuma derrubar)
+IPP_KEEPALIVE_IDLE_SEC = 30.0
+# Job-state: primeira consulta logo (cupom curto já terminou), depois dobra até o teto
+IPP_JOB_POLL_FIRST_SEC = 0.02
+IPP_JOB_POLL_INTERVAL_SEC = 0.5
+
+
+class IppError(Exception):
+    """Resposta IPP com status de erro (ou resposta inválida)."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class IppDeliveryUnknown(IppError):
+    """Requisição já enviada e sem resposta: a impressora pode ter aceitado o job."""
+
+
+class IppMessage:
+    """Requisição ou resposta IPP decodificada."""
+
+    def __init__(self, version: Tuple[int, int], code: int, request_id: int,
+                 groups: List[Tuple[int, Dict[str, List[Any]]]], data: bytes = b""):
+        self.version = version
+        # operation-id na requisição, status-code na resposta
+        self.code = code
+        self.request_id = request_id
+        self.groups = groups
+        self.data = data
+
+    @property
+    def ok(self) -> bool:
+        return self.code < 0x0100
+
+    def group(self, tag: int) -> Dict[str, List[Any]]:
+        """Atributos do primeiro grupo com a tag (vazio se não houver)."""
+        for group_tag, attrs in self.groups:
+            if group_tag == tag:
+                return attrs
+        return {}
+
+    def attr(self, tag: int, name: str, default=None):
+        values = self.group(tag).get(name)
+        return values[0] if values else default
+
+
+def _encode_value(value_tag: int, value) -> bytes:
+    if value_tag in _INT_TAGS:
+        return struct.pack(">i", int(value))
+    if value_tag == TAG_BOOLEAN:
+        return b"\x01" if value else b"\x00"
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode("utf-8")
+
+
+def encode_message(
+    code: int,
+    request_id: int,
+    groups: Iterable[Tuple[int, Iterable[Tuple[str, int, Any]]]],
+    data: bytes = b"",
+    version: Tuple[int, int] = (2, 0),
+) -> bytes:
+    """
+    groups: [(tag do grupo, [(nome, tag do valor, valor ou lista de valores), ...]), ...].
+    Lista vira atributo multi-valor (nome vazio nos valores seguintes).
+    """
+    out = bytearray(struct.pack(">BBHI", version[0], version[1], code, request_id))
+    for group_tag, attrs in groups:
+        out.append(group_tag)
+        for name, value_tag, value in attrs:
+            values = value if isinstance(value, (list, tuple)) else [value]
+            for idx, item in enumerate(values):
+                name_bytes = name.encode("ascii") if idx == 0 else b""
+                encoded = _encode_value(value_tag, item)
+                out += struct.pack(">BH", value_tag, len(name_bytes)) + name_bytes
+                out += struct.pack(">H", len(encoded)) + encoded
+    out.append(TAG_END)
+    return bytes(out) + data
+
+
+def _decode_value(value_tag: int, raw: bytes):
+    if value_tag in _INT_TAGS and len(raw) == 4:
+        return struct.unpack(">i", raw)[0]
+    if value_tag == TAG_BOOLEAN and len(raw) == 1:
+        return raw != b"\x00"
+    if value_tag in _STR_TAGS:
+        return raw.decode("utf-8", errors="replace")
+    # Datas, resolução, coleções etc.: bytes crus (o agente não usa)
+    return raw
+
+
+def decode_message(data: bytes) -> IppMessage:
+    if len(data) < 9:
+        raise IppError("mensagem IPP curta demais")
+    major, minor, code, request_id = struct.unpack_from(">BBHI", data, 0)
+    pos = 8
+    groups: List[Tuple[int, Dict[str, List[Any]]]] = []
+    current: Optional[Dict[str, List[Any]]] = None
+    last_name: Optional[str] = None
+    try:
+        while True:
+            tag = data[pos]
+            pos += 1
+            if tag == TAG_END:
+                break
+            if tag < 0x10:
+                current = {}
+                groups.append((tag, current))
+                last_name = None
+                continue
+            name_len = struct.unpack_from(">H", data, pos)[0]
+            pos += 2
+            name = data[pos:pos + name_len].decode("ascii", errors="replace")
+            pos += name_len
+            value_len = struct.unpack_from(">H", data, pos)[0]
+            pos += 2
+            raw = data[pos:pos + value_len]
+            pos += value_len
+            if current is None:
+                raise IppError("atributo fora de grupo")
+            if name:
+                last_name = name
+                current.setdefault(name, []).append(_decode_value(tag, raw))
+            elif last_name is not None:
+                # Valor adicional (multi-valor ou membro de coleção)
+                current[last_name].append(_decode_value(tag, raw))
+    except (IndexError, struct.error) as e:
+        raise IppError(f"mensagem IPP truncada: {e}")
+    return IppMessage((major, minor), code, request_id, groups, data[pos:])
+
+
+def _operation_attrs(printer_uri: str, extra: Iterable[Tuple[str, int, Any]] = ()) -> List[Tuple[str, int, Any]]:
+    # Ordem exigida pela RFC 8011: charset, idioma, alvo
+    return [
+        ("attributes-charset", TAG_CHARSET, "utf-8"),
+        ("attributes-natural-language", TAG_LANGUAGE, "pt-br"),
+        ("printer-uri", TAG_URI, printer_uri),
+        *extra,
+    ]
+
+
+def _peer_closed(conn: http.client.HTTPConnection) -> bool:
+    """Keep-alive ocioso com algo para ler = impressora fechou (FIN/RST)."""
+    sock = conn.sock
+    if sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+class IppClient:
+    """Uma impressora IPP; conexão HTTP/1.1 reaproveitada entre requisições."""
+
+    def __init__(self, host: str, port: int = IPP_DEFAULT_PORT, path: str = IPP_DEFAULT_PATH,
+                 timeout: float = 10.0, user: str = "print-agent"):
+        self.host = host
+        self.port = int(port or IPP_DEFAULT_PORT)
+        self.path = path or IPP_DEFAULT_PATH
+        self.timeout = timeout
+        self.user = user
+        self._lock = threading.Lock()
+        self._conn: Optional[http.client.HTTPConnection] = None
+        self._last_used = 0.0
+        self._ids = itertools.count(1)
+        self.requests = 0
+        self.connects = 0
+
+    @property
+    def printer_uri(self) -> str:
+        port = "" if self.port == IPP_DEFAULT_PORT else f":{self.port}"
+        return f"ipp://{self.host}{port}{self.path}"
+
+    def close(self):
+        with self._lock:
+            self._drop()
+
+    def _drop(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def _connection(self) -> Tuple[http.client.HTTPConnection, bool]:
+        """(conexão, reaproveitada?). Chamar com _lock."""
+        if self._conn is not None and (
+            time.monotonic() - self._last_used > IPP_KEEPALIVE_IDLE_SEC or _peer_closed(self._conn)
+        ):
+            self._drop()
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.connects += 1
+            return self._conn, False
+        return self._conn, True
+
+    def request(self, operation: int, groups, data: bytes = b"") -> IppMessage:
+        """Envia uma operação e devolve a resposta; status de erro vira IppError."""
+        with self._lock:
+            request_id = next(self._ids)
+            body = encode_message(operation, request_id, groups, data)
+            headers = {"Content-Type": "application/ipp"}
+            for attempt in range(2):
+                conn, reused = self._connection()
+                try:
+                    conn.request("POST", self.path, body, headers)
+                except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+                    self._drop()
+                    # Keep-alive que a impressora já fechou: nada saiu, reconecta uma vez
+                    if reused and not attempt:
+                        continue
+                    raise
+                except (http.client.HTTPException, OSError):
+                    self._drop()
+                    raise
+                try:
+                    response = conn.getresponse()
+                    # Ler tudo: a conexão só volta a servir depois do corpo consumido
+                    payload = response.read()
+                except http.client.RemoteDisconnected as e:
+                    self._drop()
+                    # Fechou sem responder nada. Consulta pode repetir; Print-Job não:
+                    # o corpo já foi enviado e a impressora pode ter aceitado o cupom
+                    if reused and not attempt and operation != PRINT_JOB:
+                        continue
+                    raise IppDeliveryUnknown(f"sem resposta após enviar: {e}") from e
+                except (http.client.HTTPException, OSError) as e:
+                    # Timeout/reset com a requisição já enviada: não reenviar
+                    self._drop()
+                    raise IppDeliveryUnknown(f"sem resposta após enviar: {e}") from e
+                break
+            self._last_used = time.monotonic()
+            self.requests += 1
+            if response.will_close:
+                self._drop()
+        if response.status != 200:
+            raise IppError(f"HTTP {response.status}")
+        message = decode_message(payload)
+        if message.request_id != request_id:
+            raise IppError(f"request-id {message.request_id} != {request_id}")
+        if not message.ok:
+            message_text = message.attr(TAG_OPERATION, "status-message") or ""
+            raise IppError(f"IPP status 0x{message.code:04x} {message_text}".strip(), message.code)
+        return message
+
+    def print_job(self, document: bytes, job_name: str = "Print Agent",
+                  document_format: str = "application/octet-stream") -> Optional[int]:
+        """Print-Job; devolve o job-id (None se a impressora não informar)."""
+        groups = [(TAG_OPERATION, _operation_attrs(self.printer_uri, [
+            ("requesting-user-name", TAG_NAME, self.user),
+            ("job-name", TAG_NAME, job_name),
+            ("document-format", TAG_MIME, document_format),
+        ]))]
+        response = self.request(PRINT_JOB, groups, document)
+        job_id = response.attr(TAG_JOB, "job-id")
+        return job_id if isinstance(job_id, int) else None
+
+    def get_job_attributes(self, job_id: int,
+                           attributes: Iterable[str] = ("job-state", "job-state-reasons")) -> Dict[str, Any]:
+        groups = [(TAG_OPERATION, _operation_attrs(self.printer_uri, [
+            ("job-id", TAG_INTEGER, job_id),
+            ("requesting-user-name", TAG_NAME, self.user),
+            ("requested-attributes", TAG_KEYWORD, list(attributes)),
+        ]))]
+        response = self.request(GET_JOB_ATTRIBUTES, groups)
+        return {k: (v[0] if len(v) == 1 else v) for k, v in response.group(TAG_JOB).items()}
+
+    def get_printer_attributes(self, attributes: Iterable[str] = (
+        "printer-state", "printer-state-reasons", "printer-is-accepting-jobs", "queued-job-count",
+    )) -> Dict[str, Any]:
+        groups = [(TAG_OPERATION, _operation_attrs(self.printer_uri, [
+            ("requesting-user-name", TAG_NAME, self.user),
+            ("requested-attributes", TAG_KEYWORD, list(attributes)),
+        ]))]
+        response = self.request(GET_PRINTER_ATTRIBUTES, groups)
+        return {k: (v[0] if len(v) == 1 else v) for k, v in response.group(TAG_PRINTER).items()}
+
+    def purge_jobs(self) -> None:
+        groups = [(TAG_OPERATION, _operation_attrs(self.printer_uri, [
+            ("requesting-user-name", TAG_NAME, self.user),
+        ]))]
+        self.request(PURGE_JOBS, groups)
+
+    def wait_for_job(self, job_id: int, timeout: float,
+                     interval: float = IPP_JOB_POLL_INTERVAL_SEC) -> Optional[int]:
+        """
+        Consulta job-state até um estado final ou o timeout (intervalo dobra até
+        interval); devolve o último estado (None se a impressora não suporta
+        Get-Job-Attributes).
+        """
+        end = time.monotonic() + max(0.0, timeout)
+        delay = min(IPP_JOB_POLL_FIRST_SEC, interval)
+        state = None
+        while True:
+            try:
+                state = self.get_job_attributes(job_id).get("job-state")
+            except IppError as e:
+                if e.status_code == STATUS_OPERATION_NOT_SUPPORTED:
+                    return None
+                raise
+            if state in JOB_TERMINAL_STATES or time.monotonic() + delay > end:
+                return state
+            time.sleep(delay)
+            delay = min(delay * 2, interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"uri": self.printer_uri, "requests": self.requests, "connects": self.connects}
+
+
+_clients: Dict[tuple, IppClient] = {}
+_clients_lock = threading.Lock()
+
+
+def ipp_client_for(host: str, port: int = IPP_DEFAULT_PORT, path: str = IPP_DEFAULT_PATH,
+                   timeout: float = 10.0) -> IppClient:
+    """Cliente compartilhado por impressora (mantém a conexão keep-alive)."""
+    key = (str(host or "").strip().lower(), int(port or IPP_DEFAULT_PORT), path)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = IppClient(host, port, path, timeout=timeout)
+            _clients[key] = client
+        client.timeout = timeout
+        return client
+
+
+def ipp_client_stats() -> List[Dict[str, Any]]:
+    with _clients_lock:
+        clients = list(_clients.values())
+    return [c.stats() for c in clients]
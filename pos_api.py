@@ -5,9 +5,9 @@ import os
 import uuid
 from datetime import datetime, timezone
 from functools import wraps
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from flask import Blueprint, jsonify, request, send_file
+from flask import Blueprint, Response, jsonify, request, send_file
 
 import db
 from pos_catalog import media_dir, sync_catalog_from_cloud
@@ -15,7 +15,7 @@ from uniplus_handler import (
     get_open_mesa_conta,
     handle_uniplus_job,
     is_uniplus_enabled,
-    list_open_contas,
+    list_open_contas_cached,
     list_pedidos_dia,
     parse_numeromesa,
     set_item_entregue,
@@ -43,31 +43,24 @@ def _require_pos_token(fn):
 
 
 def _find_product(product_id: int) -> Optional[Dict[str, Any]]:
-    return db.get_pos_product(int(product_id))
+    return db.pos_catalog_index().product(product_id)
 
 
 def _option_codigo(product: Dict[str, Any], option_id: Any) -> str:
     if not option_id:
         return str(product.get("idUniplus") or "")
-    for variation in product.get("variations") or []:
-        for opt in variation.get("options") or []:
-            if int(opt.get("id") or 0) == int(option_id):
-                return str(opt.get("idUniplus") or product.get("idUniplus") or "")
+    opt = db.pos_catalog_index().option_by_product.get(
+        (int(product.get("id") or 0), int(option_id))
+    )
+    if opt is not None:
+        return str(opt.get("idUniplus") or product.get("idUniplus") or "")
     return str(product.get("idUniplus") or "")
 
 
 def _addon_codigo(addon_id: Any) -> str:
     if not addon_id:
         return ""
-    for group in db.list_pos_addon_groups():
-        for item in group.get("items") or []:
-            if int(item.get("id") or 0) == int(addon_id):
-                return str(item.get("idUniplus") or "")
-        for sg in group.get("subgroups") or []:
-            for item in sg.get("items") or []:
-                if int(item.get("id") or 0) == int(addon_id):
-                    return str(item.get("idUniplus") or "")
-    return ""
+    return db.pos_catalog_index().addon_codigo_by_id.get(int(addon_id), "")
 
 
 def _user_observation(item: Dict[str, Any]) -> str:
@@ -187,27 +180,7 @@ def _items_for_printer(items: List[Dict[str, Any]], group_names: List[str]) -> L
 
 
 def _grupo_by_codigo() -> Dict[str, str]:
-    out: Dict[str, str] = {}
-    for product in db.list_pos_products():
-        if not isinstance(product, dict):
-            continue
-        grupo = str(product.get("grupo") or "Outros").strip() or "Outros"
-        codigo = str(product.get("idUniplus") or "").strip()
-        if codigo:
-            out[codigo] = grupo
-        for variation in product.get("variations") or []:
-            if not isinstance(variation, dict):
-                continue
-            for opt in variation.get("options") or []:
-                if not isinstance(opt, dict):
-                    continue
-                oc = str(opt.get("idUniplus") or "").strip()
-                if oc:
-                    out[oc] = grupo
-        name = str(product.get("name") or "").strip().lower()
-        if name and name not in out:
-            out[f"name:{name}"] = grupo
-    return out
+    return db.pos_catalog_index().grupo_by_codigo
 
 
 def _printer_catalog() -> List[Dict[str, Any]]:
@@ -251,7 +224,14 @@ def _send_receipt(printer_cfg: Dict[str, Any], payload: Dict[str, Any], *, timeo
         timeout=timeout,
         max_retries=0,
     )
-    return bool(printer.print_receipt(format_order_receipt(payload)))
+    if printer.print_receipt(format_order_receipt(payload)):
+        return True
+    if printer.undelivered:
+        # Nada saiu: o pool pode mandar para outra impressora da rota
+        from print_pools import NotDelivered
+
+        raise NotDelivered(f"{printer_cfg.get('name') or printer_cfg.get('device_id') or '?'} não recebeu o cupom")
+    return False
 
 
 def _cancel_printer_queue(printer_cfg: Dict[str, Any]) -> Dict[str, Any]:
@@ -288,6 +268,8 @@ def _print_kitchen(payload: Dict[str, Any]) -> Dict[str, Any]:
     try:
         from concurrent.futures import ThreadPoolExecutor, wait
 
+        import print_pools
+
         printers = db.get_printers()
         if not printers:
             info["error"] = "Nenhuma impressora configurada"
@@ -307,19 +289,17 @@ def _print_kitchen(payload: Dict[str, Any]) -> Dict[str, Any]:
         jobs: List[tuple] = []
         if not routes:
             # Sem rotas configuradas: mantém comportamento antigo (todas as impressoras).
-            jobs = [(p, items) for p in printers]
+            jobs = [(pool, items) for pool in print_pools.single_pools(printers)]
         else:
             # Só imprime itens cujo grupo está na rota da impressora.
             # Grupos sem impressora (e sem rota "*") são ignorados — sem fallback.
-            for p in printers:
-                device_id = str(p.get("device_id") or "").strip().lower()
-                groups = routes.get(device_id)
-                if not groups:
-                    continue
-                subset = _items_for_printer(items, groups)
+            # Impressoras com a mesma rota formam um pool (uma imprime, as outras
+            # cobrem falha) quando o balanceamento está ligado.
+            for pool in print_pools.build_pools(printers, routes):
+                subset = _items_for_printer(items, pool.groups)
                 if not subset:
                     continue
-                jobs.append((p, subset))
+                jobs.append((pool, subset))
             skipped = [
                 it
                 for it in items
@@ -342,22 +322,19 @@ def _print_kitchen(payload: Dict[str, Any]) -> Dict[str, Any]:
             info["printed"] = True
             return info
 
-        def _run_job(printer_cfg: Dict[str, Any], subset: List[Dict[str, Any]]) -> bool:
+        def _run_job(pool, subset: List[Dict[str, Any]]) -> bool:
             job = dict(payload)
             job["menuItems"] = subset
-            try:
-                return _send_receipt(printer_cfg, job, timeout=4)
-            except Exception as exc:
-                print(f"[POS] impressora falhou: {exc}")
-                return False
+            return print_pools.send_to_pool(pool, lambda cfg: _send_receipt(cfg, job, timeout=4))
 
         ok = 0
         fail = 0
         errors: List[str] = []
         # Espera o suficiente para o POS receber printed=true/false real (não async).
-        wait_timeout = max(12, 4 * len(jobs) + 4)
+        # Failover: cada impressora extra do pool pode somar outra tentativa de 4s
+        wait_timeout = max(12, 4 * sum(len(p.members) for p, _ in jobs) + 4)
         with ThreadPoolExecutor(max_workers=min(4, len(jobs))) as pool:
-            futures = [pool.submit(_run_job, cfg, subset) for cfg, subset in jobs]
+            futures = [pool.submit(_run_job, printer_pool, subset) for printer_pool, subset in jobs]
             done, pending = wait(futures, timeout=wait_timeout)
             for fut in pending:
                 fail += 1
@@ -394,12 +371,26 @@ def pos_health():
         dsn = (db.get_config("uniplus_connection_string") or "").strip()
         uniplus_ok = bool(dsn)
         uniplus_msg = "configured" if dsn else "missing_dsn"
+    from printer_monitor import printer_health
+
+    # Estado do monitor (sem sondar na requisição)
+    printers = [
+        {
+            "deviceId": p["device_id"],
+            "name": p["name"],
+            "online": p["accessible"],
+            "state": p["state"],
+            "since": p["since"],
+        }
+        for p in printer_health()
+    ]
     return jsonify(
         {
             "ok": True,
             "catalogVersion": int(db.get_config("pos_catalog_version") or 0),
             "updatedAt": db.get_config("pos_catalog_updated_at") or "",
             "uniplus": {"ok": uniplus_ok, "status": uniplus_msg},
+            "printers": printers,
         }
     )
 
@@ -415,10 +406,42 @@ def pos_sync():
             db.set_config("pos_last_sync_error", str(exc))
             return jsonify({"error": str(exc), "catalog": db.build_pos_sync_payload()}), 502
     since = request.args.get("since")
-    payload = db.build_pos_sync_payload()
-    if since and str(payload.get("catalogVersion")) == str(since):
-        return jsonify({"unchanged": True, "catalogVersion": payload["catalogVersion"]})
-    return jsonify(payload)
+    # Versão vem do cache de config: "since" igual responde sem tocar no SQLite
+    version = db.get_config_int("pos_catalog_version", 0)
+    if since and str(version) == str(since):
+        return jsonify({"unchanged": True, "catalogVersion": version})
+    # Delta só para tablets que pedem (delta=1); fora do log cai no completo
+    if since and str(request.args.get("delta") or "").lower() in ("1", "true", "yes"):
+        try:
+            delta = db.build_pos_sync_delta(int(since))
+        except (TypeError, ValueError):
+            delta = None
+        if delta is not None:
+            return jsonify(delta)
+    snap = db.pos_sync_snapshot()
+    headers = {"ETag": snap.etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("If-None-Match"), snap.etag):
+        return Response(status=304, headers=headers)
+    if "gzip" in (request.headers.get("Accept-Encoding") or "").lower():
+        headers["Content-Encoding"] = "gzip"
+        body = snap.gzip
+    else:
+        body = snap.identity
+    return Response(body, status=200, mimetype="application/json", headers=headers)
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
 
 
 @pos_bp.route("/pos/sync", methods=["POST"])
@@ -457,16 +480,21 @@ def pos_login():
     return jsonify({"ok": True, "user": {"id": user["id"], "name": user["name"]}})
 
 
-def _mesas_com_status_uniplus() -> List[Dict[str, Any]]:
-    """Lista do catálogo local + ocupação lida do Uniplus (conta aberta)."""
+def _mesas_com_status_uniplus() -> Tuple[List[Dict[str, Any]], Optional[float]]:
+    """
+    Lista do catálogo local + ocupação lida do Uniplus (conta aberta), e quando
+    essa ocupação foi lida (cache compartilhado entre os tablets; None se a
+    leitura falhou e as mesas vão sem ocupação).
+    """
     mesas = db.list_pos_mesas()
     open_by_num: Dict[int, Dict[str, Any]] = {}
     try:
-        for conta in list_open_contas(db, tipopedido=1):
+        contas, generated_at = list_open_contas_cached(db, tipopedido=1)
+        for conta in contas:
             open_by_num[int(conta["numeromesa"])] = conta
     except Exception as exc:
         print(f"[POS] status Uniplus indisponível: {exc}")
-        return mesas
+        return mesas, None
 
     used_nums = set()
     for mesa in mesas:
@@ -499,13 +527,23 @@ def _mesas_com_status_uniplus() -> List[Dict[str, Any]]:
                 "section": None,
             }
         )
-    return mesas
+    return mesas, generated_at
 
 
 @pos_bp.route("/pos/mesas", methods=["GET"])
 @_require_pos_token
 def pos_mesas():
-    return jsonify({"mesas": _mesas_com_status_uniplus()})
+    mesas, generated_at = _mesas_com_status_uniplus()
+    return jsonify(
+        {
+            "mesas": mesas,
+            "generatedAt": (
+                datetime.fromtimestamp(generated_at, timezone.utc).isoformat()
+                if generated_at is not None
+                else None
+            ),
+        }
+    )
 
 
 @pos_bp.route("/pos/conta", methods=["GET"])
@@ -625,10 +663,7 @@ def pos_trocar_nome(mesa_id: int):
 
     uniplus_updated = False
     if numeromesa is not None:
-        try:
-            tipopedido = int(db.get_config("uniplus_mesa_tipopedido") or 1)
-        except (TypeError, ValueError):
-            tipopedido = 1
+        tipopedido = db.get_config_int("uniplus_mesa_tipopedido", 1)
         if tipopedido == 0:
             tipopedido = 1
         try:
@@ -707,10 +742,7 @@ def pos_orders():
     total = round(sum(float(it.get("valortotal") or 0) for it in itens), 2)
     now = datetime.now(timezone.utc)
     # PDV de mesa no Uniplus usa tipopedido=1; 0 é delivery e some da sala.
-    try:
-        tipopedido = int(db.get_config("uniplus_mesa_tipopedido") or 1)
-    except (TypeError, ValueError):
-        tipopedido = 1
+    tipopedido = db.get_config_int("uniplus_mesa_tipopedido", 1)
     if tipopedido == 0:
         tipopedido = 1
     conteudo = {
@@ -1,11 +1,15 @@
 """Sync do catálogo POS: Compuchat cloud → SQLite local + imagens."""
 from __future__ import annotations
 
+import hashlib
+import http.client
 import logging
 import os
 import threading
-import urllib.request
-from typing import Any, Dict
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, List
 
 import db
 from product_sync import _compuchat_request, _ssl_unverified_context
@@ -13,7 +17,15 @@ from product_sync import _compuchat_request, _ssl_unverified_context
 logger = logging.getLogger("pos_catalog")
 
 MEDIA_DIR = "pos_media"
+IMAGE_DOWNLOAD_WORKERS = 6
+IMAGE_TIMEOUT_SEC = 20
+IMAGE_CHUNK_SIZE = 64 * 1024
+IMAGE_MAX_REDIRECTS = 3
+# Tamanho do hex -> algoritmo para conferir o hash do catálogo
+_HASH_BY_HEX_LEN = {32: "md5", 40: "sha1", 64: "sha256"}
 _sync_lock = threading.Lock()
+_progress_lock = threading.Lock()
+_progress: Dict[str, Any] = {"running": False, "total": 0, "done": 0}
 
 
 def media_dir() -> str:
@@ -26,23 +38,162 @@ def fetch_cloud_catalog() -> Dict[str, Any]:
     return _compuchat_request("GET", "/agent/pos/catalog", timeout=45)
 
 
-def _download_image(url: str, dest: str) -> None:
-    req = urllib.request.Request(url, headers={"User-Agent": "Compuchat-PrintAgent"})
-    with urllib.request.urlopen(
-        req, timeout=20, context=_ssl_unverified_context()
-    ) as resp:
-        data = resp.read()
+def _open_connection(scheme: str, netloc: str) -> http.client.HTTPConnection:
+    if scheme == "https":
+        return http.client.HTTPSConnection(
+            netloc, timeout=IMAGE_TIMEOUT_SEC, context=_ssl_unverified_context()
+        )
+    return http.client.HTTPConnection(netloc, timeout=IMAGE_TIMEOUT_SEC)
+
+
+class _ConnectionReuse:
+    """Uma conexão keep-alive por (thread, host); fechadas juntas no fim do lote."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all: List[http.client.HTTPConnection] = []
+
+    def get(self, scheme: str, netloc: str, *, fresh: bool = False) -> http.client.HTTPConnection:
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        key = (scheme, netloc)
+        conn = conns.get(key)
+        if conn is not None and fresh:
+            conn.close()
+            conn = None
+        if conn is None:
+            conn = _open_connection(scheme, netloc)
+            conns[key] = conn
+            with self._lock:
+                self._all.append(conn)
+        return conn
+
+    def close_all(self) -> None:
+        with self._lock:
+            conns, self._all = self._all, []
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+def _request(pool: _ConnectionReuse, url: str, headers: Dict[str, str]):
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme not in ("http", "https"):
+        raise ValueError(f"URL de imagem inválida: {url}")
+    target = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+    for attempt in range(2):
+        conn = pool.get(parsed.scheme, parsed.netloc, fresh=attempt > 0)
+        try:
+            conn.request("GET", target, headers=headers)
+            return conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            # Keep-alive fechado pelo servidor: tenta uma vez com conexão nova
+            if attempt:
+                raise
+    raise RuntimeError("inalcançável")
+
+
+def _digest_for(hash_val: str):
+    algo = _HASH_BY_HEX_LEN.get(len(hash_val or ""))
+    if not algo:
+        return None
+    try:
+        int(hash_val, 16)
+    except ValueError:
+        return None
+    return hashlib.new(algo)
+
+
+def _download_image(
+    pool: _ConnectionReuse,
+    url: str,
+    dest: str,
+    *,
+    hash_val: str = "",
+    etag: str = "",
+    last_modified: str = "",
+) -> Dict[str, Any]:
+    """GET condicional com gravação em streaming (.tmp + os.replace)."""
+    headers = {"User-Agent": "Compuchat-PrintAgent", "Accept-Encoding": "identity"}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    for _ in range(IMAGE_MAX_REDIRECTS + 1):
+        resp = _request(pool, url, headers)
+        if resp.status in (301, 302, 303, 307, 308) and resp.getheader("Location"):
+            resp.read()
+            url = urllib.parse.urljoin(url, resp.getheader("Location"))
+            continue
+        break
+    else:
+        raise RuntimeError(f"Redirecionamentos demais: {url}")
+    validators = {
+        "etag": resp.getheader("ETag") or etag,
+        "last_modified": resp.getheader("Last-Modified") or last_modified,
+    }
+    if resp.status == 304:
+        resp.read()
+        return {"status": "not_modified", "bytes": 0, **validators}
+    if resp.status != 200:
+        resp.read()
+        raise RuntimeError(f"HTTP {resp.status}")
+
+    expected_len = resp.getheader("Content-Length")
+    digest = _digest_for(hash_val)
+    size = 0
     tmp = dest + ".tmp"
-    with open(tmp, "wb") as fh:
-        fh.write(data)
-    os.replace(tmp, dest)
+    try:
+        with open(tmp, "wb") as fh:
+            while True:
+                chunk = resp.read(IMAGE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                fh.write(chunk)
+                size += len(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+        if expected_len and expected_len.isdigit() and int(expected_len) != size:
+            raise RuntimeError(f"download incompleto ({size}/{expected_len} bytes)")
+        os.replace(tmp, dest)
+    except Exception:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    # O hash da cloud nem sempre é o digest do arquivo: divergência só é contada
+    mismatch = digest is not None and digest.hexdigest().lower() != hash_val.lower()
+    if mismatch:
+        logger.warning("Imagem %s: hash do arquivo difere do catálogo", url)
+    return {"status": "downloaded", "bytes": size, "hash_mismatch": mismatch, **validators}
+
+
+def _progress_update(**changes: Any) -> None:
+    with _progress_lock:
+        for key, value in changes.items():
+            if key in ("done", "downloaded", "skipped", "not_modified", "failed", "bytes", "hash_mismatch"):
+                _progress[key] = _progress.get(key, 0) + value
+            else:
+                _progress[key] = value
+
+
+def image_sync_progress() -> Dict[str, Any]:
+    """Contadores do download de imagens em andamento (ou do último)."""
+    with _progress_lock:
+        return dict(_progress)
 
 
 def _sync_images(images: list, *, force: bool = False) -> Dict[str, int]:
     folder = media_dir()
-    downloaded = 0
+    # Uma leitura do índice local em vez de uma consulta por imagem
+    existing = {i["id"]: i for i in db.list_pos_images()}
+    jobs = []
     skipped = 0
-    failed = 0
     for img in images or []:
         image_id = str(img.get("id") or img.get("hash") or "").strip()
         url = str(img.get("url") or "").strip()
@@ -50,30 +201,104 @@ def _sync_images(images: list, *, force: bool = False) -> Dict[str, int]:
         if not image_id or not url:
             continue
         dest = os.path.join(folder, image_id)
-        existing = db.get_pos_image(image_id)
-        if (
-            not force
-            and existing
-            and existing.get("hash") == hash_val
-            and existing.get("path")
-            and os.path.isfile(existing["path"])
-        ):
+        prev = existing.get(image_id)
+        has_file = bool(prev and prev.get("path") and os.path.isfile(prev["path"]))
+        if not force and has_file and prev.get("hash") == hash_val:
             skipped += 1
             continue
-        try:
-            _download_image(url, dest)
-            db.upsert_pos_image(image_id, url, hash_val, dest)
-            downloaded += 1
-        except Exception as exc:
-            failed += 1
-            logger.warning("Falha ao baixar imagem %s: %s", url, exc)
-    return {"downloaded": downloaded, "skipped": skipped, "failed": failed, "total": downloaded + skipped + failed}
+        conditional = not force and has_file
+        jobs.append({
+            "id": image_id,
+            "url": url,
+            "hash": hash_val,
+            "path": dest,
+            "etag": (prev or {}).get("etag") if conditional else "",
+            "last_modified": (prev or {}).get("last_modified") if conditional else "",
+        })
+
+    with _progress_lock:
+        _progress.clear()
+        _progress.update({
+            "running": True,
+            "total": len(jobs) + skipped,
+            "done": skipped,
+            "downloaded": 0,
+            "skipped": skipped,
+            "not_modified": 0,
+            "failed": 0,
+            "bytes": 0,
+            "hash_mismatch": 0,
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "finished_at": None,
+        })
+
+    pool = _ConnectionReuse()
+    rows: List[Dict[str, Any]] = []
+
+    def _one(job: Dict[str, Any]) -> Dict[str, Any]:
+        return _download_image(
+            pool,
+            job["url"],
+            job["path"],
+            hash_val=job["hash"],
+            etag=job["etag"],
+            last_modified=job["last_modified"],
+        )
+
+    try:
+        if jobs:
+            workers = min(IMAGE_DOWNLOAD_WORKERS, len(jobs))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pos-image") as executor:
+                futures = {executor.submit(_one, job): job for job in jobs}
+                for fut in as_completed(futures):
+                    job = futures[fut]
+                    try:
+                        result = fut.result()
+                    except Exception as exc:
+                        logger.warning("Falha ao baixar imagem %s: %s", job["url"], exc)
+                        _progress_update(done=1, failed=1)
+                        continue
+                    rows.append({
+                        "id": job["id"],
+                        "url": job["url"],
+                        "hash": job["hash"],
+                        "path": job["path"],
+                        "etag": result.get("etag") or "",
+                        "last_modified": result.get("last_modified") or "",
+                    })
+                    status = result["status"]
+                    _progress_update(
+                        done=1,
+                        bytes=result.get("bytes") or 0,
+                        hash_mismatch=1 if result.get("hash_mismatch") else 0,
+                        **{status: 1},
+                    )
+        db.upsert_pos_images(rows)
+    finally:
+        pool.close_all()
+        _progress_update(running=False, finished_at=datetime.now().isoformat(timespec="seconds"))
+
+    progress = image_sync_progress()
+    return {
+        "downloaded": progress["downloaded"],
+        "not_modified": progress["not_modified"],
+        "skipped": progress["skipped"],
+        "failed": progress["failed"],
+        "bytes": progress["bytes"],
+        "total": progress["total"],
+    }
 
 
 def sync_catalog_from_cloud() -> Dict[str, Any]:
     with _sync_lock:
         catalog = fetch_cloud_catalog()
-        db.replace_pos_catalog(catalog)
+        current = db.get_config_int("pos_catalog_version", 0)
+        new_version = int(catalog.get("catalogVersion") or 0)
+        if new_version >= current and db.has_pos_entity_hashes():
+            applied = db.apply_pos_catalog_delta(catalog)
+        else:
+            # Banco antigo sem hashes ou versão da cloud voltou: substitui tudo
+            applied = db.replace_pos_catalog(catalog)
         images = _sync_images(catalog.get("images") or [])
         db.set_config("pos_last_sync_error", "")
         return {
@@ -82,6 +307,7 @@ def sync_catalog_from_cloud() -> Dict[str, Any]:
             "users": len(catalog.get("users") or []),
             "mesas": len(catalog.get("mesas") or []),
             "products": len(catalog.get("products") or []),
+            "applied": applied,
             "images": images,
         }
 
@@ -0,0 +1,194 @@
+"""Pools de impressoras por rota: impressoras com a mesma lista de grupos formam um
+pool; cada cupom vai para uma delas (menor fila ou rodízio) e, se o envio falhar,
+para a próxima saudável. Com o balanceamento desligado cada impressora é um pool
+de uma só (comportamento antigo: todas as impressoras da rota imprimem).
+"""
+from __future__ import annotations
+
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import db
+from printer_monitor import printer_monitor
+from printer_service import print_dispatcher, printer_key_for_config
+
+# Config "print_route_balance": off | least_queue | round_robin
+BALANCE_MODES = ("off", "least_queue", "round_robin")
+POOL_LATENCY_SAMPLES = 200
+
+
+class NotDelivered(Exception):
+    """Envio falhou sem nenhum byte chegar à impressora: outra do pool pode imprimir."""
+
+
+def balance_mode() -> str:
+    mode = (db.get_config("print_route_balance") or "off").strip().lower()
+    return mode if mode in BALANCE_MODES else "off"
+
+
+class _PoolStats:
+    """Contadores de um pool (persistem entre pedidos; chave = grupos da rota)."""
+
+    def __init__(self, groups: List[str]):
+        self.groups = groups
+        self.lock = threading.Lock()
+        self.rr = itertools.count()
+        self.jobs = 0
+        self.printed = 0
+        self.failed = 0
+        self.failovers = 0
+        self.by_printer: Dict[str, int] = {}
+        self.samples: deque = deque(maxlen=POOL_LATENCY_SAMPLES)  # (fim, segundos)
+
+
+_stats_lock = threading.Lock()
+_stats: Dict[tuple, _PoolStats] = {}
+
+
+def _stats_for(key: tuple, groups: List[str]) -> _PoolStats:
+    with _stats_lock:
+        stats = _stats.get(key)
+        if stats is None:
+            stats = _PoolStats(groups)
+            _stats[key] = stats
+        return stats
+
+
+class PrinterPool:
+    """Impressoras que atendem exatamente os mesmos grupos."""
+
+    def __init__(self, key: tuple, groups: List[str], members: List[Dict[str, Any]], mode: str):
+        self.key = key
+        self.groups = groups
+        self.members = members
+        self.mode = mode
+        self._stats = _stats_for(key, groups)
+
+    @property
+    def name(self) -> str:
+        return ", ".join(self.groups)
+
+    def candidates(self) -> List[Dict[str, Any]]:
+        """Ordem de tentativa: saudáveis primeiro, pela regra do modo; offline por último."""
+        if len(self.members) == 1:
+            return list(self.members)
+        start = next(self._stats.rr) % len(self.members)
+        rotated = self.members[start:] + self.members[:start]
+        monitor = printer_monitor()
+        if self.mode == "least_queue":
+            dispatcher = print_dispatcher()
+            # sorted é estável: empate na fila mantém o rodízio
+            rotated = sorted(rotated, key=lambda m: dispatcher.load(printer_key_for_config(m)))
+        return sorted(rotated, key=lambda m: monitor.is_up(m) is False)
+
+    def record(self, cfg: Dict[str, Any], ok: bool, seconds: float, attempt: int):
+        stats = self._stats
+        device_id = str(cfg.get("device_id") or "").strip()
+        with stats.lock:
+            if attempt == 0:
+                stats.jobs += 1
+            else:
+                stats.failovers += 1
+            if ok:
+                stats.printed += 1
+                stats.by_printer[device_id] = stats.by_printer.get(device_id, 0) + 1
+                stats.samples.append((time.monotonic(), seconds))
+
+    def record_failure(self):
+        with self._stats.lock:
+            self._stats.failed += 1
+
+
+def build_pools(
+    printers: List[Dict[str, Any]],
+    routes: Dict[str, List[str]],
+    mode: Optional[str] = None,
+) -> List[PrinterPool]:
+    """Agrupa as impressoras com rota pela lista de grupos (ordem da config)."""
+    mode = mode or balance_mode()
+    by_groups: Dict[tuple, List[Dict[str, Any]]] = {}
+    groups_by_key: Dict[tuple, List[str]] = {}
+    for p in printers:
+        device_id = str(p.get("device_id") or "").strip().lower()
+        groups = routes.get(device_id)
+        if not groups:
+            continue
+        key = tuple(sorted({g.strip().lower() for g in groups}))
+        if mode == "off":
+            # Sem balanceamento o pool é a própria impressora
+            key += ("@" + device_id,)
+        by_groups.setdefault(key, []).append(p)
+        groups_by_key.setdefault(key, groups)
+    return [PrinterPool(key, groups_by_key[key], members, mode) for key, members in by_groups.items()]
+
+
+def single_pools(printers: List[Dict[str, Any]]) -> List[PrinterPool]:
+    """Sem rotas configuradas: cada impressora recebe o pedido inteiro."""
+    pools = []
+    for idx, p in enumerate(printers):
+        device_id = str(p.get("device_id") or "").strip().lower() or str(idx)
+        pools.append(PrinterPool(("*", "@" + device_id), ["*"], [p], "off"))
+    return pools
+
+
+def send_to_pool(pool: PrinterPool, send) -> bool:
+    """
+    send(cfg) em cada candidata até uma imprimir. Failover só quando o cupom com
+    certeza não saiu: send levanta NotDelivered (conexão recusada/timeout antes do
+    primeiro byte, fila cheia, prazo vencido) ou falha com a impressora offline no
+    monitor. send devolvendo False (cortou no meio, ainda na fila, fila cancelada)
+    encerra: outra impressora duplicaria o cupom na cozinha.
+    """
+    candidates = pool.candidates()
+    for attempt, cfg in enumerate(candidates):
+        started = time.monotonic()
+        failover = False
+        try:
+            ok = bool(send(cfg))
+        except NotDelivered as exc:
+            print(f"[POS] impressora não recebeu o cupom: {exc}")
+            ok, failover = False, True
+        except Exception as exc:
+            print(f"[POS] impressora falhou: {exc}")
+            ok, failover = False, printer_monitor().is_up(cfg) is False
+        pool.record(cfg, ok, time.monotonic() - started, attempt)
+        if ok:
+            return True
+        # Confirma o estado já: o próximo pedido não insiste na mesma impressora
+        printer_monitor().request_probe(cfg)
+        if not failover:
+            break
+        if attempt + 1 < len(candidates):
+            print(f"[POS] impressora {cfg.get('name') or cfg.get('device_id')} falhou; tentando outra do pool {pool.name}")
+    pool.record_failure()
+    return False
+
+
+def pool_stats() -> List[Dict[str, Any]]:
+    """Por pool: cupons, falhas, failovers, vazão no último minuto e latência de envio."""
+    with _stats_lock:
+        pools = list(_stats.values())
+    now = time.monotonic()
+    out = []
+    for stats in pools:
+        with stats.lock:
+            if not stats.jobs:
+                continue
+            samples = sorted(seconds for _, seconds in stats.samples)
+            out.append(
+                {
+                    "groups": stats.groups,
+                    "jobs": stats.jobs,
+                    "printed_last_min": sum(1 for at, _ in stats.samples if now - at <= 60),
+                    "printed": stats.printed,
+                    "failed": stats.failed,
+                    "failovers": stats.failovers,
+                    "by_printer": dict(stats.by_printer),
+                    "avg_ms": int(sum(samples) / len(samples) * 1000) if samples else 0,
+                    "p95_ms": int(samples[max(0, int(len(samples) * 0.95) - 1)] * 1000) if samples else 0,
+                }
+            )
+    return out
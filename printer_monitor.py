@@ -0,0 +1,354 @@
+"""Monitor de disponibilidade das impressoras de rede.
+
+Uma thread sonda cada impressora em intervalo adaptativo (online: devagar; offline:
+backoff curto, mais curto ainda com job esperando), publica as transições
+online/offline e acorda os jobs que esperam a impressora voltar. /status e
+/pos/health leem o estado daqui em vez de sondar na requisição.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import db
+from error_recovery import ConnectionHealthChecker
+from printer_service import printer_key_for_config, probe_raw_printer, raw_pool_has_idle
+
+# Online: confirma de tempos em tempos (connect simples, sem prender a térmica)
+MONITOR_UP_INTERVAL_SEC = 15.0
+# Offline: backoff entre sondagens
+MONITOR_DOWN_MIN_SEC = 1.0
+MONITOR_DOWN_MAX_SEC = 30.0
+# Offline com job esperando: nunca mais que isso sem sondar
+MONITOR_DOWN_WAITING_MAX_SEC = 5.0
+MONITOR_PROBE_TIMEOUT_SEC = 2.0
+MONITOR_PROBE_WORKERS = 4
+# Lista de impressoras relida no máximo a cada X (get_printers vem do cache de config)
+MONITOR_REFRESH_SEC = 10.0
+# Impressora que só apareceu num job (fora da lista) some depois disso sem uso
+MONITOR_ADHOC_TTL_SEC = 600.0
+
+
+class _Target:
+    """Estado de uma impressora (chave do dispatcher)."""
+
+    def __init__(self, key, cfg):
+        self.key = key
+        self.cfg = dict(cfg)
+        self.up: Optional[bool] = None
+        self.changed_at: Optional[str] = None
+        self.checked_at = 0.0
+        self.next_at = 0.0
+        self.down_interval = MONITOR_DOWN_MIN_SEC
+        self.failures = 0
+        self.transitions = 0
+        self.waiters = 0
+        self.probing = False
+        self.listed = False
+        self.used_at = time.monotonic()
+
+    @property
+    def is_local(self) -> bool:
+        return (self.cfg.get("connection_type") or "network") == "local"
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "key": list(self.key),
+            "device_id": self.cfg.get("device_id") or "",
+            "state": "unknown" if self.up is None else ("up" if self.up else "down"),
+            "since": self.changed_at,
+            "checked_ago_ms": int((time.monotonic() - self.checked_at) * 1000) if self.checked_at else None,
+            "failures": self.failures,
+            "transitions": self.transitions,
+            "waiters": self.waiters,
+        }
+
+
+class PrinterMonitor:
+    """Uma sondagem por impressora, compartilhada por todos os jobs e pelo /health."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._targets: Dict[tuple, _Target] = {}
+        self._listeners: List[Callable[[tuple, bool, Dict[str, Any]], None]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._should_stop = False
+        self._refresh_at = 0.0
+
+    # --- ciclo de vida -------------------------------------------------
+
+    def start(self):
+        with self._cond:
+            self._should_stop = False
+            if self._thread and self._thread.is_alive():
+                return
+            self._executor = ThreadPoolExecutor(
+                max_workers=MONITOR_PROBE_WORKERS, thread_name_prefix="printer-probe"
+            )
+            self._thread = threading.Thread(target=self._loop, name="printer-monitor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._should_stop = True
+            self._cond.notify_all()
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def invalidate(self):
+        """Relê a lista de impressoras no próximo ciclo (config salva)."""
+        with self._cond:
+            self._refresh_at = 0.0
+            self._cond.notify_all()
+
+    # --- API para jobs e health ----------------------------------------
+
+    def subscribe(self, callback: Callable[[tuple, bool, Dict[str, Any]], None]) -> Callable[[], None]:
+        """callback(chave, online, estado) a cada transição. Retorna o cancelamento."""
+        with self._cond:
+            self._listeners.append(callback)
+
+        def _unsubscribe():
+            with self._cond:
+                if callback in self._listeners:
+                    self._listeners.remove(callback)
+
+        return _unsubscribe
+
+    def wait_until_up(self, cfg, timeout: float) -> bool:
+        """
+        Bloqueia até a impressora ficar online ou o timeout vencer (sem sondar aqui:
+        quem sonda é o monitor, e todos os jobs da mesma impressora esperam juntos).
+        """
+        self.start()
+        end = time.monotonic() + max(0.0, timeout)
+        with self._cond:
+            target = self._target_for(cfg)
+            if target.is_local:
+                return True
+            if target.up is True:
+                return True
+            target.waiters += 1
+            # Job esperando: não deixa o backoff de "offline" passar do teto curto
+            now = time.monotonic()
+            if target.up is None or target.next_at - now > MONITOR_DOWN_WAITING_MAX_SEC:
+                target.next_at = now
+            target.down_interval = min(target.down_interval, MONITOR_DOWN_WAITING_MAX_SEC)
+            self._cond.notify_all()
+            try:
+                while target.up is not True and not self._should_stop:
+                    remaining = end - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                return target.up is True
+            finally:
+                target.waiters -= 1
+
+    def request_probe(self, cfg):
+        """Sonda já (ex.: envio falhou com a impressora marcada online)."""
+        self.start()
+        with self._cond:
+            target = self._target_for(cfg)
+            target.next_at = 0.0
+            self._cond.notify_all()
+
+    def is_up(self, cfg) -> Optional[bool]:
+        with self._cond:
+            target = self._targets.get(tuple(printer_key_for_config(cfg)))
+            if target is None:
+                return None
+            return True if target.is_local else target.up
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._cond:
+            return [t.as_dict() for t in self._targets.values()]
+
+    def printer_health(self) -> List[Dict[str, Any]]:
+        """Lista no formato do /health: uma entrada por impressora configurada."""
+        self.start()
+        out = []
+        for p in db.get_printers():
+            with self._cond:
+                target = self._targets.get(tuple(printer_key_for_config(p)))
+                up = target.up if target else None
+                since = target.changed_at if target else None
+            base = {
+                "device_id": p.get("device_id", ""),
+                "name": p.get("name") or p.get("device_id") or "",
+            }
+            if p.get("connection_type") == "network":
+                printer_ip = p.get("printer_ip", "")
+                printer_port = p.get("printer_port", 9100)
+                if up is None and printer_ip:
+                    # Ainda sem sondagem: socket ocioso do pool já prova que ela está lá
+                    up = raw_pool_has_idle(printer_ip, printer_port) or None
+                out.append(
+                    {
+                        **base,
+                        "connection_type": "network",
+                        "printer_ip": printer_ip,
+                        "printer_port": printer_port,
+                        "accessible": bool(up),
+                        "state": "unknown" if up is None else ("up" if up else "down"),
+                        "since": since,
+                    }
+                )
+            else:
+                out.append(
+                    {
+                        **base,
+                        "connection_type": "local",
+                        "printer_name_local": p.get("printer_name_local") or "",
+                        "accessible": True,
+                        "state": "up",
+                        "since": None,
+                    }
+                )
+        return out
+
+    # --- internos ------------------------------------------------------
+
+    def _target_for(self, cfg) -> _Target:
+        """Chamar com _cond. Cria a impressora sob demanda (job com config fora da lista)."""
+        key = tuple(printer_key_for_config(cfg))
+        target = self._targets.get(key)
+        if target is None:
+            target = _Target(key, cfg)
+            self._targets[key] = target
+        else:
+            target.cfg.update({k: v for k, v in (cfg or {}).items() if v not in (None, "")})
+        target.used_at = time.monotonic()
+        return target
+
+    def _refresh_targets(self, now: float):
+        """Chamar com _cond."""
+        listed = set()
+        for p in db.get_printers():
+            if p.get("connection_type") == "network" and not str(p.get("printer_ip") or "").strip():
+                continue
+            target = self._target_for(p)
+            target.listed = True
+            listed.add(target.key)
+        for key, target in list(self._targets.items()):
+            if key in listed:
+                continue
+            target.listed = False
+            if not target.waiters and now - target.used_at > MONITOR_ADHOC_TTL_SEC:
+                del self._targets[key]
+        self._refresh_at = now + MONITOR_REFRESH_SEC
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if self._should_stop:
+                    return
+                now = time.monotonic()
+                if now >= self._refresh_at:
+                    try:
+                        self._refresh_targets(now)
+                    except Exception as e:
+                        print(f"[WARN] Monitor de impressoras: falha ao ler impressoras: {e}")
+                        self._refresh_at = now + MONITOR_REFRESH_SEC
+                due = []
+                wake_at = self._refresh_at
+                for target in self._targets.values():
+                    if target.is_local or target.probing:
+                        continue
+                    if target.next_at <= now:
+                        target.probing = True
+                        due.append((target, target.waiters > 0))
+                    else:
+                        wake_at = min(wake_at, target.next_at)
+                executor = self._executor
+                if not due:
+                    self._cond.wait(max(0.05, wake_at - now))
+                    continue
+            for target, for_job in due:
+                try:
+                    if executor is None:
+                        raise RuntimeError("monitor parado")
+                    executor.submit(self._probe, target, for_job)
+                except RuntimeError:
+                    # Executor encerrado (stop): a thread sai no próximo ciclo
+                    with self._cond:
+                        target.probing = False
+
+    def _probe(self, target: _Target, for_job: bool):
+        cfg = target.cfg
+        ip = str(cfg.get("printer_ip") or "").strip()
+        port = cfg.get("printer_port") or 9100
+        ok = False
+        try:
+            if raw_pool_has_idle(ip, port):
+                ok = True
+            elif (cfg.get("printer_type") or "raw") == "raw" and for_job:
+                # Job esperando: a conexão do probe fica no pool para o cupom
+                ok = probe_raw_printer(ip, port, MONITOR_PROBE_TIMEOUT_SEC)
+            else:
+                ok = ConnectionHealthChecker.check_printer_connection(
+                    ip, int(port), timeout=MONITOR_PROBE_TIMEOUT_SEC
+                )
+        except Exception as e:
+            print(f"[WARN] Monitor de impressoras: sondagem de {ip}:{port} falhou: {e}")
+        self._record(target, ok)
+
+    def _record(self, target: _Target, ok: bool):
+        listeners = []
+        with self._cond:
+            now = time.monotonic()
+            target.probing = False
+            target.checked_at = now
+            if ok:
+                target.failures = 0
+                target.down_interval = MONITOR_DOWN_MIN_SEC
+                target.next_at = now + MONITOR_UP_INTERVAL_SEC
+            else:
+                target.failures += 1
+                target.next_at = now + target.down_interval
+                cap = MONITOR_DOWN_WAITING_MAX_SEC if target.waiters else MONITOR_DOWN_MAX_SEC
+                target.down_interval = min(target.down_interval * 2, cap)
+            changed = target.up is not ok
+            if changed:
+                first = target.up is None
+                target.up = ok
+                target.changed_at = datetime.now().isoformat(timespec="seconds")
+                target.transitions += 1
+                listeners = list(self._listeners)
+                state = target.as_dict()
+                if not (first and ok):
+                    ip = target.cfg.get("printer_ip") or ""
+                    port = target.cfg.get("printer_port") or 9100
+                    level = "INFO" if ok else "WARN"
+                    print(f"[{level}] Impressora {ip}:{port} {'online' if ok else 'offline'}")
+            self._cond.notify_all()
+        for callback in listeners:
+            try:
+                callback(target.key, ok, state)
+            except Exception as e:
+                print(f"[WARN] Monitor de impressoras: listener falhou: {e}")
+
+
+_monitor = PrinterMonitor()
+db.subscribe_config(lambda _changes: _monitor.invalidate(), keys=("printers",))
+
+
+def printer_monitor() -> PrinterMonitor:
+    return _monitor
+
+
+def start_printer_monitor() -> None:
+    _monitor.start()
+
+
+def stop_printer_monitor() -> None:
+    _monitor.stop()
+
+
+def printer_health() -> List[Dict[str, Any]]:
+    return _monitor.printer_health()
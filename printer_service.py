@@ -1,15 +1,24 @@
+import hashlib
+import heapq
 import socket
-import http.client
 import json
 import threading
 import time
+from collections import OrderedDict
 from datetime import datetime
 
+import db
 from error_recovery import (
     retry_with_backoff,
     RetryConfig,
     EncodingFallback,
 )
+from ipp_client import JOB_ABORTED, JOB_CANCELED, JOB_COMPLETED, IppDeliveryUnknown, ipp_client_for
+from receipt_layout import (
+    _layout_width_for_font_scale,
+    _wrap_text_by_words,
+    compiled_layout,
+)
 
 # Tentar importar win32print para impressoras locais (Windows)
 try:
@@ -58,13 +67,6 @@ def _resolve_font_scale(receipt_data) -> int:
     return 1
 
 
-def _layout_width_for_font_scale(paper_width: int, scale: int) -> int:
-    w = min(max(int(paper_width or 32), 24), 48)
-    if int(scale or 1) >= 3:
-        return max(12, w // 2)
-    return w
-
-
 def _escpos_pickup_banner(encoding: str = "cp850") -> bytes:
     """Banner grande e centralizado — sempre no fim, independente da escala do cupom."""
     try:
@@ -152,6 +154,17 @@ class _QueueCancelled(Exception):
     """Impressão abortada porque a fila foi cancelada."""
 
 
+class _PartialWrite(Exception):
+    """Parte do cupom já saiu pelo socket: reenviar duplicaria a impressão."""
+
+
+def _send_counted(sock, data: bytes, sent: list):
+    """sendall que conta em sent[0] quantos bytes já saíram (mesmo se falhar no meio)."""
+    view = memoryview(data)
+    while sent[0] < len(data):
+        sent[0] += sock.send(view[sent[0]:])
+
+
 def _as_int(value, default):
     try:
         if value is None or value == "":
@@ -191,6 +204,8 @@ def _unregister_sock(sock):
 def _close_active_socks(key):
     with _active_lock:
         victims = [sock for k, sock in _active_socks if k == key]
+    # Conexões ociosas do pool também caem: o cancelamento vale para a impressora toda
+    _raw_pool.discard(key)
     closed = 0
     for sock in victims:
         try:
@@ -205,18 +220,580 @@ def _close_active_socks(key):
     return closed
 
 
+# Pool de sockets RAW (9100): reaproveita a conexão TCP entre cupons.
+# Muitas térmicas só atendem uma conexão por vez — o ocioso não pode durar muito.
+RAW_POOL_IDLE_SECONDS = 15.0
+# Ociosa há mais que isso: confirma com DLE EOT antes de reutilizar
+RAW_POOL_PROBE_AFTER_SECONDS = 3.0
+RAW_STATUS_TIMEOUT = 0.5
+_DLE_EOT_PRINTER_STATUS = b"\x10\x04\x01"
+# IPP: acompanha o job-state até o fim por no máximo isso (depois conta como aceito)
+IPP_JOB_WAIT_SECONDS = 10.0
+
+
+def _is_status_byte(value: int) -> bool:
+    # Resposta ESC/POS de status: bits 1 e 4 ligados, bits 0 e 7 desligados
+    return (value & 0x93) == 0x12
+
+
+class _RawSocketPool:
+    """Uma conexão ociosa por impressora (a fila do dispatcher já serializa o envio)."""
+
+    def __init__(self, idle_seconds=RAW_POOL_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._idle = {}  # key -> (sock, released_at)
+        self._dle_eot = {}  # key -> impressora responde DLE EOT?
+        self._reaper = None
+        self.connects = 0
+        self.reused = 0
+        self.stale = 0
+
+    def _connect(self, host, port, timeout):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.settimeout(timeout)
+        try:
+            sock.connect((host, int(port)))
+        except Exception:
+            _close_quietly(sock)
+            raise
+        with self._lock:
+            self.connects += 1
+        return sock
+
+    def _peer_closed(self, sock) -> bool:
+        """Leitura sem bloquear: b"" = impressora fechou; bytes soltos são descartados."""
+        try:
+            sock.setblocking(False)
+            try:
+                while True:
+                    chunk = sock.recv(256)
+                    if not chunk:
+                        return True
+            finally:
+                sock.setblocking(True)
+        except (BlockingIOError, InterruptedError):
+            return False
+        except OSError:
+            return True
+
+    def _status_ok(self, key, sock, timeout) -> bool:
+        """DLE EOT 1. Sem resposta na 1ª vez: impressora não suporta, passa a confiar no peek."""
+        if self._dle_eot.get(key) is False:
+            return True
+        try:
+            sock.settimeout(RAW_STATUS_TIMEOUT)
+            sock.sendall(_DLE_EOT_PRINTER_STATUS)
+            reply = sock.recv(1)
+        except socket.timeout:
+            if key not in self._dle_eot:
+                self._dle_eot[key] = False
+                return True
+            return False
+        except OSError:
+            return False
+        finally:
+            try:
+                sock.settimeout(timeout)
+            except OSError:
+                pass
+        if not reply or not _is_status_byte(reply[0]):
+            return False
+        self._dle_eot[key] = True
+        return True
+
+    def acquire(self, key, host, port, timeout):
+        """Devolve (sock, reutilizado). Conexão ociosa morta é trocada sem o chamador ver."""
+        with self._lock:
+            entry = self._idle.pop(key, None)
+        if entry is not None:
+            sock, released_at = entry
+            idle = time.monotonic() - released_at
+            alive = idle < self.idle_seconds and not self._peer_closed(sock)
+            if alive and idle >= RAW_POOL_PROBE_AFTER_SECONDS:
+                alive = self._status_ok(key, sock, timeout)
+            if alive:
+                sock.settimeout(timeout)
+                with self._lock:
+                    self.reused += 1
+                return sock, True
+            with self._lock:
+                self.stale += 1
+            _close_quietly(sock)
+        return self._connect(host, port, timeout), False
+
+    def release(self, key, sock, *, broken=False):
+        if broken or self.idle_seconds <= 0:
+            _close_quietly(sock)
+            return
+        with self._lock:
+            old = self._idle.get(key)
+            self._idle[key] = (sock, time.monotonic())
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap, name="raw-pool-reaper", daemon=True)
+                self._reaper.start()
+        if old is not None and old[0] is not sock:
+            _close_quietly(old[0])
+
+    def discard(self, key=None):
+        with self._lock:
+            if key is None:
+                victims = [sock for sock, _ in self._idle.values()]
+                self._idle.clear()
+            else:
+                entry = self._idle.pop(key, None)
+                victims = [entry[0]] if entry else []
+        for sock in victims:
+            _close_quietly(sock)
+        return len(victims)
+
+    def has_idle(self, key) -> bool:
+        with self._lock:
+            entry = self._idle.get(key)
+        return bool(entry and time.monotonic() - entry[1] < self.idle_seconds)
+
+    def _reap(self):
+        """Fecha ociosas vencidas para liberar a impressora a outros clientes."""
+        while True:
+            time.sleep(max(1.0, self.idle_seconds / 3))
+            now = time.monotonic()
+            with self._lock:
+                expired = [k for k, (_, at) in self._idle.items() if now - at >= self.idle_seconds]
+                victims = [self._idle.pop(k)[0] for k in expired]
+                if not self._idle:
+                    self._reaper = None
+            for sock in victims:
+                _close_quietly(sock)
+            if self._reaper is None:
+                return
+
+    def stats(self):
+        with self._lock:
+            return {
+                "idle": len(self._idle),
+                "connects": self.connects,
+                "reused": self.reused,
+                "stale": self.stale,
+            }
+
+
+def _close_quietly(sock):
+    try:
+        sock.close()
+    except Exception:
+        pass
+
+
+_raw_pool = _RawSocketPool()
+
+
+def raw_pool_stats():
+    return _raw_pool.stats()
+
+
+def raw_pool_has_idle(printer_ip, printer_port) -> bool:
+    """Há conexão ociosa viva para a impressora (dispensa sondar com outro connect)."""
+    return _raw_pool.has_idle(_printer_key("network", printer_ip, printer_port, None))
+
+
+def probe_raw_printer(printer_ip, printer_port, timeout=3.0) -> bool:
+    """
+    Testa a impressora RAW pela conexão do pool e a deixa ociosa para o cupom seguinte
+    (em vez de um connect só para sondar e outro para imprimir).
+    """
+    key = _printer_key("network", printer_ip, printer_port, None)
+    try:
+        sock, _ = _raw_pool.acquire(key, printer_ip, _as_int(printer_port, 9100), timeout)
+    except OSError:
+        return False
+    _raw_pool.release(key, sock)
+    return True
+
+
 _drain_until = {}
-_print_sem_lock = threading.Lock()
-_print_sems = {}
 
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9
+PRINT_QUEUE_MAX = 200
+# Tempo máximo que quem enfileira espera por vaga (backpressure)
+PRINT_QUEUE_PUT_TIMEOUT = 45.0
+# Cupom síncrono (print_receipt): prazo para chegar a vez na impressora, como o
+# antigo semáforo; depois de começar, espera o envio (timeouts do próprio envio)
+PRINT_TURN_TIMEOUT = 45.0
+PRINT_SEND_GRACE_SECONDS = 15.0
+# Worker ocioso encerra; a próxima submissão recria
+PRINT_WORKER_IDLE_SECONDS = 300.0
+# Coalescência (opt-in via config print_coalesce_window_ms): limites por escrita
+COALESCE_MAX_JOBS = 8
+COALESCE_MAX_BYTES = 256 * 1024
+
+
+def coalesce_window_seconds() -> float:
+    """Janela para juntar cupons da mesma impressora; 0 = desligado."""
+    return max(0, db.get_config_int("print_coalesce_window_ms", 0)) / 1000.0
+
+
+class PrintQueueFull(Exception):
+    """Fila da impressora cheia além do tempo de espera do chamador."""
+
+
+class PrintDeadlineExpired(Exception):
+    """O job passou do prazo antes de chegar na impressora."""
+
+
+class PrintTicket:
+    """Resultado de um job enfileirado; wait() bloqueia até o worker terminar."""
+
+    def __init__(self, key, fn, priority, deadline, on_done=None, payload=None, sender=None):
+        self.key = key
+        self.fn = fn
+        self.priority = priority
+        self.deadline = deadline
+        self.on_done = on_done
+        # Cupom RAW já renderizado: pode ser agrupado com os vizinhos da fila
+        self.payload = payload
+        self.sender = sender
+        # Falhou sem nenhum byte chegar à impressora (outra do pool pode imprimir)
+        self.undelivered = False
+        self.enqueued_at = time.monotonic()
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def _finish(self, result=None, error=None):
+        self._result = result
+        self._error = error
+        self._done.set()
+        if self.on_done is not None:
+            try:
+                self.on_done(self)
+            except Exception as e:
+                print(f"[WARN] Callback do job da impressora {self.key} falhou: {e}")
+
+    @property
+    def error(self):
+        return self._error
+
+    @property
+    def result(self):
+        return self._result
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Job ainda na fila da impressora {self.key}")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class _PrinterLane:
+    """Fila com prioridade + um worker para uma impressora (chave _printer_key)."""
+
+    def __init__(self, key, maxsize):
+        self.key = key
+        self.maxsize = maxsize
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._worker = None
+        self.current = None
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self.coalesced_batches = 0
+        self.coalesced_jobs = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._service_total = 0.0
+        self._service_max = 0.0
+        self._last_wait = 0.0
+        self._last_service = 0.0
+
+    def put(self, ticket, block_timeout):
+        with self._cond:
+            end = time.monotonic() + max(0.0, block_timeout)
+            while len(self._heap) >= self.maxsize:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    self.rejected += 1
+                    raise PrintQueueFull(
+                        f"Fila da impressora {self.key} cheia ({self.maxsize} jobs)"
+                    )
+                self._cond.wait(remaining)
+            self._seq += 1
+            heapq.heappush(self._heap, (ticket.priority, self._seq, ticket))
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, len(self._heap))
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run,
+                    name=f"printer_lane_{'_'.join(str(p) for p in self.key)}",
+                    daemon=True,
+                )
+                self._worker.start()
+            self._cond.notify_all()
+
+    def _take(self):
+        with self._cond:
+            while not self._heap:
+                if not self._cond.wait(PRINT_WORKER_IDLE_SECONDS) and not self._heap:
+                    self._worker = None
+                    return None
+            _, _, ticket = heapq.heappop(self._heap)
+            self.current = ticket
+            self._cond.notify_all()
+            return ticket
+
+    def _expired(self, ticket) -> bool:
+        waited = time.monotonic() - ticket.enqueued_at
+        if ticket.deadline is None or time.monotonic() <= ticket.deadline:
+            return False
+        with self._cond:
+            self.expired += 1
+        ticket._finish(error=PrintDeadlineExpired(
+            f"Job expirou após {waited:.1f}s na fila da impressora {self.key}"
+        ))
+        return True
 
-def _printer_semaphore(key):
-    with _print_sem_lock:
-        sem = _print_sems.get(key)
-        if sem is None:
-            sem = threading.Semaphore(1)
-            _print_sems[key] = sem
-        return sem
+    def _record(self, tickets, started, failures):
+        service = time.monotonic() - started
+        with self._cond:
+            self.current = None
+            for ticket, failed in zip(tickets, failures):
+                waited = started - ticket.enqueued_at
+                if failed:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+                self._last_wait = waited
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            self._last_service = service
+            self._service_total += service * len(tickets)
+            self._service_max = max(self._service_max, service)
+
+    def _execute(self, ticket):
+        if self._expired(ticket):
+            return
+        started = time.monotonic()
+        result, error = None, None
+        try:
+            result = ticket.fn()
+        except BaseException as e:
+            error = e
+        self._record([ticket], started, [error is not None])
+        ticket._finish(result, error)
+
+    def _collect(self, first, window):
+        """
+        Junta cupons já renderizados da fila durante a janela. Job comum na frente
+        da fila encerra o lote: ele só roda depois que o lote sair (ordem FIFO).
+        """
+        batch = [first]
+        size = len(first.payload)
+        end = time.monotonic() + window
+        while len(batch) < COALESCE_MAX_JOBS and size < COALESCE_MAX_BYTES:
+            with self._cond:
+                if not self._heap:
+                    remaining = end - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                    continue
+                if self._heap[0][2].payload is None:
+                    break
+                _, _, ticket = heapq.heappop(self._heap)
+                self._cond.notify_all()
+            if not self._expired(ticket):
+                batch.append(ticket)
+                size += len(ticket.payload)
+        return batch
+
+    def _run(self):
+        while True:
+            ticket = self._take()
+            if ticket is None:
+                return
+            window = coalesce_window_seconds() if ticket.payload is not None else 0
+            if window <= 0:
+                self._execute(ticket)
+                continue
+            if self._expired(ticket):
+                continue
+            batch = self._collect(ticket, window)
+            started = time.monotonic()
+            results, error = [None] * len(batch), None
+            undelivered = [False] * len(batch)
+            try:
+                # Mesmo socket, um envio por cupom: sucesso/falha contados por cupom
+                results = ticket.sender([t.payload for t in batch], undelivered=undelivered)
+            except BaseException as e:
+                error = e
+            for t, flag in zip(batch, undelivered):
+                t.undelivered = flag
+            self._record(batch, started, [error is not None or not ok for ok in results])
+            if len(batch) > 1:
+                with self._cond:
+                    self.coalesced_batches += 1
+                    self.coalesced_jobs += len(batch)
+            for t, ok in zip(batch, results):
+                t._finish(ok, error)
+
+    def is_worker_thread(self) -> bool:
+        return self._worker is threading.current_thread()
+
+    def load(self) -> int:
+        """Cupons na fila + o que está imprimindo."""
+        with self._cond:
+            return len(self._heap) + (self.current is not None)
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            runs = max(1, self.completed + self.failed)
+            oldest = min((t.enqueued_at for _, _, t in self._heap), default=None)
+            return {
+                "key": list(self.key),
+                "depth": len(self._heap),
+                "max_depth": self.max_depth,
+                "busy": self.current is not None,
+                "worker_alive": self._worker is not None,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "expired": self.expired,
+                "rejected": self.rejected,
+                "coalesced_batches": self.coalesced_batches,
+                "coalesced_jobs": self.coalesced_jobs,
+                "oldest_wait_ms": int((now - oldest) * 1000) if oldest is not None else 0,
+                "last_wait_ms": int(self._last_wait * 1000),
+                "avg_wait_ms": int(self._wait_total / runs * 1000),
+                "max_wait_ms": int(self._wait_max * 1000),
+                "last_service_ms": int(self._last_service * 1000),
+                "avg_service_ms": int(self._service_total / runs * 1000),
+                "max_service_ms": int(self._service_max * 1000),
+            }
+
+
+class PrinterDispatcher:
+    """
+    Uma fila FIFO limitada + um worker por impressora.
+
+    Jobs de mesma prioridade saem na ordem de chegada; prioridade menor sai antes.
+    Fila cheia bloqueia o chamador até block_timeout (backpressure) e então
+    levanta PrintQueueFull. Job que passa do deadline antes de rodar é descartado
+    com PrintDeadlineExpired.
+    """
+
+    def __init__(self, maxsize=PRINT_QUEUE_MAX):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._lanes = {}
+
+    def _lane(self, key):
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = _PrinterLane(key, self.maxsize)
+                self._lanes[key] = lane
+            return lane
+
+    def submit(
+        self,
+        key,
+        fn,
+        *,
+        priority=PRIORITY_NORMAL,
+        deadline=None,
+        block_timeout=PRINT_QUEUE_PUT_TIMEOUT,
+        on_done=None,
+        payload=None,
+        sender=None,
+    ):
+        """
+        Enfileira fn() para a impressora key.
+        deadline: segundos a partir de agora; on_done(ticket) roda no worker ao terminar.
+        payload/sender: cupom RAW pronto; com coalescência ligada o worker envia
+        vários payloads seguidos numa chamada sender([bytes, ...], undelivered=[...])
+        -> [ok, ...].
+        """
+        ticket = PrintTicket(
+            key,
+            fn,
+            int(priority),
+            time.monotonic() + float(deadline) if deadline is not None else None,
+            on_done=on_done,
+            payload=payload,
+            sender=sender,
+        )
+        self._lane(key).put(ticket, block_timeout)
+        return ticket
+
+    def run(
+        self,
+        key,
+        fn,
+        *,
+        priority=PRIORITY_NORMAL,
+        deadline=None,
+        block_timeout=PRINT_QUEUE_PUT_TIMEOUT,
+        wait_timeout=None,
+    ):
+        """
+        Enfileira e espera (até wait_timeout; TimeoutError se passar). Dentro do
+        próprio worker da impressora roda direto.
+        """
+        lane = self._lane(key)
+        if lane.is_worker_thread():
+            return fn()
+        return self.submit(
+            key, fn, priority=priority, deadline=deadline, block_timeout=block_timeout
+        ).wait(wait_timeout)
+
+    def in_worker(self, key) -> bool:
+        return self._lane(key).is_worker_thread()
+
+    def load(self, key) -> int:
+        """Carga da impressora sem criar fila para ela (0 se nunca recebeu cupom)."""
+        with self._lock:
+            lane = self._lanes.get(key)
+        return lane.load() if lane is not None else 0
+
+    def stats(self):
+        with self._lock:
+            lanes = list(self._lanes.values())
+        return [lane.stats() for lane in lanes]
+
+
+_dispatcher = PrinterDispatcher()
+
+
+def print_dispatcher() -> PrinterDispatcher:
+    return _dispatcher
+
+
+def printer_key_for_config(cfg):
+    """Mesma chave usada pelo dispatcher/cancelamento para um item de get_printers()."""
+    cfg = cfg or {}
+    return _printer_key(
+        cfg.get("connection_type"),
+        cfg.get("printer_ip"),
+        cfg.get("printer_port"),
+        cfg.get("printer_name_local"),
+    )
+
+
+def print_dispatcher_stats():
+    return _dispatcher.stats()
 
 
 def _is_draining_key(key) -> bool:
@@ -241,31 +818,6 @@ def is_print_draining_for_config(cfg) -> bool:
     return _is_draining_key(svc._printer_key())
 
 
-def _wrap_text_by_words(text: str, max_width: int) -> list:
-    """Quebra texto por palavras para não cortar no meio; retorna lista de linhas."""
-    if not text or max_width <= 0:
-        return [text] if text else []
-    text = text.strip()
-    words = text.split()
-    if not words:
-        return []
-    lines = []
-    current = []
-    current_len = 0
-    for w in words:
-        need = len(w) + (1 if current else 0)
-        if current and current_len + need > max_width:
-            lines.append(" ".join(current))
-            current = [w]
-            current_len = len(w)
-        else:
-            current.append(w)
-            current_len = current_len + need if current_len else len(w)
-    if current:
-        lines.append(" ".join(current))
-    return lines
-
-
 def _escpos_qr_bytes(url: str, module_size=None) -> bytes:
     """Gera bytes ESC/POS para imprimir QR code (URL para entregador), tamanho legível."""
     if not url or len(url) > 400:
@@ -288,6 +840,88 @@ def _escpos_qr_bytes(url: str, module_size=None) -> bytes:
         return b""
 
 
+# Cache LRU de payloads ESC/POS prontos (corpo, QR, banner, corte): retry, reimpressão
+# e o mesmo subconjunto indo para várias impressoras reaproveitam os bytes.
+PAYLOAD_CACHE_MAX_ENTRIES = 256
+PAYLOAD_CACHE_MAX_BYTES = 8 * 1024 * 1024
+
+
+def _receipt_digest(receipt_data, layout):
+    """
+    Hash estável de (cupom, layout). A ordem das chaves entra no hash de propósito:
+    os grupos saem impressos nessa ordem. None = cupom não serializável (sem cache).
+    """
+    try:
+        blob = json.dumps(
+            [layout, receipt_data], ensure_ascii=False, separators=(",", ":"), default=repr
+        )
+    except (TypeError, ValueError):
+        return None
+    return hashlib.blake2b(blob.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+class _PayloadCache:
+    """LRU limitado em número de cupons e em bytes."""
+
+    def __init__(self, max_entries=PAYLOAD_CACHE_MAX_ENTRIES, max_bytes=PAYLOAD_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # digest -> payload
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            payload = self._items.get(key)
+            if payload is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def put(self, key, payload: bytes):
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[key] = payload
+            self._bytes += len(payload)
+            while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+_payload_cache = _PayloadCache()
+
+
+def payload_cache_stats():
+    return _payload_cache.stats()
+
+
 class PrinterService:
     """Serviço para impressão em impressoras de rede ou locais (Windows)"""
     
@@ -313,68 +947,156 @@ class PrinterService:
         self.printer_name_local = printer_name_local
         self.timeout = max(1, int(timeout or 10))
         self.max_retries = max(0, int(max_retries if max_retries is not None else 2))
+        # Último envio falhou sem nada chegar à impressora (failover do pool é seguro)
+        self.undelivered = False
     
     def print_receipt(self, receipt_data):
         """
         Imprime o recibo do pedido.
         Para pedidos delivery, inclui QR/URL para o entregador adicionar à rota.
         """
+        self.undelivered = False
         if _is_draining_key(self._printer_key()):
             print("[INFO] Fila marcada como impressa — não envia cupom")
             return True
         key = self._printer_key()
-        sem = _printer_semaphore(key)
-        if not sem.acquire(timeout=45):
-            print(f"[WARN] Timeout aguardando fila da impressora {key}")
-            return False
+        # Vez na fila até PRINT_TURN_TIMEOUT; depois disso só o tempo do envio
+        wait_timeout = (
+            PRINT_TURN_TIMEOUT
+            + self.timeout * (self.max_retries + 1)
+            + PRINT_SEND_GRACE_SECONDS
+        )
         try:
-            scale = _resolve_font_scale(receipt_data)
-            is_pickup = _resolve_is_pickup(receipt_data)
-            receipt_for_text = dict(receipt_data)
-            receipt_for_text["is_pickup"] = is_pickup
-            receipt_text = self._generate_receipt_text(receipt_for_text)
-            qr_bytes = b""
-            if not is_pickup and receipt_data.get("delivery_scan_url"):
-                qr_bytes = _escpos_qr_bytes(
-                    receipt_data["delivery_scan_url"],
-                    receipt_data.get("qr_module_size"),
+            if self.can_coalesce() and not _dispatcher.in_worker(key):
+                payload = self.render_raw_payload(receipt_data)
+                ticket = _dispatcher.submit(
+                    key,
+                    lambda: self._send_raw_payload(payload),
+                    deadline=PRINT_TURN_TIMEOUT,
+                    payload=payload,
+                    sender=self._send_raw_payloads,
                 )
-            pickup_bytes = b""
-            if is_pickup:
-                _, encoding = self._get_esc_pos_encoding()
-                pickup_bytes = _escpos_pickup_banner(encoding)
+                ok = ticket.wait(wait_timeout)
+                # Saiu num lote: o resultado do envio veio no ticket
+                self.undelivered = self.undelivered or ticket.undelivered
+                return ok
+            return _dispatcher.run(
+                key,
+                lambda: self._print_now(receipt_data),
+                deadline=PRINT_TURN_TIMEOUT,
+                wait_timeout=wait_timeout,
+            )
+        except PrintQueueFull as e:
+            print(f"[WARN] {e}")
+            self.undelivered = True
+            return False
+        except PrintDeadlineExpired as e:
+            print(f"[WARN] Timeout aguardando fila da impressora {key}: {e}")
+            self.undelivered = True
+            return False
+        except TimeoutError as e:
+            # Ainda na fila/enviando: pode imprimir depois, não é "não entregue"
+            print(f"[WARN] {e}")
+            self.undelivered = False
+            return False
+        except Exception as e:
+            print(f"Erro ao imprimir: {str(e)}")
+            return False
 
-            if self.connection_type == "local":
-                return self._print_via_local(
-                    receipt_text,
-                    qr_bytes=qr_bytes,
-                    pickup_bytes=pickup_bytes,
-                    font_scale=scale,
-                    is_pickup=is_pickup,
-                )
-            if self.printer_type == "ipp":
-                return self._print_via_ipp(
-                    receipt_text,
-                    qr_bytes=qr_bytes,
-                    pickup_bytes=pickup_bytes,
-                    font_scale=scale,
-                    is_pickup=is_pickup,
-                )
-            return self._print_via_raw(
-                receipt_text,
+    def can_coalesce(self) -> bool:
+        """Só RAW de rede agrupa cupons (payload ESC/POS concatenável)."""
+        return (
+            self.connection_type == "network"
+            and self.printer_type != "ipp"
+            and coalesce_window_seconds() > 0
+        )
+
+    def submit_receipt(self, receipt_data, on_done, *, deadline=None):
+        """
+        Renderiza e enfileira o cupom sem esperar o envio; on_done(sucesso) roda no
+        worker da impressora. Com coalescência ligada, cupons enfileirados juntos
+        saem numa escrita só. Seguro de chamar de dentro do próprio worker.
+        """
+        key = self._printer_key()
+        if _is_draining_key(key):
+            print("[INFO] Fila marcada como impressa — não envia cupom")
+            on_done(True)
+            return
+        try:
+            payload = self.render_raw_payload(receipt_data)
+            _dispatcher.submit(
+                key,
+                lambda: self._send_raw_payload(payload),
+                deadline=deadline,
+                # No próprio worker esperar vaga travaria a fila
+                block_timeout=0 if _dispatcher.in_worker(key) else PRINT_QUEUE_PUT_TIMEOUT,
+                on_done=lambda ticket: on_done(ticket.error is None and bool(ticket.result)),
+                payload=payload,
+                sender=self._send_raw_payloads,
+            )
+        except Exception as e:
+            print(f"[WARN] Cupom não enfileirado em {key}: {e}")
+            on_done(False)
+
+    def _receipt_parts(self, receipt_data):
+        """(corpo em bytes, qr, banner retirada, escala, é retirada) do cupom."""
+        scale = _resolve_font_scale(receipt_data)
+        is_pickup = _resolve_is_pickup(receipt_data)
+        receipt_for_text = dict(receipt_data)
+        receipt_for_text["is_pickup"] = is_pickup
+        receipt_text = self._render_receipt_bytes(receipt_for_text, scale)
+        qr_bytes = b""
+        if not is_pickup and receipt_data.get("delivery_scan_url"):
+            qr_bytes = _escpos_qr_bytes(
+                receipt_data["delivery_scan_url"],
+                receipt_data.get("qr_module_size"),
+            )
+        pickup_bytes = b""
+        if is_pickup:
+            _, encoding = self._get_esc_pos_encoding()
+            pickup_bytes = _escpos_pickup_banner(encoding)
+        return receipt_text, qr_bytes, pickup_bytes, scale, is_pickup
+
+    def render_raw_payload(self, receipt_data) -> bytes:
+        """Buffer ESC/POS completo (init, corpo, corte) de um cupom; vem do cache se repetido."""
+        key = _receipt_digest(receipt_data, (self.paper_width, self.printer_encoding))
+        payload = _payload_cache.get(key) if key is not None else None
+        if payload is None:
+            text, qr_bytes, pickup_bytes, scale, is_pickup = self._receipt_parts(receipt_data)
+            payload = self._compose_escpos_payload(
+                text,
                 qr_bytes=qr_bytes,
                 pickup_bytes=pickup_bytes,
                 font_scale=scale,
                 is_pickup=is_pickup,
             )
+            if key is not None:
+                _payload_cache.put(key, payload)
+        return payload
+
+    def _print_now(self, receipt_data):
+        """Envia o cupom já com a vez da impressora (roda no worker do dispatcher)."""
+        try:
+            payload = self.render_raw_payload(receipt_data)
+            if self.connection_type == "local":
+                return self._send_local_payload(payload)
+            if self.printer_type == "ipp":
+                return self._send_ipp_payload(payload)
+            return self._send_raw_payload(payload)
         except Exception as e:
             print(f"Erro ao imprimir: {str(e)}")
             return False
-        finally:
-            sem.release()
     
+    def _render_receipt_bytes(self, receipt, scale) -> bytes:
+        """Corpo do cupom já codificado, pelo layout compilado (receipt_layout)."""
+        _, encoding = self._get_esc_pos_encoding()
+        return compiled_layout(self.paper_width, scale, encoding).render(receipt)
+
     def _generate_receipt_text(self, receipt):
-        """Gera o texto formatado do recibo"""
+        """
+        Gera o texto formatado do recibo (versão em str). A impressão usa o layout
+        compilado; este fica como referência e o benchmark compara os bytes.
+        """
         scale = _resolve_font_scale(receipt)
         W = _layout_width_for_font_scale(self.paper_width, scale)
         lines = []
@@ -534,7 +1256,8 @@ class PrinterService:
     ) -> bytes:
         """Monta buffer ESC/POS: corpo com escala do form; banner RETIRADA separado no fim."""
         esc_encoding, encoding = self._get_esc_pos_encoding()
-        text_bytes = self._encode_text_with_fallback(text)
+        # Corpo pode vir pronto do layout compilado
+        text_bytes = text if isinstance(text, (bytes, bytearray)) else self._encode_text_with_fallback(text)
         esc_pos_init = b"\x1B\x40"
         esc_pos_cut = b"\x1D\x56\x00"
         feed = b"\n" * (14 if is_pickup else 8)
@@ -582,7 +1305,35 @@ class PrinterService:
 
     def _print_via_raw(self, text, qr_bytes=b"", pickup_bytes=b"", font_scale=1, is_pickup=False):
         """Imprime via socket RAW (porta 9100). qr_bytes: opcional, QR ESC/POS."""
-        epoch = _generation(self._printer_key())
+        return self._send_raw_payload(
+            self._compose_escpos_payload(
+                text,
+                qr_bytes=qr_bytes,
+                pickup_bytes=pickup_bytes,
+                font_scale=font_scale,
+                is_pickup=is_pickup,
+            )
+        )
+
+    def _send_raw_payload(self, full_command: bytes):
+        """Envia bytes ESC/POS prontos (um cupom) pelo pool RAW."""
+        undelivered = [False]
+        ok = self._send_raw_payloads([full_command], undelivered=undelivered)[0]
+        self.undelivered = undelivered[0]
+        return ok
+
+    def _send_raw_payloads(self, payloads, undelivered=None):
+        """
+        Envia cupons ESC/POS prontos, um após o outro, no mesmo socket do pool RAW;
+        devolve o resultado de cada um. Retry e reconexão retomam só os cupons que
+        ainda não saíram; cupom que saiu pela metade conta como falha e encerra o
+        envio (reenviar imprimiria duas vezes). undelivered (lista) recebe, por
+        cupom, se falhou sem nenhum byte sair (seguro imprimir em outra impressora).
+        """
+        key = self._printer_key()
+        epoch = _generation(key)
+        results = [False] * len(payloads)
+        pending = [0]  # próximo cupom a enviar
 
         @retry_with_backoff(RetryConfig(
             max_retries=self.max_retries,
@@ -591,111 +1342,122 @@ class PrinterService:
             retryable_exceptions=(socket.timeout, socket.error, ConnectionError)
         ))
         def _send_to_printer():
-            if _generation(self._printer_key()) != epoch:
+            if _generation(key) != epoch:
                 raise _QueueCancelled()
-            full_command = self._compose_escpos_payload(
-                text,
-                qr_bytes=qr_bytes,
-                pickup_bytes=pickup_bytes,
-                font_scale=font_scale,
-                is_pickup=is_pickup,
-            )
-            
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-            sock.settimeout(self.timeout)
-            _register_sock(self._printer_key(), sock)
-            try:
-                sock.connect((self.printer_ip, int(self.printer_port)))
-                if _generation(self._printer_key()) != epoch:
-                    raise _QueueCancelled()
-                sock.sendall(full_command)
-            finally:
-                _unregister_sock(sock)
+            port = int(self.printer_port)
+            for attempt in range(2):
+                sock, reused = _raw_pool.acquire(key, self.printer_ip, port, self.timeout)
+                _register_sock(key, sock)
+                broken = True
+                sent_before = pending[0]
                 try:
-                    sock.close()
-                except Exception:
-                    pass
-            
+                    while pending[0] < len(payloads):
+                        if _generation(key) != epoch:
+                            raise _QueueCancelled()
+                        sent = [0]
+                        try:
+                            _send_counted(sock, payloads[pending[0]], sent)
+                        except (socket.timeout, socket.error, ConnectionError) as e:
+                            if sent[0]:
+                                raise _PartialWrite(str(e)) from e
+                            raise
+                        results[pending[0]] = True
+                        pending[0] += 1
+                    broken = False
+                    break
+                except (socket.timeout, socket.error, ConnectionError):
+                    # Conexão reaproveitada que morreu antes do primeiro byte: reconecta
+                    # uma vez sem contar retry
+                    if not reused or attempt or pending[0] != sent_before or _generation(key) != epoch:
+                        raise
+                finally:
+                    _unregister_sock(sock)
+                    _raw_pool.release(key, sock, broken=broken or _generation(key) != epoch)
+
             print(f"Pedido impresso com sucesso na impressora {self.printer_ip}:{self.printer_port}")
             return True
-        
+
         try:
-            return _send_to_printer()
+            _send_to_printer()
         except _QueueCancelled:
-            if _is_draining_key(self._printer_key()):
+            if _is_draining_key(key):
                 print(f"[INFO] Fila marcada como impressa em {self.printer_ip}:{self.printer_port}")
-                return True
-            print(f"Impressão cancelada em {self.printer_ip}:{self.printer_port}")
-            return False
+                results[pending[0]:] = [True] * (len(payloads) - pending[0])
+            else:
+                # Cancelado de propósito: não vai para outra impressora
+                print(f"Impressão cancelada em {self.printer_ip}:{self.printer_port}")
+            return results
+        except _PartialWrite as e:
+            print(f"Cupom interrompido no meio em {self.printer_ip}:{self.printer_port}: {e}")
+            if undelivered is not None:
+                # O cupom cortado pode ter saído no papel; os seguintes nem saíram
+                undelivered[pending[0] + 1:] = [True] * (len(payloads) - pending[0] - 1)
+            return results
         except socket.timeout:
             print(f"Timeout ao conectar na impressora {self.printer_ip}:{self.printer_port} após múltiplas tentativas")
-            return False
         except socket.error as e:
             print(f"Erro de conexão com impressora {self.printer_ip}:{self.printer_port}: {str(e)}")
-            return False
         except Exception as e:
             print(f"Erro ao imprimir via RAW: {str(e)}")
-            return False
+        if undelivered is not None:
+            # Falha antes do primeiro byte do cupom pendente: ele e os seguintes não saíram
+            undelivered[pending[0]:] = [True] * (len(payloads) - pending[0])
+        return results
     
     def _print_via_ipp(self, text, qr_bytes=b"", pickup_bytes=b"", font_scale=1, is_pickup=False):
         """Imprime via IPP com comandos ESC/POS no payload."""
-        try:
-            ipp_payload = self._create_ipp_request(
-                self._compose_escpos_payload(
-                    text,
-                    qr_bytes=qr_bytes,
-                    pickup_bytes=pickup_bytes,
-                    font_scale=font_scale,
-                    is_pickup=is_pickup,
-                )
+        return self._send_ipp_payload(
+            self._compose_escpos_payload(
+                text,
+                qr_bytes=qr_bytes,
+                pickup_bytes=pickup_bytes,
+                font_scale=font_scale,
+                is_pickup=is_pickup,
             )
-            conn = http.client.HTTPConnection(self.printer_ip, self.printer_port, timeout=5)
-            headers = {"Content-Type": "application/ipp"}
-            headers["Content-Length"] = str(len(ipp_payload))
-            conn.request("POST", "/ipp/print", ipp_payload, headers)
-            response = conn.getresponse()
-            conn.close()
-            
-            if response.status == 200:
-                print(f"Pedido impresso com sucesso via IPP na impressora {self.printer_ip}:{self.printer_port}")
-                return True
-            else:
-                print(f"Erro ao imprimir via IPP: Status {response.status}")
-                return False
-                
+        )
+
+    def _send_ipp_payload(self, escpos_payload: bytes):
+        """Envia bytes ESC/POS prontos num Print-Job IPP e acompanha o job-state."""
+        try:
+            client = ipp_client_for(self.printer_ip, _as_int(self.printer_port, 631), timeout=self.timeout)
+            job_id = client.print_job(escpos_payload)
         except Exception as e:
             print(f"Erro ao imprimir via IPP: {str(e)}")
+            # Recusa/conexão falhou: não imprimiu. Sem resposta após enviar: talvez sim
+            self.undelivered = not isinstance(e, IppDeliveryUnknown)
             return False
-    
-    def _create_ipp_request(self, data):
-        """Cria requisição IPP básica"""
-        # Versão IPP (2.0)
-        ipp_request = b'\x02\x00'
-        # Operação Print-Job (0x0002)
-        ipp_request += b'\x00\x02'
-        # Request ID
-        ipp_request += b'\x00\x00\x00\x01'
-        # Attributes
-        ipp_request += b'\x01'  # Operation attributes tag
-        ipp_request += b'\x47'  # charset
-        ipp_request += b'\x00\x12attributes-charset'
-        ipp_request += b'\x00\x05utf-8'
-        ipp_request += b'\x48'  # naturalLanguage
-        ipp_request += b'\x00\x1battributes-natural-language'
-        ipp_request += b'\x00\x02pt'
-        ipp_request += b'\x45'  # uri
-        ipp_request += b'\x00\x0bprinter-uri'
-        ipp_request += b'\x00\x1f'
-        ipp_request += f'ipp://{self.printer_ip}/ipp/print'.encode('utf-8')
-        ipp_request += b'\x03'  # End of attributes
-        # Data
-        ipp_request += data
-        
-        return ipp_request
+        try:
+            state = client.wait_for_job(job_id, IPP_JOB_WAIT_SECONDS) if job_id else None
+        except Exception as e:
+            # Print-Job aceito: a impressora já tem o cupom. Falha só na consulta do
+            # job-state não pode virar erro (o failover do pool reimprimiria)
+            print(f"[WARN] Job IPP {job_id} aceito; falha ao acompanhar job-state: {e}")
+            state = None
+        if state in (JOB_ABORTED, JOB_CANCELED):
+            print(f"Erro ao imprimir via IPP: job {job_id} {'abortado' if state == JOB_ABORTED else 'cancelado'}")
+            # Abortado pela impressora pode ir para outra; cancelado foi de propósito
+            self.undelivered = state == JOB_ABORTED
+            return False
+        if state is not None and state != JOB_COMPLETED:
+            # Aceito e ainda na fila da impressora: não reenviar
+            print(f"[INFO] Job IPP {job_id} aceito (job-state={state}) em {self.printer_ip}:{self.printer_port}")
+        print(f"Pedido impresso com sucesso via IPP na impressora {self.printer_ip}:{self.printer_port}")
+        return True
     
     def _print_via_local(self, text, qr_bytes=b"", pickup_bytes=b"", font_scale=1, is_pickup=False):
         """Imprime via impressora local do Windows usando win32print com comandos ESC/POS."""
+        return self._send_local_payload(
+            self._compose_escpos_payload(
+                text,
+                qr_bytes=qr_bytes,
+                pickup_bytes=pickup_bytes,
+                font_scale=font_scale,
+                is_pickup=is_pickup,
+            )
+        )
+
+    def _send_local_payload(self, full_content: bytes):
+        """Envia bytes ESC/POS prontos ao spooler do Windows (documento RAW)."""
         if not HAS_WIN32PRINT:
             print("Erro: win32print não disponível. Apenas Windows suporta impressoras locais.")
             return False
@@ -704,6 +1466,8 @@ class PrinterService:
             print("Erro: Nome da impressora local não especificado.")
             return False
         
+        started = [False]
+
         @retry_with_backoff(RetryConfig(
             max_retries=2,
             initial_delay=1.0,
@@ -711,20 +1475,13 @@ class PrinterService:
             retryable_exceptions=(Exception,)
         ))
         def _send_to_local_printer():
-            full_content = self._compose_escpos_payload(
-                text,
-                qr_bytes=qr_bytes,
-                pickup_bytes=pickup_bytes,
-                font_scale=font_scale,
-                is_pickup=is_pickup,
-            )
-            
             # Abrir a impressora local
             printer_handle = win32print.OpenPrinter(self.printer_name_local)
             try:
                 # Iniciar documento com tipo RAW para enviar comandos ESC/POS diretamente
                 job_info = ("Print Agent", None, "RAW")
                 job_id = win32print.StartDocPrinter(printer_handle, 1, job_info)
+                started[0] = True
                 try:
                     win32print.StartPagePrinter(printer_handle)
                     # Enviar dados RAW (incluindo comandos ESC/POS)
@@ -742,6 +1499,8 @@ class PrinterService:
             return _send_to_local_printer()
         except Exception as e:
             print(f"Erro ao imprimir na impressora local {self.printer_name_local}: {str(e)}")
+            # Nenhum documento chegou ao spooler
+            self.undelivered = not started[0]
             return False
 
     @classmethod
@@ -822,14 +1581,7 @@ class PrinterService:
         _bump_cancel(key)
         _close_active_socks(key)
         try:
-            conn = http.client.HTTPConnection(ip, _as_int(self.printer_port, 631), timeout=min(max(self.timeout, 1), 4))
-            payload = self._create_ipp_purge_jobs()
-            headers = {"Content-Type": "application/ipp", "Content-Length": str(len(payload))}
-            conn.request("POST", "/ipp/print", payload, headers)
-            response = conn.getresponse()
-            conn.close()
-            if response.status not in (200, 204):
-                raise RuntimeError(f"IPP {response.status}")
+            ipp_client_for(ip, _as_int(self.printer_port, 631), timeout=min(max(self.timeout, 1), 4)).purge_jobs()
             print(f"[INFO] Fila IPP cancelada em {ip}:{self.printer_port}")
             return True, f"Fila cancelada via IPP em {ip}:{self.printer_port}"
         except Exception as ipp_exc:
@@ -850,18 +1602,6 @@ class PrinterService:
                 pass
             return False, str(ipp_exc)
 
-    def _create_ipp_purge_jobs(self):
-        uri = f"ipp://{self.printer_ip}/ipp/print".encode("utf-8")
-        req = b"\x02\x00"  # IPP 2.0
-        req += b"\x00\x12"  # Purge-Jobs
-        req += b"\x00\x00\x00\x01"
-        req += b"\x01"  # operation attributes
-        req += b"\x47\x00\x12attributes-charset\x00\x05utf-8"
-        req += b"\x48\x00\x1battributes-natural-language\x00\x02pt"
-        req += b"\x45\x00\x0bprinter-uri" + len(uri).to_bytes(2, "big") + uri
-        req += b"\x03"
-        return req
-
     def _cancel_local_queue(self):
         if not HAS_WIN32PRINT:
             return False, "Impressora local só está disponível no Windows"
@@ -18,7 +18,9 @@ from uniplus_handler import (
     is_uniplus_enabled,
     psycopg2,
     RealDictCursor,
+    schema_columns,
 )
+from uniplus_session import PRIORITY_SYNC, uniplus_session
 
 logger = logging.getLogger("product_sync")
 
@@ -75,19 +77,14 @@ def _produto_cfg() -> Dict[str, str]:
     }
 
 
-def _connect_uniplus():
+def _uniplus_connection(label: str):
+    """Sessão UniPlus compartilhada, na prioridade mais baixa (sync espera os pedidos)."""
     if psycopg2 is None:
         raise RuntimeError("psycopg2 não instalado")
     dsn = (db.get_config("uniplus_connection_string") or "").strip()
     if not dsn:
         raise RuntimeError("uniplus_connection_string vazio")
-    conn = psycopg2.connect(dsn, connect_timeout=8)
-    try:
-        with conn.cursor() as cur:
-            cur.execute('SET search_path TO public, unico, "$user"')
-    except Exception:
-        pass
-    return conn
+    return uniplus_session().connection(dsn, priority=PRIORITY_SYNC, label=label)
 
 
 def make_fingerprint(nome: str, preco: float, dataalteracao: Any = None) -> str:
@@ -104,26 +101,12 @@ def list_uniplus_products(q: str = "", limit: int = 500) -> List[Dict[str, Any]]
     cfg = _produto_cfg()
     limit = max(1, min(int(limit or 500), 5000))
     q = (q or "").strip()
-    conn = _connect_uniplus()
-    try:
+    with _uniplus_connection("list_uniplus_products") as conn:
         factory = RealDictCursor if RealDictCursor else None
         with conn.cursor(cursor_factory=factory) as cur:
-            # Colunas em qualquer schema (não só current_schema)
-            cur.execute(
-                """
-                SELECT lower(column_name) AS col
-                FROM information_schema.columns
-                WHERE lower(table_name) = lower(%s)
-                  AND table_schema NOT IN ('pg_catalog', 'information_schema')
-                  AND lower(column_name) IN (
-                    'inativo', 'dataalteracao', 'nome', 'codigo', 'preco', 'id'
-                  )
-                """,
-                (cfg["table"],),
-            )
-            cols = {
-                str(r["col"] if isinstance(r, dict) else r[0]).lower()
-                for r in (cur.fetchall() or [])
+            # Colunas em qualquer schema (não só current_schema), do cache de schema
+            cols = schema_columns(cur, cfg["table"], any_schema=True) & {
+                "inativo", "dataalteracao", "nome", "codigo", "preco", "id"
             }
 
             # Fallback de colunas se o schema não reportou
@@ -240,8 +223,6 @@ def list_uniplus_products(q: str = "", limit: int = 500) -> List[Dict[str, Any]]
                     }
                 )
             return out
-    finally:
-        conn.close()
 
 
 def fetch_uniplus_product(codigo: str) -> Optional[Dict[str, Any]]:
@@ -249,20 +230,9 @@ def fetch_uniplus_product(codigo: str) -> Optional[Dict[str, Any]]:
     if not codigo:
         return None
     cfg = _produto_cfg()
-    conn = _connect_uniplus()
-    try:
+    with _uniplus_connection("fetch_uniplus_product") as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(
-                """
-                SELECT lower(column_name) AS col
-                FROM information_schema.columns
-                WHERE lower(table_name) = lower(%s)
-                  AND table_schema = current_schema()
-                  AND lower(column_name) = 'dataalteracao'
-                """,
-                (cfg["table"],),
-            )
-            has_da = bool(cur.fetchall())
+            has_da = "dataalteracao" in schema_columns(cur, cfg["table"])
             da_sel = ", dataalteracao" if has_da else ", NULL AS dataalteracao"
             cur.execute(
                 f"""
@@ -296,8 +266,6 @@ def fetch_uniplus_product(codigo: str) -> Optional[Dict[str, Any]]:
                 "dataalteracao": da,
                 "fingerprint": make_fingerprint(nome, preco, da),
             }
-    finally:
-        conn.close()
 
 
 def _compuchat_request(
@@ -1090,8 +1058,7 @@ def _poll_loop():
 
 def is_product_sync_poll_enabled() -> bool:
     """Poll contínuo fica OFF por padrão — Unico reclama de conexão concorrente no Postgres."""
-    raw = (db.get_config("uniplus_product_sync_poll") or "false").lower()
-    return raw in ("true", "1", "yes", "on") and is_uniplus_enabled(db)
+    return db.get_config_bool("uniplus_product_sync_poll") and is_uniplus_enabled(db)
 
 
 def start_product_sync_thread() -> None:
@@ -1104,9 +1071,10 @@ def start_product_sync_thread() -> None:
         )
         return
     with _lock:
+        # Zerar antes do is_alive: stop+start rápido mantém a thread viva
+        _should_stop = False
         if _sync_thread and _sync_thread.is_alive():
             return
-        _should_stop = False
         _sync_thread = threading.Thread(
             target=_poll_loop, name="uniplus-product-sync", daemon=True
         )
@@ -1125,3 +1093,17 @@ def refresh_product_sync_thread() -> None:
     else:
         stop_product_sync_thread()
         logger.info("product_sync poll parado")
+
+
+def _on_sync_config_change(changes: Dict[str, str]) -> None:
+    try:
+        refresh_product_sync_thread()
+    except Exception as e:
+        logger.warning("refresh product_sync após mudança de config: %s", e)
+
+
+# Liga/desliga o poller quando a config muda (sem reler o banco em loop)
+db.subscribe_config(
+    _on_sync_config_change,
+    keys=("uniplus_product_sync_poll", "uniplus_enabled", "uniplus_connection_string"),
+)
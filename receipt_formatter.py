@@ -25,35 +25,21 @@ def _resolve_size_label_from_db(item: dict) -> str:
         
     try:
         import db
+        index = db.pos_catalog_index()
         if product_id and option_id:
-            product = db.get_pos_product(int(product_id))
-            if product:
-                for variation in product.get("variations") or []:
-                    for opt in variation.get("options") or []:
-                        if int(opt.get("id") or 0) == int(option_id):
-                            label = str(opt.get("label") or "").strip()
-                            if label:
-                                return label
-                                
+            label = index.label_by_product_option.get((int(product_id), int(option_id)))
+            if label:
+                return label
+
         if id_uniplus:
-            id_uniplus_str = str(id_uniplus).strip()
-            for p in db.list_pos_products():
-                for variation in p.get("variations") or []:
-                    for opt in variation.get("options") or []:
-                        if str(opt.get("idUniplus") or "").strip() == id_uniplus_str:
-                            label = str(opt.get("label") or "").strip()
-                            if label:
-                                return label
-                                
+            label = index.label_by_option_uniplus.get(str(id_uniplus).strip())
+            if label:
+                return label
+
         if option_id:
-            option_id_val = int(option_id)
-            for p in db.list_pos_products():
-                for variation in p.get("variations") or []:
-                    for opt in variation.get("options") or []:
-                        if int(opt.get("id") or 0) == option_id_val:
-                            label = str(opt.get("label") or "").strip()
-                            if label:
-                                return label
+            label = index.label_by_option_id.get(int(option_id))
+            if label:
+                return label
     except Exception as e:
         print(f"[ERROR] Erro ao buscar tamanho no banco de dados: {e}")
         
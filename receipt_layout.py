@@ -0,0 +1,221 @@
+"""Layout compilado do cupom: um por (largura útil, encoding), devolve o corpo em bytes.
+
+Saída byte a byte igual a PrinterService._generate_receipt_text + _encode_text_with_fallback
+(inclusive a transliteração da code page); separadores,
+blocos fixos e a tabela do codec são montados uma vez por layout.
+"""
+from __future__ import annotations
+
+import codecs
+import importlib
+import threading
+from typing import Any, Dict, List
+
+from error_recovery import EncodingFallback
+
+# Nomes de codec usados por PrinterService._get_esc_pos_encoding — todos estendem ASCII
+_ASCII_COMPATIBLE = {"cp850", "cp860", "cp1252", "utf-8"}
+
+
+def _layout_width_for_font_scale(paper_width: int, scale: int) -> int:
+    w = min(max(int(paper_width or 32), 24), 48)
+    if int(scale or 1) >= 3:
+        return max(12, w // 2)
+    return w
+
+
+def _wrap_text_by_words(text: str, max_width: int) -> list:
+    """Quebra texto por palavras para não cortar no meio; retorna lista de linhas."""
+    if not text or max_width <= 0:
+        return [text] if text else []
+    text = text.strip()
+    words = text.split()
+    if not words:
+        return []
+    lines = []
+    current = []
+    current_len = 0
+    for w in words:
+        need = len(w) + (1 if current else 0)
+        if current and current_len + need > max_width:
+            lines.append(" ".join(current))
+            current = [w]
+            current_len = len(w)
+        else:
+            current.append(w)
+            current_len = current_len + need if current_len else len(w)
+    if current:
+        lines.append(" ".join(current))
+    return lines
+
+
+def _fast_charmap(encoding: str):
+    """
+    cp850/cp860 do Python codificam por dict (lento); a tabela de decodificação do
+    mesmo módulo vira um EncodingMap em C com saída idêntica, inclusive nos error handlers.
+    """
+    try:
+        module = importlib.import_module("encodings." + codecs.lookup(encoding).name.replace("-", "_"))
+    except (ImportError, LookupError):
+        return None
+    if isinstance(getattr(module, "encoding_map", None), dict) and hasattr(module, "decoding_table"):
+        return codecs.charmap_build(module.decoding_table)
+    return None
+
+
+def _money(value: float) -> str:
+    return f"R$ {value:.2f}".replace(".", ",")
+
+
+class ReceiptLayout:
+    """
+    Template do cupom para uma largura útil e um encoding.
+
+    Separadores, blocos fixos e a tabela do codec ficam prontos no layout; o corpo é
+    montado numa passada e codificado uma vez só (codificar linha a linha mede pior).
+    """
+
+    def __init__(self, width: int, encoding: str):
+        W = width
+        self.width = W
+        self.encoding = encoding
+        self._ascii_fast = encoding in _ASCII_COMPATIBLE
+        self._charmap = _fast_charmap(encoding)
+        self._errors = EncodingFallback.errors_for(encoding)
+        self.name_width = max(W - 14, 12)
+        self.header_rule = "=" * W + "\n"
+        self.client_end = "\n" + "-" * W + "\n\n"
+        self.items_end = "-" * W + "\n\n"
+        self.qr_block = (
+            "-" * W + "\n QR ENTREGADOR\n Escaneie o QR abaixo\n para add a rota\n\n\n"
+            + "-" * W + "\n\n"
+        )
+        self.footer = "=" * W + "\n\nObrigado pela preferência!\n\n\n\n"
+
+    def encode(self, text: str) -> bytes:
+        # ASCII puro sai igual em cp850/cp860/cp1252/utf-8 — evita o codec charmap
+        if self._ascii_fast and text.isascii():
+            return text.encode("ascii")
+        if self._charmap is not None:
+            return codecs.charmap_encode(text, self._errors, self._charmap)[0]
+        return text.encode(self.encoding, errors=self._errors)
+
+    def _wrapped(self, text: str) -> str:
+        W = self.width
+        return "".join(line[:W] + "\n" for line in _wrap_text_by_words(text, W) or [text[:W]])
+
+    def render(self, receipt: Dict[str, Any]) -> bytes:
+        W = self.width
+        parts: List[str] = []
+        add = parts.append
+
+        is_mesa = bool(receipt.get("table_number"))
+        if not is_mesa:
+            add(f"{self.header_rule} {receipt['form_name'].upper()[:W-2]}\n{self.header_rule}")
+        if receipt.get("protocol"):
+            add(f"Pedido: {receipt['protocol'][:W-10]}\n")
+        add(f"Data: {receipt['date'][:W-6]}\n")
+        if receipt.get("table_number"):
+            add(f"Mesa: {receipt['table_number'][:W-8]}\n")
+        if receipt.get("garcom_name"):
+            add(f"Garcom: {receipt['garcom_name'][:W-10]}\n")
+        if receipt.get("table_number") or receipt.get("garcom_name"):
+            add("\n")
+
+        customer = receipt["customer"]
+        add(f"\nCLIENTE:\n {customer['name'][:W-2]}\n")
+        if customer["phone"]:
+            add(f" Tel: {customer['phone'][:W-6]}\n")
+        if customer["email"]:
+            add(f" {customer['email'][:W-2]}\n")
+        for key, value in (receipt.get("custom_info") or {}).items():
+            add(self._wrapped(f" {key}: {str(value).strip()}"))
+        add(self.client_end)
+
+        name_width = self.name_width
+        for grupo, items in receipt["items_by_group"].items():
+            add(f"* {grupo.upper()[:W-4]} *\n\n")
+            for item in items:
+                name = (item.get("name") or "Item").strip()
+                half_lines = item.get("half_lines") or []
+                if (item.get("type") == "halfAndHalf" or half_lines) and not name.upper().startswith("MEIO A MEIO"):
+                    name = "MEIO A MEIO"
+                qty = item.get("quantity", 1) or 1
+                addons = item.get("addons") or ()
+                addons_sum = sum(float(a.get("value", 0) or 0) for a in addons) if addons else 0
+                unit_full = float(item.get("value", 0) or 0)
+                total_str = f"R$ {round((unit_full - addons_sum) * qty, 2):.2f}".replace(".", ",")
+                right_part = f" {qty}x {total_str}"
+                if len(right_part) <= 14:
+                    right_part = right_part.rjust(14)
+                name_one_line = (name[: name_width - 2] + "..") if len(name) > name_width else name
+                add((name_one_line[:name_width].ljust(name_width) + right_part)[:W] + "\n")
+                for half_name in half_lines:
+                    add(self._wrapped(f"  {str(half_name).strip()}"))
+                for ci in item.get("combo_items") or ():
+                    ci_name = (ci.get("name") or "Item").strip()
+                    ci_qty = int(ci.get("quantity") or 1)
+                    ci_label = f"  > {ci_qty}x {ci_name}" if ci_qty > 1 else f"  > {ci_name}"
+                    ci_str = f" R$ {float(ci.get('value') or 0):.2f}".replace(".", ",")
+                    width = W - len(ci_str)
+                    add((ci_label[:width].ljust(width) + ci_str)[:W] + "\n")
+                for addon in addons:
+                    addon_label = "  + " + (addon.get("label") or "Adicional").strip()
+                    addon_str = f" R$ {float(addon.get('value', 0) or 0):.2f}".replace(".", ",")
+                    width = W - len(addon_str)
+                    add((addon_label[:width].ljust(width) + addon_str)[:W] + "\n")
+                obs = (item.get("observation") or "").strip()
+                if obs:
+                    obs_text = "  Obs: " + obs
+                    while obs_text:
+                        add(obs_text[:W] + "\n")
+                        obs_text = ("    " + obs_text[W:]) if len(obs_text) > W else ""
+                add("\n")
+            add("\n")
+        add(self.items_end)
+
+        self._render_totals(add, receipt)
+        add(self.footer)
+        return self.encode("".join(parts))
+
+    def _render_totals(self, add, receipt: Dict[str, Any]) -> None:
+        W = self.width
+        delivery_fee = float(receipt.get("delivery_fee") or 0)
+        if delivery_fee <= 0 and receipt.get("delivery_scan_url"):
+            sub = float(receipt.get("subtotal") or 0)
+            tot = float(receipt.get("total") or 0)
+            if tot > sub:
+                delivery_fee = round(tot - sub, 2)
+        if delivery_fee > 0 or receipt.get("delivery_scan_url"):
+            subtotal_val = receipt.get("subtotal")
+            if subtotal_val is None:
+                subtotal_val = (receipt.get("total") or 0) - delivery_fee
+            add(
+                f"SUBTOTAL:\n {_money(float(subtotal_val)):>{W-1}}\n"
+                f"TAXA ENTREGA:\n {_money(delivery_fee):>{W-1}}\n\n"
+            )
+        add(f"TOTAL:\n {_money(receipt['total']):>{W-1}}\n\n")
+        if receipt.get("delivery_scan_url"):
+            add(self.qr_block)
+
+
+_layouts: Dict[tuple, ReceiptLayout] = {}
+_layouts_lock = threading.Lock()
+
+
+def compiled_layout(paper_width: int, font_scale: int, encoding: str) -> ReceiptLayout:
+    """Layout compilado uma vez por (largura do papel, escala, encoding)."""
+    key = (_layout_width_for_font_scale(paper_width, font_scale), encoding)
+    layout = _layouts.get(key)
+    if layout is None:
+        with _layouts_lock:
+            layout = _layouts.get(key)
+            if layout is None:
+                layout = ReceiptLayout(key[0], encoding)
+                _layouts[key] = layout
+    return layout
+
+
+def render_receipt_bytes(receipt: Dict[str, Any], paper_width: int, font_scale: int, encoding: str) -> bytes:
+    return compiled_layout(paper_width, font_scale, encoding).render(receipt)
+
@@ -0,0 +1,170 @@
+"""Retenção do agent.db: apaga print_logs / pos_orders_queue antigos em lotes,
+arquiva opcionalmente em JSONL.gz diário e devolve o espaço com incremental vacuum.
+"""
+from __future__ import annotations
+
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import db
+
+RETENTION_INTERVAL_SEC = 6 * 3600
+# Primeira rodada longe do startup (agente conectando, sync de catálogo)
+RETENTION_FIRST_DELAY_SEC = 120
+DELETE_BATCH_SIZE = 500
+# Pausa entre lotes: libera o lock de escrita para agente/POS
+BATCH_PAUSE_SEC = 0.05
+VACUUM_PAGES_PER_STEP = 256
+ARCHIVE_DIR = "archive"
+
+# tabela -> (chave de dias, chave de máximo de linhas ou None)
+POLICIES = {
+    "print_logs": ("log_retention_days", "log_retention_max_rows"),
+    "pos_orders_queue": ("pos_orders_retention_days", None),
+}
+
+_thread: Optional[threading.Thread] = None
+_should_stop = False
+_wake = threading.Event()
+_run_lock = threading.Lock()
+
+
+def archive_dir() -> str:
+    base = os.path.dirname(os.path.abspath(db.DB_FILE))
+    path = os.path.join(base, ARCHIVE_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _archive_rows(table: str, rows: List[Dict[str, Any]]) -> None:
+    """Acrescenta linhas em <tabela>-AAAA-MM-DD.jsonl.gz (um membro gzip por lote)."""
+    by_day: Dict[str, List[Dict[str, Any]]] = {}
+    for row in rows:
+        day = str(row.get("created_at") or "")[:10] or "sem-data"
+        by_day.setdefault(day, []).append(row)
+    folder = archive_dir()
+    for day, day_rows in by_day.items():
+        path = os.path.join(folder, f"{table}-{day}.jsonl.gz")
+        with gzip.open(path, "at", encoding="utf-8") as fh:
+            for row in day_rows:
+                data = {k: v for k, v in row.items() if k != "_rowid"}
+                fh.write(json.dumps(data, ensure_ascii=False, default=str) + "\n")
+
+
+def _purge(table: str, limit_rows: int, older_than: Optional[str], archive: bool) -> int:
+    """Apaga até limit_rows linhas (ou todas as elegíveis se limit_rows < 0), lote a lote."""
+    deleted = 0
+    while not _should_stop and (limit_rows < 0 or deleted < limit_rows):
+        size = DELETE_BATCH_SIZE if limit_rows < 0 else min(DELETE_BATCH_SIZE, limit_rows - deleted)
+        rows = db.fetch_retention_batch(table, size, older_than=older_than)
+        if not rows:
+            break
+        if archive:
+            # Falha no arquivo interrompe antes de apagar — nada se perde
+            _archive_rows(table, rows)
+        deleted += db.delete_rows_by_rowid(table, [r["_rowid"] for r in rows])
+        if len(rows) < size:
+            break
+        time.sleep(BATCH_PAUSE_SEC)
+    return deleted
+
+
+def run_retention() -> Dict[str, Any]:
+    """Aplica as políticas uma vez e devolve o relatório (também salvo na config)."""
+    with _run_lock:
+        started = time.perf_counter()
+        bytes_before = db.db_file_bytes()
+        archive = db.get_config_bool("retention_archive")
+        report: Dict[str, Any] = {
+            "ran_at": datetime.now().isoformat(timespec="seconds"),
+            "deleted": {},
+            "archived": archive,
+        }
+        try:
+            for table, (days_key, max_rows_key) in POLICIES.items():
+                deleted = 0
+                days = db.get_config_int(days_key, 0)
+                if days > 0:
+                    cutoff = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+                    deleted += _purge(table, -1, cutoff, archive)
+                max_rows = db.get_config_int(max_rows_key, 0) if max_rows_key else 0
+                if max_rows > 0:
+                    excess = db.count_rows(table) - max_rows
+                    if excess > 0:
+                        deleted += _purge(table, excess, None, archive)
+                report["deleted"][table] = deleted
+
+            # Conversão (VACUUM completo) só no start: db.ensure_incremental_vacuum
+            pages = 0
+            report["compaction_pending"] = db.auto_vacuum_mode() != 2
+            while not _should_stop and not report["compaction_pending"]:
+                step = db.incremental_vacuum(VACUUM_PAGES_PER_STEP)
+                pages += step
+                if step < VACUUM_PAGES_PER_STEP:
+                    break
+                time.sleep(BATCH_PAUSE_SEC)
+            report["pages_freed"] = pages
+            db.checkpoint_wal()
+        except Exception as e:
+            report["error"] = str(e)
+            print(f"[ERROR] Retenção do banco falhou: {e}")
+
+        bytes_after = db.db_file_bytes()
+        previous = get_last_report()
+        report["db_bytes"] = bytes_after
+        report["bytes_reclaimed"] = max(0, bytes_before - bytes_after)
+        report["total_bytes_reclaimed"] = int(previous.get("total_bytes_reclaimed") or 0) + report["bytes_reclaimed"]
+        report["duration_ms"] = int((time.perf_counter() - started) * 1000)
+        try:
+            db.set_config("retention_last_report", json.dumps(report, ensure_ascii=False))
+        except Exception as e:
+            print(f"[WARN] Não foi possível salvar relatório de retenção: {e}")
+        total_deleted = sum(report["deleted"].values())
+        print(
+            f"[INFO] Retenção: {total_deleted} linha(s) removida(s), "
+            f"{report['bytes_reclaimed']} bytes recuperados"
+        )
+        return report
+
+
+def get_last_report() -> Dict[str, Any]:
+    raw = db.get_config("retention_last_report") or ""
+    try:
+        data = json.loads(raw) if raw else {}
+    except (json.JSONDecodeError, TypeError):
+        data = {}
+    return data if isinstance(data, dict) else {}
+
+
+def _loop() -> None:
+    delay = RETENTION_FIRST_DELAY_SEC
+    while not _should_stop:
+        _wake.wait(delay)
+        _wake.clear()
+        if _should_stop:
+            break
+        try:
+            run_retention()
+        except Exception as e:
+            print(f"[ERROR] Worker de retenção: {e}")
+        delay = RETENTION_INTERVAL_SEC
+
+
+def start_retention_thread() -> None:
+    global _thread, _should_stop
+    _should_stop = False
+    if _thread and _thread.is_alive():
+        return
+    _thread = threading.Thread(target=_loop, name="db-retention", daemon=True)
+    _thread.start()
+
+
+def stop_retention_thread() -> None:
+    global _should_stop
+    _should_stop = True
+    _wake.set()
@@ -79,6 +79,7 @@ def run_tray(run_flask_callable):
     # Importar agente após redirecionar para que prints vão para o log
     from agent import start_agent_thread, stop_agent
     from product_sync import start_product_sync_thread
+    from retention import start_retention_thread
 
     # Iniciar Flask em thread (callable passado para evitar re-importar app)
     flask_thread = threading.Thread(target=run_flask_callable, daemon=True)
@@ -87,6 +88,7 @@ def run_tray(run_flask_callable):
 
     start_agent_thread()
     start_product_sync_thread()
+    start_retention_thread()
 
     try:
         import pystray
@@ -113,6 +115,13 @@ def run_tray(run_flask_callable):
 
     def on_sair(icon, item):
         stop_agent()
+        # os._exit pula o atexit: gravar logs pendentes antes
+        try:
+            import db
+
+            db.stop_print_log_writer()
+        except Exception:
+            pass
         try:
             from notifications import clear_tray_icon
 
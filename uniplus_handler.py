@@ -3,6 +3,8 @@ from __future__ import annotations
 
 import logging
 import re
+import threading
+import time
 import uuid
 import unicodedata
 from datetime import datetime, timedelta, timezone
@@ -21,6 +23,14 @@ except ImportError:
     IntegrityError = Exception  # type: ignore
     RealDictCursor = None  # type: ignore
 
+import db
+from uniplus_session import (
+    PRIORITY_ORDER,
+    PRIORITY_READ,
+    PRIORITY_UPDATE,
+    uniplus_session,
+)
+
 _IDENT_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
 _NUMERO_RE = re.compile(r"(\d+)")
 
@@ -63,8 +73,16 @@ def parse_numeromesa(raw: Any) -> Optional[int]:
 
 CONNECT_TIMEOUT_SEC = 8
 STATEMENT_TIMEOUT_MS = 15000
+# Colunas do information_schema em cache por até isso (ver _SchemaCache)
+SCHEMA_CACHE_TTL_SEC = 3600.0
 # Fallback CONTAMESAITEM.idunidademedida quando o produto UniPlus não tem unidade
 DEFAULT_IDUNIDADEMEDIDA = 30
+# Produto resolvido (codigo -> id/idunidademedida): curto, cadastro muda durante o dia
+PRODUTO_CACHE_TTL_SEC = 120.0
+# Config "uniplus_mesas_cache_ms": idade máxima da ocupação das mesas (0 = sem cache)
+MESAS_CACHE_DEFAULT_MS = 3000
+# Linhas por INSERT multi-linha de CONTAMESAITEM (~60 colunas: bem abaixo de 65535 parâmetros)
+CONTAMESAITEM_BATCH_ROWS = 200
 
 
 class UniplusPermanentError(RuntimeError):
@@ -128,8 +146,9 @@ def list_open_contas(
     if not is_uniplus_enabled(db_module) or psycopg2 is None:
         return []
     cfg = _cfg(db_module)
-    conn = _connect(cfg["connection_string"])
-    try:
+    with uniplus_session().connection(
+        cfg["connection_string"], priority=PRIORITY_READ, label="list_open_contas"
+    ) as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             mesa_table = cfg["contamesa_table"]
             cols = _table_columns(cur, mesa_table)
@@ -171,8 +190,100 @@ def list_open_contas(
                     }
                 )
             return out
-    finally:
-        conn.close()
+
+
+class _OpenContasCache:
+    """
+    Ocupação das mesas (list_open_contas) compartilhada entre os tablets: dentro da
+    idade máxima todos leem a mesma foto; no miss só uma thread consulta o UniPlus
+    e as demais esperam o resultado dela (single-flight). Nossas próprias gravações
+    (pedido, nome do cliente) invalidam na hora.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._entries: Dict[Any, Tuple[float, float, List[Dict[str, Any]]]] = {}
+        self._inflight: Dict[Any, Dict[str, Any]] = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    def get(self, db_module, tipopedido: Optional[int], max_age: float) -> Tuple[List[Dict[str, Any]], float]:
+        """(contas, gerado_em epoch). Levanta o erro da consulta para quem esperava por ela."""
+        key = tipopedido
+        with self._cond:
+            while True:
+                entry = self._entries.get(key)
+                if entry is not None and time.monotonic() - entry[0] <= max_age:
+                    self.hits += 1
+                    return entry[2], entry[1]
+                flight = self._inflight.get(key)
+                if flight is None:
+                    break
+                self.coalesced += 1
+                while not flight["done"]:
+                    self._cond.wait()
+                if "error" in flight:
+                    raise flight["error"]
+                return flight["contas"], flight["generated_at"]
+            flight = {"done": False}
+            self._inflight[key] = flight
+            generation = self._generation
+            self.misses += 1
+        try:
+            started = time.monotonic()
+            contas = list_open_contas(db_module, tipopedido=tipopedido)
+            flight.update(contas=contas, generated_at=time.time())
+        except Exception as exc:
+            flight["error"] = exc
+            raise
+        finally:
+            with self._cond:
+                flight["done"] = True
+                self._inflight.pop(key, None)
+                # Invalidado durante a consulta: serve quem esperava, mas não guarda
+                if "error" not in flight and generation == self._generation:
+                    self._entries[key] = (started, flight["generated_at"], flight["contas"])
+                self._cond.notify_all()
+        return contas, flight["generated_at"]
+
+    def invalidate(self):
+        with self._cond:
+            self._generation += 1
+            self.invalidations += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "invalidations": self.invalidations,
+            }
+
+
+_open_contas_cache = _OpenContasCache()
+
+
+def list_open_contas_cached(
+    db_module, tipopedido: Optional[int] = None
+) -> Tuple[List[Dict[str, Any]], float]:
+    """list_open_contas via cache (idade máxima em uniplus_mesas_cache_ms) + gerado_em."""
+    max_age = db_module.get_config_int("uniplus_mesas_cache_ms", MESAS_CACHE_DEFAULT_MS) / 1000
+    if max_age <= 0:
+        return list_open_contas(db_module, tipopedido=tipopedido), time.time()
+    return _open_contas_cache.get(db_module, tipopedido, max_age)
+
+
+def invalidate_open_contas() -> None:
+    _open_contas_cache.invalidate()
+
+
+def open_contas_cache_stats() -> Dict[str, Any]:
+    return _open_contas_cache.stats()
 
 
 def get_open_mesa_conta(db_module, numeromesa: int) -> Dict[str, Any]:
@@ -187,8 +298,9 @@ def get_open_mesa_conta(db_module, numeromesa: int) -> Dict[str, Any]:
     if not is_uniplus_enabled(db_module) or psycopg2 is None:
         return empty
     cfg = _cfg(db_module)
-    conn = _connect(cfg["connection_string"])
-    try:
+    with uniplus_session().connection(
+        cfg["connection_string"], priority=PRIORITY_READ, label="get_open_mesa_conta"
+    ) as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             mesa_table = cfg["contamesa_table"]
             item_table = cfg["contamesaitem_table"]
@@ -278,8 +390,6 @@ def get_open_mesa_conta(db_module, numeromesa: int) -> Dict[str, Any]:
                 "valortotal": float(row.get("valortotal") or 0),
                 "itens": itens,
             }
-    finally:
-        conn.close()
 
 
 def update_open_mesa_cliente_name(
@@ -293,8 +403,9 @@ def update_open_mesa_cliente_name(
     if not customer_name or not is_uniplus_enabled(db_module) or psycopg2 is None:
         return False
     cfg = _cfg(db_module)
-    conn = _connect(cfg["connection_string"])
-    try:
+    with uniplus_session().connection(
+        cfg["connection_string"], priority=PRIORITY_UPDATE, label="update_open_mesa_cliente_name"
+    ) as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             mesa_table = cfg["contamesa_table"]
             cols = _table_columns(cur, mesa_table)
@@ -319,9 +430,10 @@ def update_open_mesa_cliente_name(
                 params,
             )
             conn.commit()
-            return cur.rowcount > 0
-    finally:
-        conn.close()
+            updated = cur.rowcount > 0
+    if updated:
+        invalidate_open_contas()
+    return updated
 
 
 def _utc_naive(dt: datetime) -> datetime:
@@ -379,8 +491,9 @@ def list_pedidos_dia(db_module, day=None) -> List[Dict[str, Any]]:
         return []
     alvo = day or _brasil_today()
     cfg = _cfg(db_module)
-    conn = _connect(cfg["connection_string"])
-    try:
+    with uniplus_session().connection(
+        cfg["connection_string"], priority=PRIORITY_READ, label="list_pedidos_dia"
+    ) as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             mesa_table = cfg["contamesa_table"]
             item_table = cfg["contamesaitem_table"]
@@ -473,16 +586,15 @@ def list_pedidos_dia(db_module, day=None) -> List[Dict[str, Any]]:
                     }
                 )
             return out
-    finally:
-        conn.close()
 
 
 def set_item_entregue(db_module, item_id: int, entregue: bool) -> bool:
     if not is_uniplus_enabled(db_module) or psycopg2 is None:
         return False
     cfg = _cfg(db_module)
-    conn = _connect(cfg["connection_string"])
-    try:
+    with uniplus_session().connection(
+        cfg["connection_string"], priority=PRIORITY_UPDATE, label="set_item_entregue"
+    ) as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             item_table = cfg["contamesaitem_table"]
             cols = _table_columns(cur, item_table)
@@ -495,8 +607,6 @@ def set_item_entregue(db_module, item_id: int, entregue: bool) -> bool:
             )
             conn.commit()
             return cur.rowcount > 0
-    finally:
-        conn.close()
 
 
 def is_uniplus_enabled(db_module) -> bool:
@@ -545,18 +655,22 @@ def validate_uniplus_connection(
 
 
 def _connect(dsn: str):
-    """Abre conexão curta. Sempre fechar no finally do caller — Unico não tolera sessão concorrente."""
+    """Abre a conexão da sessão única (uniplus_session) — Unico não tolera sessão concorrente."""
     conn = psycopg2.connect(dsn, connect_timeout=CONNECT_TIMEOUT_SEC)
+    # SET dentro de transação desfeita volta atrás: commit em cada um, senão o
+    # rollback do primeiro leitor (_release) apaga o timeout da sessão inteira
     with conn.cursor() as cur:
         cur.execute(f"SET statement_timeout = {int(STATEMENT_TIMEOUT_MS)}")
-        try:
-            cur.execute('SET search_path TO public, unico, "$user"')
-        except Exception:
-            pass
-        try:
-            cur.execute("SET application_name = 'compuchat_print_agent'")
-        except Exception:
-            pass
+        conn.commit()
+        for stmt in (
+            'SET search_path TO public, unico, "$user"',
+            "SET application_name = 'compuchat_print_agent'",
+        ):
+            try:
+                cur.execute(stmt)
+                conn.commit()
+            except Exception:
+                conn.rollback()
     return conn
 
 
@@ -572,20 +686,7 @@ def _normalize_nome(nome: str) -> str:
 
 def _produto_nome_column(cur, table: str) -> str:
     """Detecta coluna de nome no cadastro de produto."""
-    cur.execute(
-        """
-        SELECT lower(column_name) AS col
-        FROM information_schema.columns
-        WHERE lower(table_name) = lower(%s)
-          AND table_schema = current_schema()
-          AND lower(column_name) IN ('nome', 'descricao', 'produto', 'nomefantasia')
-        """,
-        (table,),
-    )
-    rows = cur.fetchall() or []
-    cols = set()
-    for row in rows:
-        cols.add(str(row["col"] if isinstance(row, dict) else row[0]).lower())
+    cols = _table_columns(cur, table)
     for preferred in ("nome", "descricao", "produto", "nomefantasia"):
         if preferred in cols:
             return preferred
@@ -593,99 +694,162 @@ def _produto_nome_column(cur, table: str) -> str:
 
 
 def _produto_has_column(cur, table: str, column: str) -> bool:
-    cur.execute(
-        """
-        SELECT 1
-        FROM information_schema.columns
-        WHERE lower(table_name) = lower(%s)
-          AND table_schema NOT IN ('pg_catalog', 'information_schema')
-          AND lower(column_name) = lower(%s)
-        LIMIT 1
-        """,
-        (table, column),
-    )
-    return bool(cur.fetchone())
+    return column.lower() in schema_columns(cur, table, any_schema=True)
 
 
-def _fetch_produto_unidademedida(cur, table: str, id_col: str, produto_id: int) -> int:
-    """Retorna idunidademedida do produto; fallback DEFAULT_IDUNIDADEMEDIDA (30)."""
-    if not _produto_has_column(cur, table, "idunidademedida"):
-        return DEFAULT_IDUNIDADEMEDIDA
-    cur.execute(
-        f"SELECT idunidademedida FROM {table} WHERE {id_col} = %s LIMIT 1",
-        (produto_id,),
-    )
-    row = cur.fetchone()
-    if not row:
-        return DEFAULT_IDUNIDADEMEDIDA
-    val = row["idunidademedida"] if isinstance(row, dict) else row[0]
-    if val is None:
-        return DEFAULT_IDUNIDADEMEDIDA
+def _row_int(value: Any, default: int) -> int:
     try:
-        return int(val)
+        return int(value) if value is not None else default
     except (TypeError, ValueError):
-        return DEFAULT_IDUNIDADEMEDIDA
+        return default
+
+
+class _ProdutoCache:
+    """
+    codigo visível -> (id, codigo, idunidademedida) por (DSN, tabela, colunas).
+    Só guarda produto encontrado: codigo novo no cadastro aparece no próximo pedido.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items: Dict[tuple, Tuple[float, Tuple[int, str, int]]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.queries = 0
+
+    def get_many(self, scope: tuple, codigos: List[str]) -> Dict[str, Tuple[int, str, int]]:
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for codigo in codigos:
+                entry = self._items.get(scope + (codigo,))
+                if entry is not None and now - entry[0] < PRODUTO_CACHE_TTL_SEC:
+                    found[codigo] = entry[1]
+            self.hits += len(found)
+            self.misses += len(codigos) - len(found)
+        return found
+
+    def put_many(self, scope: tuple, resolved: Dict[str, Tuple[int, str, int]]):
+        now = time.monotonic()
+        with self._lock:
+            self.queries += 1
+            for codigo, value in resolved.items():
+                self._items[scope + (codigo,)] = (now, value)
+
+    def invalidate(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "produtos": len(self._items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "queries": self.queries,
+            }
 
 
-def _resolve_produto_id(
-    cur, cfg: Dict[str, str], codigo: str, nome: str = ""
-) -> Tuple[int, str]:
+_produto_cache = _ProdutoCache()
+
+
+def produto_cache_stats() -> Dict[str, Any]:
+    return _produto_cache.stats()
+
+
+def _resolve_produtos(
+    cur, cfg: Dict[str, str], itens: List[Dict[str, Any]]
+) -> List[Tuple[int, str, int]]:
     """
-    Resolve id do produto UniPlus a partir do campo visível `codigo`.
+    Resolve (id, codigo, idunidademedida) de todos os itens pelo campo visível
+    `codigo`, numa consulta só (= ANY) para os códigos fora do cache.
 
-    Ordem:
-    1) Match exato em produto.codigo (campo visível ao usuário)
-    2) Se o valor bater no id interno, erro orientando a usar o codigo
+    Mesmos erros do fluxo item a item, na ordem dos itens:
+    - ERR_UNIPLUS_USE_CODIGO_NOT_ID se o valor bate no id interno
+    - ERR_UNIPLUS_PRODUCT_NOT_FOUND se não bate em nada
     """
     table = cfg["produto_table"]
     codigo_col = cfg["produto_codigo_column"]
     id_col = cfg["produto_id_column"]
-    codigo = str(codigo or "").strip()
-    nome = str(nome or "").strip()
+    scope = (getattr(cur.connection, "dsn", ""), table, codigo_col, id_col)
 
-    if codigo:
+    wanted = []
+    for item in itens:
+        codigo = str(item.get("codigoproduto") or "").strip()
+        nome = str(item.get("nomeproduto") or "").strip()
+        if not codigo and not nome:
+            raise UniplusPermanentError(
+                "ERR_UNIPLUS_PAYLOAD: Item sem codigoproduto/nomeproduto"
+            )
+        wanted.append((codigo, nome))
+
+    codigos = list(dict.fromkeys(c for c, _ in wanted if c))
+    resolved = _produto_cache.get_many(scope, codigos)
+    missing = [c for c in codigos if c not in resolved]
+    if missing:
+        un_expr = (
+            "idunidademedida"
+            if _produto_has_column(cur, table, "idunidademedida")
+            else "NULL"
+        )
         cur.execute(
-            f"SELECT {id_col} AS id, {codigo_col} AS codigo FROM {table} WHERE CAST({codigo_col} AS text) = %s LIMIT 1",
-            (codigo,),
+            f"""
+            SELECT {id_col} AS id, CAST({codigo_col} AS text) AS codigo,
+                   {un_expr} AS idunidademedida
+            FROM {table}
+            WHERE CAST({codigo_col} AS text) = ANY(%s)
+            """,
+            (missing,),
         )
-        row = cur.fetchone()
-        if row:
+        fetched: Dict[str, Tuple[int, str, int]] = {}
+        for row in cur.fetchall() or []:
+            rc = str(row["codigo"] if isinstance(row, dict) else row[1])
+            if rc in fetched:
+                continue
             rid = int(row["id"] if isinstance(row, dict) else row[0])
-            rc = str(row["codigo"] if isinstance(row, dict) else row[1]).strip()
-            return rid, rc
-
+            un = row["idunidademedida"] if isinstance(row, dict) else row[2]
+            fetched[rc] = (rid, rc.strip(), _row_int(un, DEFAULT_IDUNIDADEMEDIDA))
+        _produto_cache.put_many(scope, fetched)
+        resolved.update(fetched)
+
+    out = []
+    by_id = None
+    for codigo, nome in wanted:
+        if codigo in resolved:
+            out.append(resolved[codigo])
+            continue
         # Valor parece ser o id interno (ex.: 177) em vez do codigo visível (ex.: 1080)
         if codigo.isdigit():
-            cur.execute(
-                f"SELECT {id_col} AS id, {codigo_col} AS codigo FROM {table} WHERE {id_col} = %s LIMIT 1",
-                (int(codigo),),
-            )
-            by_id = cur.fetchone()
-            if by_id:
-                rid = int(by_id["id"] if isinstance(by_id, dict) else by_id[0])
-                rc = str(
-                    by_id["codigo"] if isinstance(by_id, dict) else by_id[1]
-                ).strip()
+            if by_id is None:
+                ids = [int(c) for c in codigos if c not in resolved and c.isdigit()]
+                cur.execute(
+                    f"SELECT {id_col} AS id, {codigo_col} AS codigo FROM {table} WHERE {id_col} = ANY(%s)",
+                    (ids,),
+                )
+                by_id = {
+                    int(row["id"] if isinstance(row, dict) else row[0]): str(
+                        row["codigo"] if isinstance(row, dict) else row[1]
+                    ).strip()
+                    for row in (cur.fetchall() or [])
+                }
+            if int(codigo) in by_id:
                 raise UniplusPermanentError(
                     "ERR_UNIPLUS_USE_CODIGO_NOT_ID: "
-                    f"informado id interno={rid}; use o codigo visível={rc or '-'} "
+                    f"informado id interno={int(codigo)}; use o codigo visível={by_id[int(codigo)] or '-'} "
                     "(campo codigo do cadastro UniPlus)"
                 )
-
-    raise UniplusPermanentError(
-        f"ERR_UNIPLUS_PRODUCT_NOT_FOUND: codigo={codigo or '-'} nome={nome or '-'} "
-        "(valide o campo codigo do UniPlus, não o id interno)"
-    )
+        raise UniplusPermanentError(
+            f"ERR_UNIPLUS_PRODUCT_NOT_FOUND: codigo={codigo or '-'} nome={nome or '-'} "
+            "(valide o campo codigo do UniPlus, não o id interno)"
+        )
+    return out
 
 
 def _blank_hash40() -> str:
     return " " * 40
 
 
-def _insert_contamesaitem(
-    cur,
-    item_table: str,
-    item_cols: Set[str],
+def _contamesaitem_row(
     *,
     conta_id: int,
     numeromesa: int,
@@ -703,9 +867,9 @@ def _insert_contamesaitem(
     now: datetime,
     idunidademedida: int,
     cnpjfilial: str,
-) -> None:
-    """INSERT item alinhado ao padrão nativo do UniPlus (defaults não-NULL)."""
-    row: Dict[str, Any] = {
+) -> Dict[str, Any]:
+    """Linha de CONTAMESAITEM alinhada ao padrão nativo do UniPlus (defaults não-NULL)."""
+    return {
         "idcontamesa": conta_id,
         "idproduto": idproduto,
         "quantidade": qty,
@@ -763,17 +927,73 @@ def _insert_contamesaitem(
         "cnpjfilial": (cnpjfilial or "")[:18],
     }
 
+
+def _contamesaitem_cols(item_table: str, item_cols: Set[str], row: Dict[str, Any]) -> List[str]:
     cols = [c for c in row.keys() if c in item_cols]
     if "idcontamesa" not in cols or "idproduto" not in cols:
         raise RuntimeError(
             f"ERR_UNIPLUS_SCHEMA: {item_table} sem idcontamesa/idproduto"
         )
-    values = [row[c] for c in cols]
+    return cols
+
+
+def _insert_contamesaitem(cur, item_table: str, item_cols: Set[str], row: Dict[str, Any]) -> Optional[int]:
+    """INSERT de um item (caminho antigo; fallback do lote)."""
+    cols = _contamesaitem_cols(item_table, item_cols, row)
+    returning = " RETURNING id" if "id" in item_cols else ""
     placeholders = ",".join(["%s"] * len(cols))
     cur.execute(
-        f"INSERT INTO {item_table} ({', '.join(cols)}) VALUES ({placeholders})",
-        tuple(values),
+        f"INSERT INTO {item_table} ({', '.join(cols)}) VALUES ({placeholders}){returning}",
+        tuple(row[c] for c in cols),
     )
+    if not returning:
+        return None
+    got = cur.fetchone()
+    return int(got["id"] if isinstance(got, dict) else got[0]) if got else None
+
+
+def _insert_contamesaitens(
+    cur, item_table: str, item_cols: Set[str], rows: List[Dict[str, Any]]
+) -> List[Optional[int]]:
+    """
+    Itens do pedido num INSERT multi-linha (até CONTAMESAITEM_BATCH_ROWS por comando),
+    devolvendo os ids na ordem das linhas. Se o lote falhar, volta ao savepoint e
+    insere item a item: o erro (hash duplicado, coluna) sai igual ao caminho antigo.
+    """
+    if not rows:
+        return []
+    cols = _contamesaitem_cols(item_table, item_cols, rows[0])
+    returning = " RETURNING id" if "id" in item_cols else ""
+    placeholders = "(" + ",".join(["%s"] * len(cols)) + ")"
+    cur.execute("SAVEPOINT uniplus_itens")
+    try:
+        ids: List[Optional[int]] = []
+        for start in range(0, len(rows), CONTAMESAITEM_BATCH_ROWS):
+            chunk = rows[start:start + CONTAMESAITEM_BATCH_ROWS]
+            cur.execute(
+                f"INSERT INTO {item_table} ({', '.join(cols)}) VALUES "
+                + ",".join([placeholders] * len(chunk))
+                + returning,
+                tuple(row[c] for row in chunk for c in cols),
+            )
+            if returning:
+                # Postgres devolve RETURNING na ordem do VALUES
+                ids.extend(
+                    int(got["id"] if isinstance(got, dict) else got[0])
+                    for got in (cur.fetchall() or [])
+                )
+            else:
+                ids.extend([None] * len(chunk))
+        cur.execute("RELEASE SAVEPOINT uniplus_itens")
+        return ids
+    except Exception as exc:
+        cur.execute("ROLLBACK TO SAVEPOINT uniplus_itens")
+        logger.warning(
+            "UniPlus: INSERT em lote de %s itens falhou (%s); inserindo item a item",
+            len(rows),
+            exc,
+        )
+    return [_insert_contamesaitem(cur, item_table, item_cols, row) for row in rows]
 
 
 def _summarize_payload(
@@ -1001,25 +1221,86 @@ def format_uniplus_log_message(result: Dict[str, Any]) -> str:
     )
 
 
-def _table_columns(cur, table: str) -> set:
+class _SchemaCache:
+    """
+    Colunas por (DSN, escopo, tabela). information_schema é lento no Postgres e o
+    schema do Unico só muda em atualização do sistema: consulta uma vez, reusa até
+    o TTL, erro de coluna/tabela inexistente ou mudança de config.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tables: Dict[tuple, Tuple[float, frozenset]] = {}
+        self.queries = 0
+        self.saved = 0
+        self.invalidations = 0
+
+    def columns(self, cur, table: str, any_schema: bool) -> frozenset:
+        key = (getattr(cur.connection, "dsn", ""), any_schema, table.lower())
+        now = time.monotonic()
+        with self._lock:
+            entry = self._tables.get(key)
+            if entry is not None and now - entry[0] < SCHEMA_CACHE_TTL_SEC:
+                self.saved += 1
+                return entry[1]
+        schema_filter = (
+            "table_schema NOT IN ('pg_catalog', 'information_schema')"
+            if any_schema
+            else "table_schema = current_schema()"
+        )
+        cur.execute(
+            f"""
+            SELECT lower(column_name) AS col
+            FROM information_schema.columns
+            WHERE lower(table_name) = lower(%s)
+              AND {schema_filter}
+            """,
+            (table,),
+        )
+        cols = frozenset(
+            str(row.get("col") or "").lower() if isinstance(row, dict) else str(row[0]).lower()
+            for row in (cur.fetchall() or [])
+        )
+        with self._lock:
+            self.queries += 1
+            self._tables[key] = (now, cols)
+        return cols
+
+    def invalidate(self):
+        with self._lock:
+            if self._tables:
+                self.invalidations += 1
+            self._tables.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "tables": len(self._tables),
+                "queries": self.queries,
+                "saved": self.saved,
+                "invalidations": self.invalidations,
+            }
+
+
+_schema_cache = _SchemaCache()
+
+
+def schema_columns(cur, table: str, *, any_schema: bool = False) -> frozenset:
+    """Colunas (lowercase) do schema atual, ou de qualquer schema de usuário."""
+    return _schema_cache.columns(cur, table, any_schema)
+
+
+def invalidate_schema_cache() -> None:
+    _schema_cache.invalidate()
+
+
+def schema_cache_stats() -> Dict[str, Any]:
+    return _schema_cache.stats()
+
+
+def _table_columns(cur, table: str) -> frozenset:
     """Colunas da tabela no schema atual (lowercase)."""
-    cur.execute(
-        """
-        SELECT lower(column_name) AS col
-        FROM information_schema.columns
-        WHERE lower(table_name) = lower(%s)
-          AND table_schema = current_schema()
-        """,
-        (table,),
-    )
-    rows = cur.fetchall() or []
-    cols = set()
-    for row in rows:
-        if isinstance(row, dict):
-            cols.add(str(row.get("col") or "").lower())
-        else:
-            cols.add(str(row[0]).lower())
-    return cols
+    return schema_columns(cur, table)
 
 
 def _is_undefined_column_error(exc: Exception) -> bool:
@@ -1028,6 +1309,28 @@ def _is_undefined_column_error(exc: Exception) -> bool:
     return pgcode == "42703" or "undefined column" in msg or "does not exist" in msg
 
 
+def _on_session_error(exc: BaseException) -> None:
+    # Coluna/tabela sumiu ou mudou: o cache de colunas não vale mais
+    if getattr(exc, "pgcode", None) in ("42703", "42P01"):
+        invalidate_schema_cache()
+
+
+uniplus_session().on_error(_on_session_error)
+db.subscribe_config(
+    lambda _changes: (
+        invalidate_schema_cache(),
+        _produto_cache.invalidate(),
+        invalidate_open_contas(),
+    ),
+    keys=(
+        "uniplus_connection_string",
+        "uniplus_produto_table",
+        "uniplus_contamesa_table",
+        "uniplus_contamesaitem_table",
+    ),
+)
+
+
 def _insert_contamesa(
     cur,
     mesa_table: str,
@@ -1199,8 +1502,9 @@ def handle_uniplus_job(db_module, conteudo: Dict[str, Any]) -> Dict[str, Any]:
     now = datetime.now(timezone.utc)
     protocol_key = str(protocol)[:40]
 
-    conn = _connect(cfg["connection_string"])
-    try:
+    with uniplus_session().connection(
+        cfg["connection_string"], priority=PRIORITY_ORDER, label="handle_uniplus_job"
+    ) as conn:
         with conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Lock do protocol (idempotência)
@@ -1216,6 +1520,9 @@ def handle_uniplus_job(db_module, conteudo: Dict[str, Any]) -> Dict[str, Any]:
                     )
                     return existing_result
 
+                # Produtos antes do lock da mesa: 1 consulta em vez de ~3 por item
+                produtos = _resolve_produtos(cur, cfg, itens)
+
                 cols = _table_columns(cur, mesa_table)
                 include_optional = (
                     "statusagendamento" in cols and "pautaunica" in cols
@@ -1301,6 +1608,7 @@ def handle_uniplus_job(db_module, conteudo: Dict[str, Any]) -> Dict[str, Any]:
 
                         # Schema sem colunas opcionais (se detection falhou)
                         if include_optional and _is_undefined_column_error(exc):
+                            invalidate_schema_cache()
                             logger.warning(
                                 "UniPlus: INSERT falhou por coluna ausente (%s). "
                                 "Retentando sem statusagendamento/pautaunica.",
@@ -1363,16 +1671,10 @@ def handle_uniplus_job(db_module, conteudo: Dict[str, Any]) -> Dict[str, Any]:
                 hora_abert = contamesa.get("horaabertura") or now.isoformat()
 
                 inserted_items = []
-                for item in itens:
+                rows = []
+                for item, (idproduto, codigo_resolvido, id_un) in zip(itens, produtos):
                     codigo = str(item.get("codigoproduto") or "").strip()
                     nome = str(item.get("nomeproduto") or "")[:120]
-                    if not codigo and not nome:
-                        raise UniplusPermanentError(
-                            "ERR_UNIPLUS_PAYLOAD: Item sem codigoproduto/nomeproduto"
-                        )
-                    idproduto, codigo_resolvido = _resolve_produto_id(
-                        cur, cfg, codigo, nome
-                    )
                     codigo = str(codigo_resolvido or codigo).strip()
                     if not codigo:
                         raise UniplusPermanentError(
@@ -1383,13 +1685,7 @@ def handle_uniplus_job(db_module, conteudo: Dict[str, Any]) -> Dict[str, Any]:
                     valortotal = float(item.get("valortotal") or (precounitario * qty))
                     # contamesitem_uk1 UNIQUE(hash) — hash vazio/espaço colide no Unichef
                     item_hash = _pad_hash(str(item.get("hash") or ""))
-                    id_un = _fetch_produto_unidademedida(
-                        cur, cfg["produto_table"], cfg["produto_id_column"], idproduto
-                    )
-                    _insert_contamesaitem(
-                        cur,
-                        item_table,
-                        item_cols,
+                    rows.append(_contamesaitem_row(
                         conta_id=conta_id,
                         numeromesa=numeromesa,
                         idproduto=idproduto,
@@ -1406,7 +1702,7 @@ def handle_uniplus_job(db_module, conteudo: Dict[str, Any]) -> Dict[str, Any]:
                         now=now,
                         idunidademedida=id_un,
                         cnpjfilial=cnpjfilial,
-                    )
+                    ))
                     inserted_items.append(
                         {
                             "codigo": codigo[:20],
@@ -1419,6 +1715,9 @@ def handle_uniplus_job(db_module, conteudo: Dict[str, Any]) -> Dict[str, Any]:
                             "hash": item_hash if "hash" in item_cols else None,
                         }
                     )
+                item_ids = _insert_contamesaitens(cur, item_table, item_cols, rows)
+                for entry, item_id in zip(inserted_items, item_ids):
+                    entry["id"] = item_id
 
                 if reused_mesa:
                     add_total = sum(float(it.get("total") or 0) for it in inserted_items)
@@ -1442,6 +1741,7 @@ def handle_uniplus_job(db_module, conteudo: Dict[str, Any]) -> Dict[str, Any]:
                     len(inserted_items),
                     summary.get("valortotal"),
                 )
+                # Commit antes de invalidar: a próxima leitura das mesas já vê a conta
+                conn.commit()
+                invalidate_open_contas()
                 return result
-    finally:
-        conn.close()
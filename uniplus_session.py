@@ -0,0 +1,271 @@
+"""Sessão única com o Postgres do UniPlus.
+
+O Unico não tolera sessões concorrentes do agente: todo acesso (jobs, POS, painel,
+sync de produtos) pega emprestada a MESMA conexão, um de cada vez, na ordem de
+prioridade (gravação de pedido antes de leitura de painel). A conexão fica aberta
+entre os pedidos, é testada antes do uso quando ficou ociosa e é refeita se caiu.
+"""
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+import db
+
+# Prioridade (menor primeiro) e espera máxima na fila de cada uma
+PRIORITY_ORDER = 0  # INSERT de pedido (uniplus_job / POS)
+PRIORITY_UPDATE = 1  # alterações pontuais (entregue, nome do cliente)
+PRIORITY_READ = 2  # painel / POS consultando contas
+PRIORITY_SYNC = 3  # sync de produtos (lote, pode esperar)
+PRIORITY_NAMES = {
+    PRIORITY_ORDER: "order",
+    PRIORITY_UPDATE: "update",
+    PRIORITY_READ: "read",
+    PRIORITY_SYNC: "sync",
+}
+UNIPLUS_QUEUE_DEADLINE_SEC = {
+    PRIORITY_ORDER: 30.0,
+    PRIORITY_UPDATE: 15.0,
+    PRIORITY_READ: 8.0,
+    PRIORITY_SYNC: 60.0,
+}
+# Ociosa há mais que isso: SELECT 1 antes de entregar (servidor pode ter derrubado)
+UNIPLUS_HEALTHCHECK_IDLE_SEC = 30.0
+# Ociosa há mais que isso: fecha (reabre no próximo pedido)
+UNIPLUS_SESSION_IDLE_CLOSE_SEC = 600.0
+UNIPLUS_SESSION_SAMPLES = 500
+
+
+class UniplusBusyError(RuntimeError):
+    """Pedido não conseguiu a sessão UniPlus dentro do prazo (fila travada)."""
+
+
+class _Waiter:
+    __slots__ = ("priority", "label", "queued_at")
+
+    def __init__(self, priority: int, label: str):
+        self.priority = priority
+        self.label = label
+        self.queued_at = time.monotonic()
+
+
+def _pct(samples, q: float) -> Optional[int]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return int(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000)
+
+
+class UniplusSession:
+    """Uma conexão, emprestada por vez a quem tiver maior prioridade na fila."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queue: list = []  # heap (prioridade, seq, _Waiter)
+        self._seq = itertools.count()
+        self._owner: Optional[int] = None
+        self._holder: Optional[_Waiter] = None
+        self._conn = None
+        self._dsn = ""
+        self._stale = False
+        self._last_used = 0.0
+        self._reaper: Optional[threading.Thread] = None
+        self._error_hooks: List[Callable[[BaseException], None]] = []
+        self.connects = 0
+        self.healthcheck_failures = 0
+        self.broken = 0
+        self.busy_timeouts = 0
+        self.errors = 0
+        self.by_priority: Dict[str, int] = {}
+        self._wait_samples: deque = deque(maxlen=UNIPLUS_SESSION_SAMPLES)
+        self._hold_samples: deque = deque(maxlen=UNIPLUS_SESSION_SAMPLES)
+
+    @contextmanager
+    def connection(self, dsn: str, *, priority: int = PRIORITY_READ, label: str = "",
+                   deadline: Optional[float] = None):
+        """
+        Empresta a conexão (abre/testa/reabre se preciso). Levanta UniplusBusyError se
+        a vez não chegar em `deadline` segundos. Reentrante na mesma thread.
+        """
+        if self._owner == threading.get_ident():
+            yield self._conn
+            return
+        waiter = self._acquire(priority, label, UNIPLUS_QUEUE_DEADLINE_SEC.get(priority, 15.0)
+                               if deadline is None else deadline)
+        started = time.monotonic()
+        conn = None
+        failed = False
+        try:
+            conn = self._ready_connection(dsn)
+            yield conn
+        except BaseException as exc:
+            failed = True
+            for hook in list(self._error_hooks):
+                try:
+                    hook(exc)
+                except Exception as e:
+                    print(f"[WARN] UniPlus: hook de erro falhou: {e}")
+            raise
+        finally:
+            self._release(waiter, conn, started, failed)
+
+    def on_error(self, callback: Callable[[BaseException], None]):
+        """callback(exceção) para erros levantados dentro de connection()."""
+        self._error_hooks.append(callback)
+
+    def invalidate(self):
+        """DSN/config mudou: a conexão atual é fechada antes do próximo uso."""
+        with self._cond:
+            self._stale = True
+            if self._owner is None:
+                self._close_locked()
+
+    def close(self):
+        with self._cond:
+            self._close_locked()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            now = time.monotonic()
+            return {
+                "connected": self._conn is not None and not self._conn.closed,
+                "connects": self.connects,
+                "reconnects": max(0, self.connects - 1),
+                "healthcheck_failures": self.healthcheck_failures,
+                "broken": self.broken,
+                "busy_timeouts": self.busy_timeouts,
+                "errors": self.errors,
+                "queue": len(self._queue),
+                "busy": self._holder.label if self._holder else None,
+                "idle_sec": int(now - self._last_used) if self._last_used and self._holder is None else None,
+                "by_priority": dict(self.by_priority),
+                "wait_p50_ms": _pct(self._wait_samples, 0.5),
+                "wait_p95_ms": _pct(self._wait_samples, 0.95),
+                "hold_p50_ms": _pct(self._hold_samples, 0.5),
+                "hold_p95_ms": _pct(self._hold_samples, 0.95),
+            }
+
+    # --- internos ------------------------------------------------------
+
+    def _acquire(self, priority: int, label: str, deadline: float) -> _Waiter:
+        waiter = _Waiter(priority, label)
+        end = waiter.queued_at + max(0.0, deadline)
+        entry = (priority, next(self._seq), waiter)
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            try:
+                while self._owner is not None or self._queue[0][2] is not waiter:
+                    remaining = end - time.monotonic()
+                    if remaining <= 0:
+                        self.busy_timeouts += 1
+                        busy = self._holder.label if self._holder else "?"
+                        raise UniplusBusyError(
+                            f"ERR_UNIPLUS_BUSY: sessão UniPlus ocupada ({busy}) há mais de {deadline:g}s"
+                        )
+                    self._cond.wait(remaining)
+            except BaseException:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._queue)
+            self._owner = threading.get_ident()
+            self._holder = waiter
+            name = PRIORITY_NAMES.get(priority, str(priority))
+            self.by_priority[name] = self.by_priority.get(name, 0) + 1
+            self._wait_samples.append(time.monotonic() - waiter.queued_at)
+        return waiter
+
+    def _release(self, waiter: _Waiter, conn, started: float, failed: bool):
+        if conn is not None:
+            try:
+                # Leitura também abre transação no psycopg2: não deixar "idle in transaction"
+                if not conn.closed:
+                    conn.rollback()
+            except Exception:
+                failed = True
+        with self._cond:
+            self._hold_samples.append(time.monotonic() - started)
+            self._last_used = time.monotonic()
+            if failed:
+                self.errors += 1
+            if conn is not None and conn.closed:
+                # Caiu no meio do pedido: o próximo reabre
+                self.broken += 1
+                self._conn = None
+            if self._stale:
+                self._close_locked()
+            self._owner = None
+            self._holder = None
+            self._cond.notify_all()
+
+    def _ready_connection(self, dsn: str):
+        """Chamar com a vez (sem _cond): conexão aberta, testada se ociosa."""
+        conn = self._conn
+        if conn is not None and (conn.closed or dsn != self._dsn or self._stale):
+            self.close()
+            conn = None
+        if conn is not None and time.monotonic() - self._last_used > UNIPLUS_HEALTHCHECK_IDLE_SEC:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except Exception as e:
+                print(f"[WARN] UniPlus: sessão ociosa caiu ({e}); reconectando")
+                self.healthcheck_failures += 1
+                self.close()
+                conn = None
+        if conn is None:
+            from uniplus_handler import _connect
+
+            conn = _connect(dsn)
+            with self._cond:
+                self._conn = conn
+                self._dsn = dsn
+                self._stale = False
+                self.connects += 1
+                if self._reaper is None:
+                    self._reaper = threading.Thread(target=self._reap, name="uniplus-session-reaper", daemon=True)
+                    self._reaper.start()
+        return conn
+
+    def _close_locked(self):
+        conn, self._conn = self._conn, None
+        self._stale = False
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _reap(self):
+        """Fecha a sessão esquecida (fora do expediente não segura conexão no Unico)."""
+        while True:
+            time.sleep(UNIPLUS_SESSION_IDLE_CLOSE_SEC / 4)
+            with self._cond:
+                if (
+                    self._conn is not None
+                    and self._owner is None
+                    and time.monotonic() - self._last_used > UNIPLUS_SESSION_IDLE_CLOSE_SEC
+                ):
+                    self._close_locked()
+
+
+_session = UniplusSession()
+db.subscribe_config(
+    lambda _changes: _session.invalidate(),
+    keys=("uniplus_connection_string", "uniplus_enabled"),
+)
+
+
+def uniplus_session() -> UniplusSession:
+    return _session
+
+
+def uniplus_session_stats() -> Dict[str, Any]:
+    return _session.stats()